@@ -0,0 +1,454 @@
+"""
+Compact, single-file packages of the available atlases.
+
+A package holds an atlas' labels in the smallest unsigned integer type that
+fits them (uint16 for all the shipped atlases), its NIfTI header, a lookup
+table of its regions (ids, voxel counts, bounding boxes and names) and its
+description table, so that consumers load all of them in a single read
+instead of decoding the NIfTI image and re-parsing the CSV description.
+
+Packages are built on first use, next to the atlas they describe (or in the
+user's cache directory if the atlas' directory is read-only), and rebuilt
+whenever the atlas or its description changes. The labels are only read from
+a package when they are used.
+"""
+
+import hashlib
+import io
+import os
+import warnings
+from functools import partial
+from pathlib import Path
+from typing import Callable, ClassVar, List, Optional, Union
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+
+from neuroflow.atlases.voxel_index import VoxelIndex
+from neuroflow.files_mapper.utils import file_signature
+from neuroflow.images import ImageLoader
+
+# FSL's output datatypes for label images, by the largest label they hold
+FSL_LABEL_DATATYPES = [
+    (np.iinfo(np.uint8).max, "char"),
+    (np.iinfo(np.int16).max, "short"),
+]
+
+
+def smallest_label_dtype(max_label: int) -> np.dtype:
+    """
+    Find the smallest NIfTI integer type that holds the labels of an atlas.
+
+    Parameters
+    ----------
+    max_label : int
+        The atlas' largest label.
+
+    Returns
+    -------
+    np.dtype
+        uint8, uint16 or int32.
+    """
+    for dtype in [np.uint8, np.uint16]:
+        if max_label <= np.iinfo(dtype).max:
+            return np.dtype(dtype)
+    return np.dtype(np.int32)
+
+
+def fsl_label_datatype(max_label: Optional[int] = None) -> str:
+    """
+    Find the smallest FSL output datatype that holds the labels of an atlas.
+
+    Parameters
+    ----------
+    max_label : Optional[int], optional
+        The atlas' largest label, by default unknown.
+
+    Returns
+    -------
+    str
+        "char", "short" or "int".
+    """
+    if max_label is not None:
+        for largest, datatype in FSL_LABEL_DATATYPES:
+            if max_label <= largest:
+                return datatype
+    return "int"
+
+
+def user_cache_directory() -> Path:
+    """
+    Get the directory of the packages that cannot be written next to their
+    atlas.
+
+    Returns
+    -------
+    Path
+        ``$XDG_CACHE_HOME/neuroflow/atlases`` (by default under
+        ``~/.cache``).
+    """
+    cache_home = os.environ.get("XDG_CACHE_HOME") or Path.home() / ".cache"
+    return Path(cache_home) / "neuroflow" / "atlases"
+
+
+class AtlasPackage:
+    """
+    An atlas' labels, regions lookup table and description, stored together.
+    """
+
+    SUFFIX: ClassVar = "package.npz"
+    VERSION: ClassVar = 1
+    LUT_KEYS: ClassVar = ["regions", "counts", "bboxes", "names"]
+    SOURCE_KEYS: ClassVar = ["nifti", "description_file"]
+    DESCRIPTION_PREFIX: ClassVar = "description__"
+    NULL_PREFIX: ClassVar = "null__"
+
+    def __init__(
+        self,
+        labels: Union[np.ndarray, Callable[[], np.ndarray]],
+        header: nib.Nifti1Header,
+        regions: np.ndarray,
+        counts: np.ndarray,
+        bboxes: np.ndarray,
+        names: np.ndarray,
+        description: pd.DataFrame,
+    ):
+        """
+        Initialize the AtlasPackage class.
+
+        Parameters
+        ----------
+        labels : Union[np.ndarray, Callable[[], np.ndarray]]
+            The atlas' labels, or a function reading them on first use.
+        header : nib.Nifti1Header
+            The atlas' NIfTI header.
+        regions : np.ndarray
+            Ids of the regions listed in the atlas' description.
+        counts : np.ndarray
+            Number of voxels of each region.
+        bboxes : np.ndarray
+            A (n_regions, 3, 2) array with the bounding box of each region.
+        names : np.ndarray
+            Name of each region.
+        description : pd.DataFrame
+            The atlas' description table.
+        """
+        self._labels = labels
+        self.header = header
+        self.regions = regions
+        self.counts = counts
+        self.bboxes = bboxes
+        self.names = names
+        self.description = description
+
+    @classmethod
+    def build(cls, atlas_entities: dict) -> "AtlasPackage":
+        """
+        Build the package of an atlas from its NIfTI image and description.
+
+        Parameters
+        ----------
+        atlas_entities : dict
+            Entities of the atlas (see ``AVAILABLE_ATLASES``).
+
+        Returns
+        -------
+        AtlasPackage
+            The atlas' package.
+        """
+        loader = ImageLoader()
+        image = loader.load(atlas_entities["nifti"])
+        labels = np.asarray(loader.load_labels(image))
+        labels = labels.astype(smallest_label_dtype(labels.max(initial=0)))
+        description = pd.read_csv(
+            atlas_entities["description_file"], index_col=atlas_entities["index_col"]
+        )
+        regions = description[atlas_entities["region_col"]].to_numpy(dtype=np.int64)
+        voxel_index = VoxelIndex.from_image(nib.Nifti1Image(labels, image.affine))
+        bounds = voxel_index.region_bounds(regions)
+        positions = np.searchsorted(voxel_index.labels, regions)
+        bboxes = np.zeros((len(regions), 3, 2), dtype=np.int64)
+        found = bounds[:, 1] > bounds[:, 0]
+        bboxes[found] = voxel_index.label_bboxes[positions[found]]
+        name_col = atlas_entities.get("name_col")
+        names = (
+            description[name_col].astype(str).to_numpy(dtype=str)
+            if name_col is not None
+            else regions.astype(str)
+        )
+        header = image.header.copy()
+        header.set_data_dtype(labels.dtype)
+        return cls(
+            labels=labels,
+            header=header,
+            regions=regions,
+            counts=np.diff(bounds, axis=1).ravel(),
+            bboxes=bboxes,
+            names=names,
+            description=description,
+        )
+
+    @classmethod
+    def package_path(cls, atlas: Union[str, Path]) -> Path:
+        """
+        Get the path of the package of an atlas.
+
+        Parameters
+        ----------
+        atlas : Union[str, Path]
+            Path to the atlas image.
+
+        Returns
+        -------
+        Path
+            Path to the package, next to the atlas.
+        """
+        atlas = Path(atlas)
+        base = atlas.name.removesuffix(".gz").removesuffix(".nii")
+        return atlas.parent / f"{base.removesuffix('_dseg')}_{cls.SUFFIX}"
+
+    @classmethod
+    def sources_signature(cls, atlas_entities: dict) -> np.ndarray:
+        """
+        Describe the files a package is built from, by their sizes and
+        modification times.
+        """
+        signature = []
+        for key in cls.SOURCE_KEYS:
+            stat = file_signature(atlas_entities[key], hash_content=False)
+            signature += [stat["size"], stat["mtime"]]
+        return np.array(signature, dtype=np.int64)
+
+    @classmethod
+    def candidate_paths(cls, path: Union[str, Path]) -> List[Path]:
+        """
+        List the locations of a package: next to its atlas, then in the user's
+        cache directory (see :func:`user_cache_directory`).
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            Path to the package, next to its atlas.
+
+        Returns
+        -------
+        List[Path]
+            The package's possible paths, in order of preference.
+        """
+        path = Path(path).absolute()
+        directory = hashlib.sha256(str(path.parent).encode()).hexdigest()[:16]
+        return [path, user_cache_directory() / directory / path.name]
+
+    @classmethod
+    def find(cls, atlas_entities: dict) -> Optional["AtlasPackage"]:
+        """
+        Load the package of an atlas, if one was built from the atlas' current
+        files.
+
+        Parameters
+        ----------
+        atlas_entities : dict
+            Entities of the atlas (see ``AVAILABLE_ATLASES``), whose "nifti"
+            is the MNI152 atlas.
+
+        Returns
+        -------
+        Optional[AtlasPackage]
+            The atlas' package, or None if it is missing or outdated.
+        """
+        path = atlas_entities.get("package", cls.package_path(atlas_entities["nifti"]))
+        signature = cls.sources_signature(atlas_entities)
+        for candidate in cls.candidate_paths(path):
+            if candidate.exists():
+                package = cls.load(candidate, signature)
+                if package is not None:
+                    return package
+        return None
+
+    @classmethod
+    def from_entities(cls, atlas_entities: dict, force: bool = False) -> "AtlasPackage":
+        """
+        Load the package of an atlas, building it if it is missing or was
+        built from different files. Packages that cannot be written next to
+        their atlas are written to the user's cache directory.
+
+        Parameters
+        ----------
+        atlas_entities : dict
+            Entities of the atlas (see ``AVAILABLE_ATLASES``), whose "nifti"
+            is the MNI152 atlas.
+        force : bool, optional
+            Force the generation of the package, by default False
+
+        Returns
+        -------
+        AtlasPackage
+            The atlas' package.
+        """
+        if not force:
+            package = cls.find(atlas_entities)
+            if package is not None:
+                return package
+        path = atlas_entities.get("package", cls.package_path(atlas_entities["nifti"]))
+        package = cls.build(atlas_entities)
+        signature = cls.sources_signature(atlas_entities)
+        path, fallback = cls.candidate_paths(path)
+        if not package.save(path, signature):
+            warnings.warn(
+                f"Cannot write the atlas package {path}; "
+                f"writing it to {fallback} instead."
+            )
+            fallback.parent.mkdir(parents=True, exist_ok=True)
+            package.save(fallback, signature)
+        return package
+
+    @classmethod
+    def load(
+        cls, path: Union[str, Path], signature: Optional[np.ndarray] = None
+    ) -> Optional["AtlasPackage"]:
+        """
+        Load a package.
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            Path to the package.
+        signature : Optional[np.ndarray], optional
+            Signature of the atlas' files (see :meth:`sources_signature`) the
+            package must have been built from, by default unchecked.
+
+        Returns
+        -------
+        Optional[AtlasPackage]
+            The atlas' package, or None if it was written by another version
+            or built from other files.
+        """
+        package, stored = cls._load(Path(path))
+        if signature is not None and not np.array_equal(stored, signature):
+            return None
+        return package
+
+    @classmethod
+    def _load(cls, path: Path):
+        """
+        Load a package (except its labels, read on first use) and the
+        signature of the files it was built from, or (None, None) if it was
+        written by another version.
+        """
+        with np.load(path) as stored:
+            if stored["version"].item() != cls.VERSION:
+                return None, None
+            header = nib.Nifti1Header.from_fileobj(
+                io.BytesIO(stored["header"].tobytes())
+            )
+            columns = {}
+            for key in stored["description_columns"]:
+                column = stored[cls.DESCRIPTION_PREFIX + key]
+                null_key = cls.NULL_PREFIX + key
+                if null_key in stored:
+                    column = column.astype(object)
+                    column[stored[null_key]] = np.nan
+                columns[key] = column
+            index = pd.Index(
+                stored["description_index"],
+                name=stored["description_index_name"].item() or None,
+            )
+            description = pd.DataFrame(columns, index=index)
+            package = cls(
+                labels=partial(cls._read, path, "labels"),
+                header=header,
+                description=description,
+                **{key: stored[key] for key in cls.LUT_KEYS},
+            )
+            return package, stored["signature"]
+
+    @staticmethod
+    def _read(path: Path, key: str) -> np.ndarray:
+        """
+        Read a single array of a package.
+        """
+        with np.load(path) as stored:
+            return stored[key]
+
+    def save(self, path: Union[str, Path], signature: np.ndarray) -> bool:
+        """
+        Save the package, alongside the signature of the files it was built
+        from.
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            Path to the package.
+        signature : np.ndarray
+            Signature of the atlas' files (see :meth:`sources_signature`).
+
+        Returns
+        -------
+        bool
+            Whether the package was written (read-only locations are not).
+        """
+        path = Path(path)
+        description = {}
+        for key, column in self.description.items():
+            values = column.to_numpy()
+            if values.dtype == object:
+                nulls = column.isna().to_numpy()
+                if nulls.any():
+                    description[self.NULL_PREFIX + key] = nulls
+                values = column.where(~nulls, "").astype(str).to_numpy(dtype=str)
+            description[self.DESCRIPTION_PREFIX + key] = values
+        header = io.BytesIO()
+        self.header.write_to(header)
+        tmp_file = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        try:
+            with Path.open(tmp_file, "wb") as f:
+                np.savez_compressed(
+                    f,
+                    labels=self.labels,
+                    header=np.frombuffer(header.getvalue(), dtype=np.uint8),
+                    description_columns=np.array(
+                        list(self.description.columns), dtype=str
+                    ),
+                    description_index=self.description.index.to_numpy(),
+                    description_index_name=np.array(self.description.index.name or ""),
+                    version=np.array(self.VERSION),
+                    signature=signature,
+                    **{key: getattr(self, key) for key in self.LUT_KEYS},
+                    **description,
+                )
+            tmp_file.replace(path)
+        except OSError:
+            if tmp_file.exists():
+                tmp_file.unlink()
+            return False
+        return True
+
+    @property
+    def labels(self) -> np.ndarray:
+        """
+        The atlas' labels, read from the package on first use.
+        """
+        if callable(self._labels):
+            self._labels = self._labels()
+        return self._labels
+
+    def to_image(self) -> nib.Nifti1Image:
+        """
+        The atlas as a NIfTI image, with its compact labels.
+
+        Returns
+        -------
+        nib.Nifti1Image
+            The atlas image.
+        """
+        return nib.Nifti1Image(
+            self.labels, self.header.get_best_affine(), header=self.header
+        )
+
+    @property
+    def max_label(self) -> int:
+        """
+        The atlas' largest label.
+        """
+        return int(self.labels.max(initial=0))
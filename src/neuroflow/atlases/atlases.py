@@ -3,16 +3,24 @@ Registrations of atlases to subject's diffusion space.
 """
 
 import copy
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property
 from pathlib import Path
-from typing import ClassVar, Optional, Union
+from typing import Callable, ClassVar, Optional, Tuple, Union
 
 from nipype.interfaces import ants, fsl
 
+from neuroflow.atlases.atlas_package import AtlasPackage, fsl_label_datatype
 from neuroflow.atlases.available_atlases.available_atlases import AVAILABLE_ATLASES
+from neuroflow.atlases.qc import QCManifest, QCRenderer
+from neuroflow.atlases.qc_metrics import RegistrationMetrics
+from neuroflow.atlases.registration_state import RegistrationState
+from neuroflow.atlases.sampling_map import SamplingMap
+from neuroflow.atlases.subject_cache import SubjectRegistrationCache
 from neuroflow.atlases.utils import (
     generate_gm_mask_from_5tt,
     generate_gm_mask_from_smriprep,
-    qc_atlas_registration,
+    thread_environment,
 )
 from neuroflow.files_mapper.files_mapper import FilesMapper
 from neuroflow.structural.smriprep_runner import SMRIPrepRunner
@@ -28,6 +36,8 @@ class Atlases:
         "sub-{subject}_ses-{session}_space-{space}_label-{label}_{atlas}"
     )
 
+    RESAMPLING_METHODS: ClassVar = ["native", "fsl"]
+
     DIRECTORY_NAME: ClassVar = "atlases"
 
     def __init__(
@@ -38,6 +48,10 @@ class Atlases:
         crop_to_gm: Optional[bool] = True,
         use_smriprep: Optional[bool] = False,
         smriprep_runner: Optional[SMRIPrepRunner] = None,
+        nthreads: int = 1,
+        resampling: str = "native",
+        qc: str = "background",
+        reuse_subject_atlases: bool = True,
     ):
         """
         Initialize the Atlases class.
@@ -50,15 +64,69 @@ class Atlases:
             Path to the output directory.
         atlases : Optional[Union[str, list]]
             Atlases to register.
-
+        nthreads : int
+            Thread budget of the registrations, shared between concurrently
+            registered atlases, by default 1 (serial).
+        resampling : str
+            Either "native", to resample the atlases in-process through a
+            sampling map computed once per session (see :class:`SamplingMap`),
+            or "fsl", to run FSL's tools for each atlas, by default "native".
+            Transforms the native resampler does not support (sMRIPrep's
+            transforms and FNIRT coefficient fields) always use FSL/ANTs.
+        qc : str
+            How the registrations' QC images are rendered (see
+            :class:`QCRenderer`): "background" (in a single background
+            process, waited for by :meth:`QCRenderer.wait` or at exit),
+            "sync", "deferred" or "skip", by default "background", as for
+            the command line. Registrations are recorded in the
+            session's QC manifest (unless skipped), and their numeric QC
+            metrics always written to the session's QC tables (see
+            :class:`RegistrationMetrics`).
+        reuse_subject_atlases : bool
+            Share the T1w-space atlases between the sessions of a subject
+            whose T1w inputs have the same content (see
+            :class:`SubjectRegistrationCache`), by default True.
         """
+        if resampling not in self.RESAMPLING_METHODS:
+            raise ValueError(f"Invalid resampling method: {resampling}.")
         self.mapper = mapper
         self.output_directory = self._gen_output_directory(output_directory)
         self.atlases = self._validate_atlas(atlases)
         self.crop_to_gm = crop_to_gm
+        self.nthreads = nthreads
+        self.resampling = resampling
+        self._sampling_map = (None, None)
+        self._gm_mask = (None, None)
+        self._packages = None
+        self._variants = {}
+        # natively resampled atlases, kept for their QC metrics
+        self._resampled = {}
+        # the atlas each registration's input file holds
+        self._job_atlases = {}
         self.use_smriprep, self.smriprep_runner = self._validate_smriprep(
             use_smriprep, smriprep_runner
         )
+        self.registrations = RegistrationState()
+        self.qc_renderer = QCRenderer(
+            QCManifest(
+                self.output_directory
+                / QCManifest.TEMPLATE.format(
+                    subject=self.mapper.subject, session=self.mapper.session
+                )
+            ),
+            mode=qc,
+        )
+        self.qc_metrics = RegistrationMetrics(
+            self.output_directory, self.mapper.subject, self.mapper.session
+        )
+        self.subject_cache = (
+            SubjectRegistrationCache(
+                self.output_directory.parent.parent
+                / SubjectRegistrationCache.DIRECTORY_NAME
+            )
+            if reuse_subject_atlases
+            else None
+        )
 
     def _validate_smriprep(self, use_smriprep: bool, smriprep_runner: SMRIPrepRunner):
         """
@@ -129,6 +197,36 @@ class Atlases:
                 raise ValueError(f"Atlas {atlas} is not available.")
         return {atlas: self.ATLASES[atlas] for atlas in atlases}
 
+    @property
+    def packages(self) -> dict:
+        """
+        The compact packages of the atlases (see :class:`AtlasPackage`),
+        built on first use and loaded once.
+        """
+        if self._packages is None:
+            self._packages = {
+                atlas: AtlasPackage.from_entities(atlas_entities)
+                for atlas, atlas_entities in self.atlases.items()
+                if "package" in atlas_entities
+            }
+        return self._packages
+
+    def _source_package(self, in_file: Union[str, Path]) -> Optional[AtlasPackage]:
+        """
+        Get the package of the atlas a registration's input file holds.
+
+        Parameters
+        ----------
+        in_file : Union[str, Path]
+            Input file of a registration.
+
+        Returns
+        -------
+        Optional[AtlasPackage]
+            The atlas' package, if it has one.
+        """
+        return self.packages.get(self._job_atlases.get(str(in_file)))
+
     def generate_gm_mask(self, force: bool = False) -> Path:
         """
         Generate a grey matter mask.
@@ -147,52 +245,346 @@ class Atlases:
             self.output_directory
             / f"sub-{self.mapper.subject}_ses-{self.mapper.session}_space-T1w_label-GM_mask.nii.gz"  # noqa: E501
         )
+        if self.use_smriprep:
+            source = self.smriprep_runner.outputs.get("smriprep").get("probseg_gm")
+            generate = generate_gm_mask_from_smriprep
+        else:
+            source = self.mapper.files.get("t1w_5tt")
+            generate = generate_gm_mask_from_5tt
+        # the mask is evaluated once per session, until its source changes
+        signature = RegistrationState.signature({"source": Path(source)})
+        if not force and self._gm_mask[0] == signature and gm_mask.exists():
+            return gm_mask
         if gm_mask.exists() and not force:
             print(f"Grey matter mask {gm_mask} already exists.")
-            return gm_mask
-        if not gm_mask.exists():
-            if self.use_smriprep:
-                gm_probseg = self.smriprep_runner.outputs.get("smriprep").get(
-                    "probseg_gm"
-                )
-                generate_gm_mask_from_smriprep(gm_probseg, gm_mask, force=force)
-            else:
-                generate_gm_mask_from_5tt(
-                    self.mapper.files.get("t1w_5tt"), gm_mask, force=force
-                )
+        else:
+            generate(source, gm_mask, force=force)
+        self._gm_mask = (signature, gm_mask)
         return gm_mask
 
-    def register_atlas_to_t1w(self, force: bool = False):
+    def _registration_inputs(self, space: str, t1w_atlases: dict = None) -> dict:
         """
-        Register an atlas to the subject's T1w space.
+        Collect the inputs the atlases' registration to a space depends on.
+
+        Parameters
+        ----------
+        space : str
+            Either "T1w" or "dwi".
+        t1w_atlases : dict, optional
+            The atlases registered to the T1w space, if the diffusion space
+            atlases are registered from them.
+
+        Returns
+        -------
+        dict
+            Inputs of the registration.
+        """
+        inputs = {
+            "atlases": {
+                atlas: Path(atlas_entities["nifti"])
+                for atlas, atlas_entities in self.atlases.items()
+            },
+            "label": self.label,
+            "use_smriprep": self.use_smriprep,
+            "resampling": self.resampling,
+        }
+        files = self.mapper.files
+        if space == "dwi":
+            if t1w_atlases is None:
+                # registered directly, through the T1w space's transforms
+                inputs.update(self._registration_inputs("T1w"))
+            else:
+                inputs["t1w_atlases"] = {
+                    atlas: Path(atlas_entities["nifti"])
+                    for atlas, atlas_entities in t1w_atlases.items()
+                }
+            inputs["b0_brain"] = files.get("b0_brain")
+            inputs["t1w_to_dwi_mat"] = files.get("t1w_to_dwi_mat")
+            return inputs
+        inputs["t1w_brain"] = files.get("t1w_brain")
+        if self.use_smriprep:
+            inputs["smriprep"] = self.smriprep_runner.outputs.get("smriprep")
+        else:
+            inputs["template_to_t1w_warp"] = files.get("template_to_t1w_warp")
+            inputs["t1w_brain_mask"] = files.get("t1w_brain_mask")
+            inputs["t1w_5tt"] = files.get("t1w_5tt")
+        return inputs
+
+    def _subject_cache_inputs(self) -> dict:
+        """
+        Collect the inputs whose content the T1w-space atlases depend on,
+        regardless of the session they belong to.
+
+        Returns
+        -------
+        dict
+            Inputs of the T1w registrations.
+        """
+
+        def as_path(value):
+            return Path(value) if value else None
+
+        inputs = {
+            "label": self.label,
+            "use_smriprep": self.use_smriprep,
+            "resampling": self.resampling,
+        }
+        if self.use_smriprep:
+            smriprep = self.smriprep_runner.outputs.get("smriprep")
+            inputs["t1w"] = as_path(smriprep.get("preprocessed_T1w"))
+            inputs["transform"] = as_path(smriprep.get("mni_to_native_transform"))
+            inputs["mask"] = as_path(smriprep.get("probseg_gm"))
+        else:
+            files = self.mapper.files
+            inputs["t1w"] = as_path(files.get("t1w_brain"))
+            inputs["transform"] = as_path(files.get("template_to_t1w_warp"))
+            inputs["mask"] = as_path(
+                files.get("t1w_5tt") if self.crop_to_gm else files.get("t1w_brain_mask")
+            )
+        return inputs
+
+    def _subject_cache_name(self, atlas: str, out_file: Path) -> str:
+        """
+        Name a T1w-space atlas in the subject's cache, after the content of
+        the MNI152 atlas it was registered from.
+        """
+        atlas_hash = self.subject_cache.content_hash(self.atlases[atlas]["nifti"])
+        name = out_file.name.replace(f"_ses-{self.mapper.session}", "")
+        return f"{atlas_hash[:16]}_{name}"
+
+    def _reuse_subject_registrations(self, jobs: dict, force: bool = False) -> dict:
+        """
+        Link the T1w-space atlases already registered for another session of
+        the subject, from inputs with the same content.
+
+        Parameters
+        ----------
+        jobs : dict
+            Input and output files of each registration, keyed by the atlas.
+        force : bool, optional
+            Register the atlases again, by default False
+
+        Returns
+        -------
+        dict
+            The registrations that are still needed.
+        """
+        if self.subject_cache is None or not jobs:
+            return jobs
+        key = self.subject_cache.content_key(self._subject_cache_inputs())
+        remaining = {}
+        for atlas, (in_file, out_file) in jobs.items():
+            name = self._subject_cache_name(atlas, out_file)
+            if force or not self.subject_cache.fetch(key, name, out_file):
+                remaining[atlas] = (in_file, out_file)
+        return remaining
+
+    def _store_subject_registrations(self, jobs: dict):
+        """
+        Store the T1w-space atlases registered for this session in the
+        subject's cache.
+
+        Parameters
+        ----------
+        jobs : dict
+            Input and output files of each registration, keyed by the atlas.
+        """
+        if self.subject_cache is None or not jobs:
+            return
+        key = self.subject_cache.content_key(self._subject_cache_inputs())
+        for atlas, (_, out_file) in jobs.items():
+            self.subject_cache.store(
+                key, self._subject_cache_name(atlas, out_file), out_file
+            )
+
+    def _thread_budget(self, n_jobs: int) -> Tuple[int, dict]:
+        """
+        Split the thread budget between concurrent registrations.
+
+        Parameters
+        ----------
+        n_jobs : int
+            Number of registrations to run.
+
+        Returns
+        -------
+        Tuple[int, dict]
+            The number of concurrent registrations, and the environment
+            variables limiting the threads each of them uses.
+        """
+        workers = max(1, min(self.nthreads, n_jobs))
+        return workers, thread_environment(max(1, self.nthreads // workers))
+
+    def _run_registrations(self, transform: Callable, jobs: dict):
+        """
+        Run independent registrations, concurrently if the thread budget
+        allows it.
+
+        Parameters
+        ----------
+        transform : Callable
+            Registration function, called with an input file, an output file
+            and the environment of the registration tool.
+        jobs : dict
+            Input and output files of each registration, keyed by the atlas.
+        """
+        workers, environ = self._thread_budget(len(jobs))
+        if workers <= 1:
+            for in_file, out_file in jobs.values():
+                transform(in_file, out_file, environ=environ)
+            return
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(transform, in_file, out_file, environ=environ)
+                for in_file, out_file in jobs.values()
+            ]
+            for future in futures:
+                future.result()
+
+    def _collect_registration_jobs(
+        self, source_atlases: dict, space: str, force: bool = False
+    ) -> Tuple[dict, dict]:
+        """
+        Build the output paths of the atlases in a space, and list the
+        registrations that are needed to generate them.
+
+        Parameters
+        ----------
+        source_atlases : dict
+            Atlases to register, whose "nifti" entries are the input images.
+        space : str
+            Either "T1w" or "dwi".
+        force : bool, optional
+            Force the registrations, by default False
+
+        Returns
+        -------
+        Tuple[dict, dict]
+            The atlases in the target space (whose "mni_nifti" entries are the
+            MNI152 atlases), and the input and output files of each needed
+            registration (once per output file).
         """
-        t1w_atlases = copy.deepcopy(self.atlases)
+        target_atlases = copy.deepcopy(self.atlases)
+        jobs, out_files = {}, set()
         for atlas, atlas_entities in self.atlases.items():
-            nifti = atlas_entities["nifti"]
-            atlas_base = Path(nifti).name.replace("space-MNI152_", "")
+            atlas_base = Path(atlas_entities["nifti"]).name.replace("space-MNI152_", "")
             out_file = self.output_directory / self.OUTPUT_TEMPLATE.format(
                 subject=self.mapper.subject,
                 session=self.mapper.session,
-                space="T1w",
+                space=space,
                 atlas=atlas_base,
                 label=self.label,
             )
-            t1w_atlases[atlas]["nifti"] = str(out_file)
+            target_atlases[atlas]["nifti"] = str(out_file)
+            target_atlases[atlas]["mni_nifti"] = atlas_entities["nifti"]
+            if out_file in out_files:
+                continue
+            out_files.add(out_file)
             if force:
                 out_file.unlink(missing_ok=True)
             if out_file.exists():
                 continue
+            jobs[atlas] = (source_atlases[atlas]["nifti"], out_file)
+            self._job_atlases[str(source_atlases[atlas]["nifti"])] = atlas
+        return target_atlases, jobs
 
-            if self.use_smriprep:
-                self.apply_h5_transform(nifti, out_file)
-            else:
-                self.apply_warp(nifti, out_file)
-            qc_atlas_registration(
-                out_file, self.mapper.files.get("t1w_brain"), atlas, "T1w", force=force
+    def _qc_registrations(
+        self,
+        jobs: dict,
+        space: str,
+        reference: Path,
+        reference_name: str,
+        force: bool = False,
+    ):
+        """
+        Compute the numeric QC metrics of the registered atlases (whatever the
+        QC mode), and hand them to the QC renderer, in the atlases' order.
+        Rendering is kept out of the registration workers, since matplotlib
+        is not thread-safe.
+
+        Parameters
+        ----------
+        jobs : dict
+            Input and output files of each registration, keyed by the atlas.
+        space : str
+            Space the atlases were registered to (e.g. "T1w" or "dwi").
+        reference : Path
+            Path to the reference image.
+        reference_name : str
+            Name of the reference image.
+        force : bool, optional
+            Force the rendering, by default False
+        """
+        if not jobs:
+            return
+        mask = self.qc_metrics.load_mask(
+            self.mapper.files.get(
+                "t1w_brain_mask" if space == "T1w" else "b0_brain_mask"
+            )
+        )
+        summaries, regions = [], []
+        for atlas, (_, out_file) in jobs.items():
+            # natively resampled atlases are still in memory
+            registered = self._resampled.pop(str(out_file), out_file)
+            summary, atlas_regions = self.qc_metrics.compute(
+                atlas,
+                space,
+                registered,
+                self.atlases[atlas]["nifti"],
+                mask=mask,
+                label=self.label,
             )
+            summaries.append(summary)
+            regions.append(atlas_regions)
+        self.qc_metrics.write(summaries, regions)
+        entries = [
+            {
+                "atlas": str(out_file),
+                "reference": str(reference),
+                "atlas_name": atlas,
+                "reference_name": reference_name,
+            }
+            for atlas, (_, out_file) in jobs.items()
+        ]
+        self.qc_renderer.submit(entries, force=force)
+
+    def register_atlas_to_t1w(self, force: bool = False):
+        """
+        Register an atlas to the subject's T1w space.
+        The registered atlases are memoized until their inputs change, and
+        shared with the subject's other sessions (see
+        :class:`SubjectRegistrationCache`).
+        """
+        inputs = self._registration_inputs("T1w")
+        if not force:
+            t1w_atlases = self.registrations.get("T1w", inputs, self.label)
+            if t1w_atlases is not None:
+                return t1w_atlases
+        t1w_atlases, jobs = self._collect_registration_jobs(self.atlases, "T1w", force)
+        registrations = self._reuse_subject_registrations(jobs, force)
+        if registrations and self.crop_to_gm:
+            # generated once, before the registrations that share it
+            self.generate_gm_mask()
+        if registrations and self.get_sampling_map() is not None:
+            transform = self.apply_sampling_map_to_t1w
+        elif self.use_smriprep:
+            transform = self.apply_h5_transform
+        else:
+            transform = self.apply_warp
+        self._run_registrations(transform, registrations)
+        self._store_subject_registrations(registrations)
+        self._qc_registrations(
+            jobs, "T1w", self.mapper.files.get("t1w_brain"), "T1w", force
+        )
+        self.registrations.set("T1w", inputs, t1w_atlases, self.label)
         return t1w_atlases
 
-    def apply_h5_transform(self, in_file: Union[str, Path], out_file: Union[str, Path]):
+    def apply_h5_transform(
+        self,
+        in_file: Union[str, Path],
+        out_file: Union[str, Path],
+        environ: Optional[dict] = None,
+    ):
         """
         Apply an h5 transformation to a file.
         """
@@ -210,6 +602,7 @@ class Atlases:
             ),
             interpolation="NearestNeighbor",
         )
+        apply_transforms.inputs.environ.update(environ or {})
         apply_transforms.run()
         if self.crop_to_gm:
             gm_mask = self.generate_gm_mask()
@@ -218,17 +611,24 @@ class Atlases:
                 mask_file=str(gm_mask),
                 out_file=str(out_file),
             )
+            apply_transforms.inputs.environ.update(environ or {})
             apply_transforms.run()
 
     def apply_warp(
         self,
         in_file: Union[str, Path],
         out_file: Union[str, Path],
+        environ: Optional[dict] = None,
     ):
         """
         Apply a warp to a file.
         """
-        aw = fsl.ApplyWarp(datatype="int", interp="nn", out_file=str(out_file))
+        package = self._source_package(in_file)
+        aw = fsl.ApplyWarp(
+            datatype=fsl_label_datatype(package.max_label if package else None),
+            interp="nn",
+            out_file=str(out_file),
+        )
         aw.inputs.in_file = in_file
         aw.inputs.ref_file = self.mapper.files.get("t1w_brain")
         aw.inputs.mask_file = (
@@ -237,43 +637,134 @@ class Atlases:
             else self.generate_gm_mask()
         )
         aw.inputs.field_file = self.mapper.files.get("template_to_t1w_warp")
+        aw.inputs.environ.update(environ or {})
         aw.run()
 
+    def apply_xfm(
+        self,
+        in_file: Union[str, Path],
+        out_file: Union[str, Path],
+        environ: Optional[dict] = None,
+    ):
+        """
+        Apply the T1w-to-DWI transformation to a file.
+        """
+        package = self._source_package(in_file)
+        apply_xfm = fsl.ApplyXFM(
+            datatype=fsl_label_datatype(package.max_label if package else None),
+            interp="nearestneighbour",
+            out_file=str(out_file),
+        )
+        apply_xfm.inputs.in_file = in_file
+        apply_xfm.inputs.reference = self.mapper.files.get("b0_brain")
+        apply_xfm.inputs.in_matrix_file = self.mapper.files.get("t1w_to_dwi_mat")
+        apply_xfm.inputs.apply_xfm = True
+        apply_xfm.inputs.environ.update(environ or {})
+        res = apply_xfm.run()
+        # clean up the intermediate file
+        Path(res.outputs.out_matrix_file).unlink()
+
+    @cached_property
+    def resamples_natively(self) -> bool:
+        """
+        Whether the atlases can be resampled in-process (False if the
+        registrations require FSL/ANTs), checked once.
+        """
+        if self.resampling != "native" or self.use_smriprep:
+            return False
+        files = self.mapper.files
+        return SamplingMap.supports(
+            files.get("template_to_t1w_warp"), files.get("t1w_brain")
+        )
+
+    def get_sampling_map(self) -> Optional[SamplingMap]:
+        """
+        Get the session's in-process sampling map, built once per inputs.
+
+        Returns
+        -------
+        Optional[SamplingMap]
+            The sampling map, or None if the registrations require FSL/ANTs.
+        """
+        if not self.resamples_natively:
+            return None
+        files = self.mapper.files
+        inputs = {
+            "warp_file": files.get("template_to_t1w_warp"),
+            "t1w_reference": files.get("t1w_brain"),
+            "t1w_mask": (
+                self.generate_gm_mask()
+                if self.crop_to_gm
+                else files.get("t1w_brain_mask")
+            ),
+            "t1w_to_dwi_mat": files.get("t1w_to_dwi_mat"),
+            "dwi_reference": files.get("b0_brain"),
+        }
+        signature = RegistrationState.signature(inputs)
+        if self._sampling_map[0] != signature:
+            self._sampling_map = (signature, SamplingMap(**inputs))
+        return self._sampling_map[1]
+
+    def apply_sampling_map_to_t1w(
+        self,
+        in_file: Union[str, Path],
+        out_file: Union[str, Path],
+        environ: Optional[dict] = None,
+    ):
+        """
+        Resample an MNI152 atlas (from its package, if it has one) to the T1w
+        space in-process.
+        """
+        package = self._source_package(in_file)
+        source = package.to_image() if package is not None else in_file
+        image = self.get_sampling_map().resample(source, "T1w")
+        image.to_filename(out_file)
+        self._resampled[str(out_file)] = image
+
+    def apply_sampling_map_to_dwi(
+        self,
+        in_file: Union[str, Path],
+        out_file: Union[str, Path],
+        environ: Optional[dict] = None,
+    ):
+        """
+        Resample an MNI152 atlas (from its package, if it has one) to the
+        diffusion space in-process.
+        """
+        package = self._source_package(in_file)
+        source = package.to_image() if package is not None else in_file
+        image = self.get_sampling_map().resample(source, "dwi")
+        image.to_filename(out_file)
+        self._resampled[str(out_file)] = image
+
     def register_atlas_to_dwi(self, force: bool = False):
         """
         Register an atlas to the subject's diffusion space.
+        When the atlases are resampled in-process, they are sampled directly
+        from the MNI152 space and no T1w-space atlas is written (unless
+        requested through :meth:`register_atlas_to_t1w`).
+        The registered atlases are memoized until their inputs change.
         """
-        dwi_atlases = copy.deepcopy(self.atlases)
-        for atlas, atlas_entities in self.atlases.items():
-            nifti = atlas_entities["nifti"]
-            in_file = self.t1w_atlases[atlas]["nifti"]
-            atlas_base = Path(nifti).name.replace("space-MNI152_", "")
-            out_file = self.output_directory / self.OUTPUT_TEMPLATE.format(
-                subject=self.mapper.subject,
-                session=self.mapper.session,
-                space="dwi",
-                atlas=atlas_base,
-                label=self.label,
-            )
-            dwi_atlases[atlas]["nifti"] = str(out_file)
-            if force:
-                out_file.unlink(missing_ok=True)
-            if out_file.exists():
-                continue
-            apply_xfm = fsl.ApplyXFM(
-                datatype="int", interp="nearestneighbour", out_file=str(out_file)
-            )
-            apply_xfm.inputs.in_file = in_file
-            apply_xfm.inputs.reference = self.mapper.files.get("b0_brain")
-            apply_xfm.inputs.in_matrix_file = self.mapper.files.get("t1w_to_dwi_mat")
-            apply_xfm.inputs.apply_xfm = True
-            res = apply_xfm.run()
-            # clean up the intermediate file
-            Path(res.outputs.out_matrix_file).unlink()
-
-            qc_atlas_registration(
-                out_file, self.mapper.files.get("b0_brain"), atlas, "DWI", force=force
-            )
+        direct = self.resamples_natively
+        t1w_atlases = None if direct else self.register_atlas_to_t1w()
+        inputs = self._registration_inputs("dwi", t1w_atlases)
+        if not force:
+            dwi_atlases = self.registrations.get("dwi", inputs, self.label)
+            if dwi_atlases is not None:
+                return dwi_atlases
+        dwi_atlases, jobs = self._collect_registration_jobs(
+            self.atlases if direct else t1w_atlases, "dwi", force
+        )
+        if direct:
+            if jobs and self.crop_to_gm:
+                self.generate_gm_mask()
+            self._run_registrations(self.apply_sampling_map_to_dwi, jobs)
+        else:
+            self._run_registrations(self.apply_xfm, jobs)
+        self._qc_registrations(
+            jobs, "dwi", self.mapper.files.get("b0_brain"), "DWI", force
+        )
+        self.registrations.set("dwi", inputs, dwi_atlases, self.label)
         return dwi_atlases
 
     @property
@@ -290,6 +781,34 @@ class Atlases:
         """
         return self.register_atlas_to_dwi()
 
+    def variant(self, crop_to_gm: bool) -> "Atlases":
+        """
+        Get the atlases manager of a label (GM-cropped or whole-brain),
+        without changing this one's. The variants share their memoized
+        registrations (keyed by label), QC renderer and caches, so each
+        label's atlases are registered at most once per session.
+
+        Parameters
+        ----------
+        crop_to_gm : bool
+            Whether the atlases are cropped to the grey matter.
+
+        Returns
+        -------
+        Atlases
+            The atlases manager of the label.
+        """
+        if crop_to_gm == self.crop_to_gm:
+            return self
+        if crop_to_gm not in self._variants:
+            variant = copy.copy(self)
+            variant.crop_to_gm = crop_to_gm
+            variant._packages = self.packages
+            variant._sampling_map = (None, None)
+            variant._variants = {self.crop_to_gm: self}
+            self._variants[crop_to_gm] = variant
+        return self._variants[crop_to_gm]
+
     @property
     def label(self):
         """
@@ -29,6 +29,9 @@ def generate_schaefer_dict() -> dict:
                 / f"schaefer2018/MNI152/space-MNI152_atlas-schaefer2018_res-1mm_den-{n_regions}_desc-{n_networks}networks_dseg.csv",
                 "region_col": "index",
                 "index_col": 0,
+                "name_col": "name",
+                "package": parent
+                / f"schaefer2018/MNI152/space-MNI152_atlas-schaefer2018_res-1mm_den-{n_regions}_desc-{n_networks}networks_package.npz",
             }
     return schaefer_dict
 
@@ -41,6 +44,9 @@ AVAILABLE_ATLASES = {
         / "fan2016/MNI152/space-MNI152_atlas-fan2016_res-1mm_dseg.csv",
         "region_col": "Label",
         "index_col": None,
+        "name_col": "FS_name",
+        "package": parent
+        / "fan2016/MNI152/space-MNI152_atlas-fan2016_res-1mm_package.npz",
     },
     "huang2022": {
         "nifti": parent
@@ -49,6 +55,9 @@ AVAILABLE_ATLASES = {
         / "huang2022/MNI152/space-MNI152_atlas-huang2022_res-1mm_dseg.csv",
         "region_col": "HCPex_label",
         "index_col": 0,
+        "name_col": "RegionName1",
+        "package": parent
+        / "huang2022/MNI152/space-MNI152_atlas-huang2022_res-1mm_package.npz",
     },
     **generate_schaefer_dict(),
 }
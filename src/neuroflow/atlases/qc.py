@@ -0,0 +1,258 @@
+"""
+Rendering of the atlas registrations' QC images, as a stage of its own.
+
+Each session's registrations are recorded in a QC manifest next to the
+registered atlases. The QC images can then be rendered right away, in a
+background process pool, or later, e.g. for a whole cohort at once (see
+:func:`render_cohort`), so that the registrations never wait for matplotlib.
+"""
+
+import atexit
+import json
+import os
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import ClassVar, List, Optional, Union
+
+from neuroflow.atlases.utils import qc_atlas_registration, qc_image_file
+
+QC_MODES = ["background", "sync", "deferred", "skip"]
+
+
+def render_entry(entry: dict, force: bool = False):
+    """
+    Render the QC image of a manifest's entry.
+
+    Parameters
+    ----------
+    entry : dict
+        The entry (see :meth:`QCManifest.add`).
+    force : bool, optional
+        Force the rendering, by default False
+    """
+    qc_atlas_registration(
+        entry["atlas"],
+        entry["reference"],
+        entry["atlas_name"],
+        entry["reference_name"],
+        force=force,
+    )
+
+
+class QCManifest:
+    """
+    The registrations of a session whose QC images are (to be) rendered.
+    """
+
+    TEMPLATE: ClassVar = "sub-{subject}_ses-{session}_QC.json"
+    PATTERN: ClassVar = "sub-*_ses-*_QC.json"
+
+    def __init__(self, path: Union[str, Path]):
+        """
+        Initialize the QCManifest class.
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            Path to the manifest.
+        """
+        self.path = Path(path)
+
+    def entries(self) -> List[dict]:
+        """
+        Read the manifest's entries.
+
+        Returns
+        -------
+        List[dict]
+            The recorded registrations, in the order they were added.
+        """
+        if not self.path.exists():
+            return []
+        with self.path.open("r") as f:
+            return json.load(f)
+
+    def add(self, entries: List[dict]):
+        """
+        Record registrations, replacing the entries of the same atlases.
+
+        Parameters
+        ----------
+        entries : List[dict]
+            Registrations, each with its "atlas" and "reference" paths, its
+            "atlas_name" and its "reference_name".
+        """
+        added = {entry["atlas"]: entry for entry in entries}
+        merged = [entry for entry in self.entries() if entry["atlas"] not in added]
+        merged += list(added.values())
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        with tmp_file.open("w") as f:
+            json.dump(merged, f, indent=2)
+        tmp_file.replace(self.path)
+
+    def pending(self, force: bool = False) -> List[dict]:
+        """
+        List the entries whose QC image is yet to be rendered.
+
+        Parameters
+        ----------
+        force : bool, optional
+            List every entry, by default False
+
+        Returns
+        -------
+        List[dict]
+            The entries to render.
+        """
+        return [
+            entry
+            for entry in self.entries()
+            if force or not qc_image_file(entry["atlas"]).exists()
+        ]
+
+
+def render_entries(entries: List[dict], nprocs: int = 1, force: bool = False):
+    """
+    Render the QC images of manifests' entries, in a process pool.
+
+    Parameters
+    ----------
+    entries : List[dict]
+        The entries to render.
+    nprocs : int, optional
+        Number of processes, by default 1 (in this process).
+    force : bool, optional
+        Force the rendering, by default False
+    """
+    if nprocs <= 1 or len(entries) <= 1:
+        for entry in entries:
+            render_entry(entry, force=force)
+        return
+    with ProcessPoolExecutor(max_workers=min(nprocs, len(entries))) as executor:
+        futures = [executor.submit(render_entry, entry, force) for entry in entries]
+        for future in futures:
+            future.result()
+
+
+def render_cohort(root: Union[str, Path], nprocs: int = 1, force: bool = False):
+    """
+    Render the pending QC images of every session under a directory.
+
+    Parameters
+    ----------
+    root : Union[str, Path]
+        NeuroFlow's output directory.
+    nprocs : int, optional
+        Number of processes, by default 1
+    force : bool, optional
+        Render the images that already exist too, by default False
+
+    Returns
+    -------
+    int
+        The number of rendered images.
+    """
+    entries = []
+    for path in sorted(Path(root).rglob(QCManifest.PATTERN)):
+        entries += QCManifest(path).pending(force=force)
+    render_entries(entries, nprocs=nprocs, force=force)
+    return len(entries)
+
+
+class QCRenderer:
+    """
+    Renders (or defers) the QC images of a session's registrations.
+
+    Background renderings are waited for (and their errors raised) by
+    :meth:`wait`, when leaving the renderer's context, or at the latest when
+    the interpreter exits.
+    """
+
+    def __init__(self, manifest: QCManifest, mode: str = "background", nprocs: int = 1):
+        """
+        Initialize the QCRenderer class.
+
+        Parameters
+        ----------
+        manifest : QCManifest
+            The session's QC manifest.
+        mode : str, optional
+            Either "background" (in a process pool, while the pipeline goes
+            on), "sync" (right away, in order), "deferred" (only recorded in
+            the manifest, see :func:`render_cohort`) or "skip",
+            by default "background".
+        nprocs : int, optional
+            Number of background processes, by default 1
+        """
+        if mode not in QC_MODES:
+            raise ValueError(f"Invalid QC mode: {mode}.")
+        self.manifest = manifest
+        self.mode = mode
+        self.nprocs = max(1, nprocs)
+        self._executor = None
+        self._futures: List[Future] = []
+
+    def submit(self, entries: List[dict], force: bool = False):
+        """
+        Record registrations and render their QC images according to the mode.
+
+        Parameters
+        ----------
+        entries : List[dict]
+            The registrations (see :meth:`QCManifest.add`).
+        force : bool, optional
+            Force the rendering, by default False
+        """
+        if not entries or self.mode == "skip":
+            return
+        self.manifest.add(entries)
+        if self.mode == "sync":
+            render_entries(entries, force=force)
+        elif self.mode == "background":
+            if self._executor is None:
+                self._executor = ProcessPoolExecutor(max_workers=self.nprocs)
+                atexit.register(self.wait)
+            self._futures += [
+                self._executor.submit(render_entry, entry, force) for entry in entries
+            ]
+
+    def wait(self, timeout: Optional[float] = None):
+        """
+        Wait for the background renderings to finish, and shut their processes
+        down.
+
+        Parameters
+        ----------
+        timeout : Optional[float], optional
+            Seconds to wait for each rendering, by default no limit.
+
+        Raises
+        ------
+        RuntimeError
+            If any rendering failed (chained to the first error).
+        """
+        futures, self._futures = self._futures, []
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            atexit.unregister(self.wait)
+        errors = []
+        try:
+            for future in futures:
+                try:
+                    future.result(timeout=timeout)
+                except Exception as error:
+                    errors.append(error)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+        if errors:
+            raise RuntimeError(
+                f"{len(errors)} QC image(s) failed to render."
+            ) from errors[0]
+
+    def __enter__(self) -> "QCRenderer":
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wait()
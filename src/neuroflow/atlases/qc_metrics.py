@@ -0,0 +1,308 @@
+"""
+Numeric QC of atlas registrations, written as small per-session tables that
+cohort tooling can scan to flag failed registrations without rendering images.
+
+For each registered atlas, the summary table holds the fraction of labelled
+voxels inside the brain mask and the number of regions lost in the
+registration, and the regions table holds each region's volume relative to
+the MNI152 atlas it was registered from.
+"""
+
+import os
+import threading
+import warnings
+from pathlib import Path
+from typing import ClassVar, Optional, Tuple, Union
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+
+from neuroflow.files_mapper.utils import file_signature
+from neuroflow.images import ImageLoader
+
+
+def label_counts(labels: np.ndarray) -> np.ndarray:
+    """
+    Count the voxels of each label.
+
+    Parameters
+    ----------
+    labels : np.ndarray
+        Label image data.
+
+    Returns
+    -------
+    np.ndarray
+        Voxel counts, indexed by label.
+    """
+    labels = np.asarray(labels).reshape(-1)
+    return np.bincount(labels[labels > 0])
+
+
+def registration_metrics(
+    labels: np.ndarray,
+    source_counts: np.ndarray,
+    voxel_volume: float,
+    source_voxel_volume: float,
+    mask: Optional[np.ndarray] = None,
+) -> Tuple[dict, pd.DataFrame]:
+    """
+    Compute the QC metrics of a registered atlas.
+
+    Parameters
+    ----------
+    labels : np.ndarray
+        The registered atlas' labels.
+    source_counts : np.ndarray
+        Voxel counts of the source (MNI152) atlas' labels.
+    voxel_volume : float
+        Volume (mm3) of the registered atlas' voxels.
+    source_voxel_volume : float
+        Volume (mm3) of the source atlas' voxels.
+    mask : Optional[np.ndarray], optional
+        Brain mask on the registered atlas' grid, by default None
+
+    Returns
+    -------
+    Tuple[dict, pd.DataFrame]
+        The summary metrics, and the per-region voxel counts.
+    """
+    labels = np.asarray(labels).reshape(-1)
+    labelled = labels > 0
+    counts = label_counts(labels)
+    regions = np.flatnonzero(source_counts)
+    voxels = np.zeros(len(source_counts), dtype=np.int64)
+    size = min(len(counts), len(voxels))
+    voxels[:size] = counts[:size]
+    voxels = voxels[regions]
+    source_voxels = source_counts[regions]
+    volume_ratio = (voxels * voxel_volume) / (source_voxels * source_voxel_volume)
+    lost = regions[voxels == 0]
+    n_labelled = int(labelled.sum())
+    if mask is None or n_labelled == 0:
+        fraction_in_mask = np.nan
+    else:
+        in_mask = np.asarray(mask).reshape(-1)[labelled] > 0
+        fraction_in_mask = float(in_mask.mean())
+    summary = {
+        "n_regions": len(regions),
+        "n_lost_regions": len(lost),
+        "lost_regions": ",".join(str(region) for region in lost),
+        "labelled_voxels": n_labelled,
+        "fraction_in_mask": fraction_in_mask,
+        "min_volume_ratio": float(volume_ratio.min()) if len(regions) else np.nan,
+        "median_volume_ratio": (
+            float(np.median(volume_ratio)) if len(regions) else np.nan
+        ),
+    }
+    regions = pd.DataFrame(
+        {
+            "region": regions,
+            "source_voxels": source_voxels,
+            "voxels": voxels,
+            "volume_ratio": volume_ratio,
+        }
+    )
+    return summary, regions
+
+
+class RegistrationMetrics:
+    """
+    The numeric QC tables of a session's atlas registrations.
+    """
+
+    SUMMARY_TEMPLATE: ClassVar = "sub-{subject}_ses-{session}_desc-registration_QC.tsv"
+    REGIONS_TEMPLATE: ClassVar = "sub-{subject}_ses-{session}_desc-regions_QC.tsv"
+    KEY_COLUMNS: ClassVar = ["atlas", "space", "label"]
+
+    # MNI152 atlases are shared by every session (and every space)
+    _source_counts: ClassVar = {}
+    _source_lock: ClassVar = threading.Lock()
+
+    def __init__(self, output_directory: Union[str, Path], subject: str, session: str):
+        """
+        Initialize the RegistrationMetrics class.
+
+        Parameters
+        ----------
+        output_directory : Union[str, Path]
+            Directory of the session's registered atlases.
+        subject : str
+            Subject's label.
+        session : str
+            Session's label.
+        """
+        output_directory = Path(output_directory)
+        entities = {"subject": subject, "session": session}
+        self.summary_file = output_directory / self.SUMMARY_TEMPLATE.format(**entities)
+        self.regions_file = output_directory / self.REGIONS_TEMPLATE.format(**entities)
+        self.loader = ImageLoader()
+
+    @staticmethod
+    def voxel_volume(image) -> float:
+        """
+        Volume (mm3) of an image's voxels.
+        """
+        return float(np.prod(image.header.get_zooms()[:3]))
+
+    def source_counts(self, source: Union[str, Path]) -> Tuple[np.ndarray, float]:
+        """
+        Count the voxels of a source atlas' labels, once per atlas file.
+
+        Parameters
+        ----------
+        source : Union[str, Path]
+            Path to the source (MNI152) atlas.
+
+        Returns
+        -------
+        Tuple[np.ndarray, float]
+            The voxel counts, indexed by label, and the voxels' volume.
+        """
+        signature = file_signature(Path(source), hash_content=False)
+        key = (str(source), signature["size"], signature["mtime"])
+        with self._source_lock:
+            if key not in self._source_counts:
+                image = self.loader.load(source)
+                self._source_counts[key] = (
+                    label_counts(self.loader.load_labels(image)),
+                    self.voxel_volume(image),
+                )
+        return self._source_counts[key]
+
+    def load_mask(
+        self, mask: Optional[Union[str, Path]] = None
+    ) -> Optional[nib.spatialimages.SpatialImage]:
+        """
+        Load a brain mask in memory, once for all the atlases registered to
+        its space.
+
+        Parameters
+        ----------
+        mask : Optional[Union[str, Path]], optional
+            Path to the brain mask, by default None
+
+        Returns
+        -------
+        Optional[nib.spatialimages.SpatialImage]
+            The mask, or None if there is no mask.
+        """
+        if mask is None or not Path(mask).exists():
+            return None
+        image = self.loader.load(mask)
+        return nib.Nifti1Image(np.asanyarray(image.dataobj), image.affine)
+
+    @staticmethod
+    def same_grid(
+        image: nib.spatialimages.SpatialImage, other: nib.spatialimages.SpatialImage
+    ) -> bool:
+        """
+        Check whether two images share a voxel grid.
+        """
+        return image.shape[:3] == other.shape[:3] and np.allclose(
+            image.affine, other.affine, atol=1e-4
+        )
+
+    def compute(
+        self,
+        atlas: str,
+        space: str,
+        registered: Union[str, Path, nib.spatialimages.SpatialImage],
+        source: Union[str, Path],
+        mask: Optional[Union[str, Path, nib.spatialimages.SpatialImage]] = None,
+        label: Optional[str] = None,
+    ) -> Tuple[dict, pd.DataFrame]:
+        """
+        Compute the QC metrics of a registered atlas.
+
+        Parameters
+        ----------
+        atlas : str
+            Name of the atlas.
+        space : str
+            Space the atlas was registered to.
+        registered : Union[str, Path, nib.spatialimages.SpatialImage]
+            The registered atlas (or a path to it).
+        source : Union[str, Path]
+            Path to the source (MNI152) atlas.
+        mask : Optional[Union[str, Path, nib.spatialimages.SpatialImage]]
+            The brain mask of the space (or a path to it, see
+            :meth:`load_mask`), by default None. A mask on another grid than
+            the registered atlas' is ignored (with a warning), and the
+            fraction of labelled voxels in the mask left undefined.
+        label : Optional[str], optional
+            Label of the atlas (e.g. "GM" or "WholeBrain"), by default None
+
+        Returns
+        -------
+        Tuple[dict, pd.DataFrame]
+            The summary row, and the per-region rows.
+        """
+        source_counts, source_voxel_volume = self.source_counts(source)
+        image = self.loader.load(registered)
+        if mask is not None and not isinstance(mask, nib.spatialimages.SpatialImage):
+            mask = self.load_mask(mask)
+        mask_data = None
+        if mask is not None:
+            if self.same_grid(image, mask):
+                mask_data = np.asanyarray(mask.dataobj)
+            else:
+                warnings.warn(
+                    f"The brain mask of the {space} space is not on the grid of "
+                    f"the registered {atlas} atlas; its fraction of labelled "
+                    "voxels in the mask is not computed."
+                )
+        summary, regions = registration_metrics(
+            self.loader.load_labels(image),
+            source_counts,
+            self.voxel_volume(image),
+            source_voxel_volume,
+            mask=mask_data,
+        )
+        keys = {"atlas": atlas, "space": space, "label": label}
+        for position, (column, value) in enumerate(keys.items()):
+            regions.insert(position, column, value)
+        return {**keys, **summary}, regions
+
+    def _upsert(self, path: Path, rows: pd.DataFrame):
+        """
+        Write rows to a table, replacing the rows of the same atlases, spaces
+        and labels.
+        """
+        if path.exists():
+            existing = pd.read_csv(path, sep="\t", dtype={"lost_regions": str})
+            keys = pd.MultiIndex.from_frame(existing[self.KEY_COLUMNS])
+            replaced = keys.isin(pd.MultiIndex.from_frame(rows[self.KEY_COLUMNS]))
+            rows = pd.concat([existing.loc[~replaced], rows], ignore_index=True)
+        tmp_file = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+        rows.to_csv(tmp_file, sep="\t", index=False)
+        tmp_file.replace(path)
+
+    def write(self, summaries: list, regions: list):
+        """
+        Write registrations' metrics (see :meth:`compute`) to the session's
+        tables.
+
+        Parameters
+        ----------
+        summaries : list
+            Summary rows.
+        regions : list
+            Per-region rows.
+        """
+        if not summaries:
+            return
+        self._upsert(self.summary_file, pd.DataFrame(summaries))
+        self._upsert(self.regions_file, pd.concat(regions, ignore_index=True))
+
+    def read(self) -> pd.DataFrame:
+        """
+        Read the session's summary table.
+
+        Returns
+        -------
+        pd.DataFrame
+            One row per registered atlas, space and label.
+        """
+        return pd.read_csv(self.summary_file, sep="\t", dtype={"lost_regions": str})
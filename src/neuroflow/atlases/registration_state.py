@@ -0,0 +1,105 @@
+"""
+Memoized atlas registrations, so that each space's atlases are resolved
+(and registered if needed) once rather than on every access.
+"""
+
+import copy
+from pathlib import Path
+from typing import Optional
+
+from neuroflow.files_mapper.utils import inputs_signature
+
+
+class RegistrationState:
+    """
+    Registered atlases of each space (and label), along with a signature of
+    the inputs they were registered from.
+    """
+
+    def __init__(self):
+        """
+        Initialize the RegistrationState class.
+        """
+        self._spaces = {}
+
+    @staticmethod
+    def signature(inputs: dict) -> dict:
+        """
+        Describe the inputs of a registration.
+        Files are described by their size and modification time, so that
+        replacing any of them invalidates the registration.
+
+        Parameters
+        ----------
+        inputs : dict
+            Inputs of the registration (paths or plain values).
+
+        Returns
+        -------
+        dict
+            The signature of the inputs.
+        """
+        return inputs_signature(inputs)
+
+    def get(
+        self, space: str, inputs: dict, label: Optional[str] = None
+    ) -> Optional[dict]:
+        """
+        Get the registered atlases of a space, if they were registered from
+        the same inputs and their files still exist.
+
+        Parameters
+        ----------
+        space : str
+            Space of the atlases (e.g. "T1w" or "dwi").
+        inputs : dict
+            Inputs of the registration.
+        label : Optional[str], optional
+            Label of the atlases (e.g. "GM" or "WholeBrain"), by default None
+
+        Returns
+        -------
+        Optional[dict]
+            A copy of the registered atlases, or None if they are outdated.
+        """
+        cached = self._spaces.get((space, label))
+        if cached is None or cached["inputs"] != self.signature(inputs):
+            return None
+        atlases = cached["atlases"]
+        if not all(Path(entities["nifti"]).exists() for entities in atlases.values()):
+            return None
+        return copy.deepcopy(atlases)
+
+    def set(self, space: str, inputs: dict, atlases: dict, label: Optional[str] = None):
+        """
+        Memoize the registered atlases of a space.
+
+        Parameters
+        ----------
+        space : str
+            Space of the atlases (e.g. "T1w" or "dwi").
+        inputs : dict
+            Inputs of the registration.
+        atlases : dict
+            The registered atlases.
+        label : Optional[str], optional
+            Label of the atlases (e.g. "GM" or "WholeBrain"), by default None
+        """
+        self._spaces[(space, label)] = {
+            "inputs": self.signature(inputs),
+            "atlases": copy.deepcopy(atlases),
+        }
+
+    def invalidate(self, space: Optional[str] = None):
+        """
+        Forget the registered atlases of a space (or of all spaces), whatever
+        their label.
+
+        Parameters
+        ----------
+        space : Optional[str], optional
+            Space of the atlases, by default None (all spaces).
+        """
+        for key in list(self._spaces):
+            if space is None or key[0] == space:
+                del self._spaces[key]
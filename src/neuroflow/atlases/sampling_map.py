@@ -0,0 +1,430 @@
+"""
+In-process nearest-neighbour resampling of MNI152 images to a subject's
+T1w and diffusion spaces.
+
+FSL's ``applywarp`` (MNI -> T1w, through a displacement field) and
+``flirt -applyxfm`` (T1w -> DWI, through an affine) are composed once per
+session into integer maps from each target voxel to the MNI voxel it samples.
+Registering an atlas is then a single gather of the atlas' labels.
+"""
+
+import threading
+from pathlib import Path
+from typing import ClassVar, Optional, Tuple, Union
+
+import nibabel as nib
+import numpy as np
+
+from neuroflow.atlases.atlas_package import smallest_label_dtype
+from neuroflow.images import ImageLoader
+
+
+def fsl_scaling(image: nib.spatialimages.SpatialImage) -> np.ndarray:
+    """
+    Build the transformation from an image's voxel indices to FSL's scaled
+    (mm) coordinates, in which FLIRT matrices and FNIRT fields are expressed.
+
+    Parameters
+    ----------
+    image : nib.spatialimages.SpatialImage
+        The image.
+
+    Returns
+    -------
+    np.ndarray
+        A 4x4 voxel-to-FSL-coordinates matrix.
+    """
+    scaling = np.diag([*image.header.get_zooms()[:3], 1.0])
+    if np.linalg.det(image.affine[:3, :3]) > 0:
+        # FSL flips the x axis of images stored in neurological order
+        flip = np.eye(4)
+        flip[0, 0] = -1
+        flip[0, 3] = image.shape[0] - 1
+        scaling = scaling @ flip
+    return scaling
+
+
+def grid_key(image: nib.spatialimages.SpatialImage) -> tuple:
+    """
+    Describe an image's voxel grid, to tell apart images on different grids.
+
+    Parameters
+    ----------
+    image : nib.spatialimages.SpatialImage
+        The image.
+
+    Returns
+    -------
+    tuple
+        The image's spatial shape and (rounded) affine.
+    """
+    return (
+        tuple(image.shape[:3]),
+        tuple(np.round(image.affine, 4).ravel().tolist()),
+    )
+
+
+def nearest_voxels(
+    coordinates: np.ndarray, shape: tuple
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Round voxel coordinates to the nearest voxel of a grid.
+
+    Parameters
+    ----------
+    coordinates : np.ndarray
+        A (3, n) array of (continuous) voxel coordinates.
+    shape : tuple
+        Spatial shape of the grid.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        The flat indices of the nearest voxels (-1 outside the grid),
+        and a mask of the coordinates that fall inside the grid.
+    """
+    voxels = np.floor(coordinates + 0.5).astype(np.int64)
+    inside = np.all((voxels >= 0) & (voxels < np.asarray(shape[:3])[:, None]), axis=0)
+    indices = np.full(coordinates.shape[1], -1, dtype=np.int64)
+    indices[inside] = np.ravel_multi_index(tuple(voxels[:, inside]), shape[:3])
+    return indices, inside
+
+
+def fsl_coordinates(
+    image: nib.spatialimages.SpatialImage, voxels: Optional[np.ndarray] = None
+) -> np.ndarray:
+    """
+    Compute the FSL (scaled mm) coordinates of voxels of an image.
+
+    Parameters
+    ----------
+    image : nib.spatialimages.SpatialImage
+        The image.
+    voxels : Optional[np.ndarray], optional
+        A (3, n) array of voxel indices, by default every voxel (computed one
+        z-slab at a time).
+
+    Returns
+    -------
+    np.ndarray
+        A (n, 3) float32 array of coordinates, or a (x, y, z, 3) one for
+        every voxel.
+    """
+    scaling = fsl_scaling(image)
+    if voxels is not None:
+        voxels = np.asarray(voxels, dtype=np.float64)
+        return (scaling[:3, :3] @ voxels + scaling[:3, 3:]).T.astype(np.float32)
+    shape = image.shape[:3]
+    coordinates = np.empty((*shape, 3), dtype=np.float32)
+    slab = np.indices(shape[:2]).reshape(2, -1)
+    for z in range(shape[2]):
+        voxels = np.vstack([slab, np.full(slab.shape[1], z)])
+        coordinates[:, :, z] = fsl_coordinates(image, voxels).reshape(*shape[:2], 3)
+    return coordinates
+
+
+def is_relative_field(
+    field: np.ndarray,
+    reference: nib.spatialimages.SpatialImage,
+    n_samples: int = 10000,
+) -> bool:
+    """
+    Tell relative displacement fields from absolute ones, as FSL guesses it:
+    an absolute field holds coordinates close to its own voxels'.
+
+    Parameters
+    ----------
+    field : np.ndarray
+        The (x, y, z, 3) field, in mm.
+    reference : nib.spatialimages.SpatialImage
+        The image whose grid the field is defined on.
+    n_samples : int, optional
+        Number of (evenly spread) voxels compared, by default 10000.
+
+    Returns
+    -------
+    bool
+        True if the field holds displacements rather than coordinates.
+    """
+    shape = reference.shape[:3]
+    n_voxels = int(np.prod(shape))
+    samples = np.unique(
+        np.linspace(0, n_voxels - 1, min(n_samples, n_voxels)).astype(np.int64)
+    )
+    voxels = np.array(np.unravel_index(samples, shape))
+    values = np.asarray(field[tuple(voxels)], dtype=np.float32)
+    as_absolute = np.abs(values - fsl_coordinates(reference, voxels)).mean()
+    return bool(np.abs(values).mean() <= as_absolute)
+
+
+class SamplingMap:
+    """
+    Nearest-neighbour sampling maps from a subject's T1w and diffusion grids
+    to MNI152 grids.
+    """
+
+    # FNIRT spline/DCT coefficient fields (2007-2009) must be expanded by FSL;
+    # 2006 ("fnirt disp field") is a displacement field, sampled in-process
+    COEFFICIENT_INTENT_CODES: ClassVar = range(2007, 2010)
+
+    def __init__(
+        self,
+        warp_file: Union[str, Path],
+        t1w_reference: Union[str, Path],
+        t1w_mask: Optional[Union[str, Path]] = None,
+        t1w_to_dwi_mat: Optional[Union[str, Path]] = None,
+        dwi_reference: Optional[Union[str, Path]] = None,
+    ):
+        """
+        Initialize the SamplingMap class.
+
+        Parameters
+        ----------
+        warp_file : Union[str, Path]
+            FNIRT displacement field from the MNI152 template to the T1w
+            image (relative or absolute, on the T1w grid).
+        t1w_reference : Union[str, Path]
+            The T1w image whose grid is sampled.
+        t1w_mask : Optional[Union[str, Path]], optional
+            Mask of the T1w voxels to sample, by default all of them.
+        t1w_to_dwi_mat : Optional[Union[str, Path]], optional
+            FLIRT matrix from the T1w image to the diffusion reference
+            (required for the diffusion space).
+        dwi_reference : Optional[Union[str, Path]], optional
+            The diffusion image whose grid is sampled
+            (required for the diffusion space).
+        """
+        self.loader = ImageLoader()
+        self.warp_file = Path(warp_file)
+        self.t1w_reference = self.loader.load(t1w_reference)
+        self.t1w_mask = t1w_mask
+        self.t1w_to_dwi_mat = t1w_to_dwi_mat
+        self.dwi_reference = (
+            self.loader.load(dwi_reference) if dwi_reference is not None else None
+        )
+        self._warp = None
+        self._relative = None
+        self._maps = {}
+        # maps are computed once, even when atlases are resampled concurrently
+        self._lock = threading.RLock()
+
+    @classmethod
+    def supports(cls, warp_file: Union[str, Path], t1w_reference: Union[str, Path]):
+        """
+        Check whether a warp can be applied in-process.
+
+        Parameters
+        ----------
+        warp_file : Union[str, Path]
+            Path to the warp.
+        t1w_reference : Union[str, Path]
+            Path to the T1w image whose grid is sampled.
+
+        Returns
+        -------
+        bool
+            True if the warp is a displacement field on the T1w grid.
+        """
+        warp = nib.load(str(warp_file))
+        intent_code = int(warp.header.get("intent_code", 0))
+        if intent_code in cls.COEFFICIENT_INTENT_CODES:
+            return False
+        reference = nib.load(str(t1w_reference))
+        return (
+            warp.ndim == 4
+            and warp.shape[3] == 3
+            and warp.shape[:3] == reference.shape[:3]
+        )
+
+    @property
+    def warp(self) -> np.ndarray:
+        """
+        The displacement field (in mm), loaded once.
+        """
+        if self._warp is None:
+            self._warp = self.loader.load_metric(self.warp_file)
+        return self._warp
+
+    @property
+    def relative(self) -> bool:
+        """
+        Whether the warp holds relative displacements (rather than absolute
+        coordinates), guessed once.
+        """
+        if self._relative is None:
+            self._relative = is_relative_field(self.warp, self.t1w_reference)
+        return self._relative
+
+    def _t1w_to_mni(
+        self, t1w_indices: np.ndarray, source: nib.spatialimages.SpatialImage
+    ) -> np.ndarray:
+        """
+        Map T1w voxels to the nearest source (MNI152) voxels through the warp.
+
+        Parameters
+        ----------
+        t1w_indices : np.ndarray
+            Flat indices of T1w voxels.
+        source : nib.spatialimages.SpatialImage
+            An image on the source grid.
+
+        Returns
+        -------
+        np.ndarray
+            Flat indices of the source voxels (-1 outside the source grid).
+        """
+        shape = self.t1w_reference.shape[:3]
+        scaling = fsl_scaling(self.t1w_reference)
+        to_source = np.linalg.inv(fsl_scaling(source))
+        source_indices = np.empty(len(t1w_indices), dtype=np.int64)
+        # a z-slab's worth of voxels at a time, to bound the temporaries
+        step = int(np.prod(shape[:2]))
+        for start in range(0, len(t1w_indices), step):
+            chunk = slice(start, start + step)
+            t1w_voxels = np.unravel_index(t1w_indices[chunk], shape)
+            coordinates = self.warp[t1w_voxels].T.astype(np.float64)
+            if self.relative:
+                coordinates += scaling[:3, :3] @ np.vstack(t1w_voxels)
+                coordinates += scaling[:3, 3:]
+            source_voxels = to_source[:3, :3] @ coordinates + to_source[:3, 3:]
+            source_indices[chunk] = nearest_voxels(source_voxels, source.shape)[0]
+        return source_indices
+
+    def _t1w_voxels(self) -> np.ndarray:
+        """
+        Flat indices of the sampled (masked) T1w voxels.
+        """
+        if self.t1w_mask is None:
+            return np.arange(int(np.prod(self.t1w_reference.shape[:3])))
+        mask = np.asanyarray(self.loader.load(self.t1w_mask).dataobj)
+        return np.flatnonzero(mask.reshape(-1) > 0)
+
+    def t1w_map(self, source: nib.spatialimages.SpatialImage) -> np.ndarray:
+        """
+        Map every T1w voxel to the source voxel it samples.
+
+        Parameters
+        ----------
+        source : nib.spatialimages.SpatialImage
+            An image on the source (MNI152) grid.
+
+        Returns
+        -------
+        np.ndarray
+            Flat source indices on the T1w grid (-1 for unsampled voxels).
+        """
+        key = ("T1w", grid_key(source))
+        with self._lock:
+            if key in self._maps:
+                return self._maps[key]
+            t1w_voxels = self._t1w_voxels()
+            sampling = np.full(
+                int(np.prod(self.t1w_reference.shape[:3])), -1, dtype=np.int64
+            )
+            sampling[t1w_voxels] = self._t1w_to_mni(t1w_voxels, source)
+            self._maps[key] = sampling.reshape(self.t1w_reference.shape[:3])
+        return self._maps[key]
+
+    def dwi_map(self, source: nib.spatialimages.SpatialImage) -> np.ndarray:
+        """
+        Map every diffusion voxel to the source voxel it samples, composing
+        the T1w-to-DWI affine with the warp.
+
+        Parameters
+        ----------
+        source : nib.spatialimages.SpatialImage
+            An image on the source (MNI152) grid.
+
+        Returns
+        -------
+        np.ndarray
+            Flat source indices on the diffusion grid (-1 for unsampled
+            voxels).
+        """
+        if self.dwi_reference is None or self.t1w_to_dwi_mat is None:
+            raise ValueError("The diffusion reference and matrix are required.")
+        key = ("dwi", grid_key(source))
+        with self._lock:
+            if key in self._maps:
+                return self._maps[key]
+            dwi_shape = self.dwi_reference.shape[:3]
+            dwi_to_t1w = (
+                np.linalg.inv(fsl_scaling(self.t1w_reference))
+                @ np.linalg.inv(np.loadtxt(self.t1w_to_dwi_mat))
+                @ fsl_scaling(self.dwi_reference)
+            )
+            voxels = np.indices(dwi_shape).reshape(3, -1)
+            t1w_voxels = dwi_to_t1w[:3, :3] @ voxels + dwi_to_t1w[:3, 3:]
+            t1w_indices, inside = nearest_voxels(t1w_voxels, self.t1w_reference.shape)
+            t1w_map = self.t1w_map(source).reshape(-1)
+            sampling = np.full(t1w_indices.shape, -1, dtype=np.int64)
+            sampling[inside] = t1w_map[t1w_indices[inside]]
+            self._maps[key] = sampling.reshape(dwi_shape)
+        return self._maps[key]
+
+    def resample(
+        self, source: Union[str, Path, nib.spatialimages.SpatialImage], space: str
+    ) -> nib.Nifti1Image:
+        """
+        Resample a label image from the MNI152 grid to a subject's space.
+
+        Parameters
+        ----------
+        source : Union[str, Path, nib.spatialimages.SpatialImage]
+            The label image (or a path to it).
+        space : str
+            Either "T1w" or "dwi".
+
+        Returns
+        -------
+        nib.Nifti1Image
+            The resampled label image, in the smallest integer type that holds
+            its labels.
+        """
+        source = self.loader.load(source)
+        if space == "T1w":
+            sampling, reference = self.t1w_map(source), self.t1w_reference
+        else:
+            sampling, reference = self.dwi_map(source), self.dwi_reference
+        labels = np.asarray(self.loader.load_labels(source)).reshape(-1)
+        data = np.zeros(
+            sampling.shape, dtype=smallest_label_dtype(labels.max(initial=0))
+        )
+        sampled = sampling >= 0
+        data[sampled] = labels[sampling[sampled]]
+        image = nib.Nifti1Image(data, reference.affine)
+        image.header.set_qform(
+            reference.header.get_qform(), code=int(reference.header["qform_code"])
+        )
+        image.header.set_sform(
+            reference.header.get_sform(), code=int(reference.header["sform_code"])
+        )
+        image.header.set_xyzt_units(*reference.header.get_xyzt_units())
+        return image
+
+    def apply(
+        self,
+        in_file: Union[str, Path, nib.spatialimages.SpatialImage],
+        out_file: Union[str, Path],
+        space: str,
+    ) -> Path:
+        """
+        Resample a label image and write it to a file.
+
+        Parameters
+        ----------
+        in_file : Union[str, Path, nib.spatialimages.SpatialImage]
+            The label image on the MNI152 grid (or a path to it).
+        out_file : Union[str, Path]
+            Path to the resampled image.
+        space : str
+            Either "T1w" or "dwi".
+
+        Returns
+        -------
+        Path
+            Path to the resampled image.
+        """
+        out_file = Path(out_file)
+        self.resample(in_file, space).to_filename(out_file)
+        return out_file
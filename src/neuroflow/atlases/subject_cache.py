@@ -0,0 +1,175 @@
+"""
+Subject-level cache of T1w-space atlases, shared by a subject's sessions.
+
+Longitudinal sessions often share their T1w image and MNI152 transforms.
+Atlases registered to the T1w space are stored once per subject, under a key
+derived from the content of the registration's inputs, and linked into each
+session whose inputs hash the same, so that only the diffusion-space step is
+recomputed per session.
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import threading
+from pathlib import Path
+from typing import ClassVar, Union
+
+from neuroflow.files_mapper.utils import file_signature, hash_file
+
+
+def link_or_copy(source: Union[str, Path], destination: Union[str, Path]):
+    """
+    Hard-link a file (or copy it, across file systems), replacing the
+    destination.
+
+    Parameters
+    ----------
+    source : Union[str, Path]
+        Path to the file.
+    destination : Union[str, Path]
+        Path to the link (or copy).
+    """
+    source, destination = Path(source), Path(destination)
+    destination.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = destination.with_name(f".{destination.name}.{os.getpid()}.tmp")
+    tmp_file.unlink(missing_ok=True)
+    try:
+        os.link(source, tmp_file)
+    except OSError:
+        shutil.copy2(source, tmp_file)
+    tmp_file.replace(destination)
+
+
+class SubjectRegistrationCache:
+    """
+    T1w-space atlases of a subject, keyed by the content of their inputs.
+    """
+
+    DIRECTORY_NAME: ClassVar = "atlases"
+
+    # content hashes are shared by every session (and instance) of a run
+    _hashes: ClassVar = {}
+    _hashes_lock: ClassVar = threading.Lock()
+
+    def __init__(self, directory: Union[str, Path]):
+        """
+        Initialize the SubjectRegistrationCache class.
+
+        Parameters
+        ----------
+        directory : Union[str, Path]
+            The subject's cache directory.
+        """
+        self.directory = Path(directory)
+
+    @classmethod
+    def content_hash(cls, file_path: Union[str, Path]) -> str:
+        """
+        Hash a file's content, once per version (size and modification time)
+        of the file.
+
+        Parameters
+        ----------
+        file_path : Union[str, Path]
+            Path to the file.
+
+        Returns
+        -------
+        str
+            The SHA-256 digest of the file.
+        """
+        signature = file_signature(file_path, hash_content=False)
+        key = (str(file_path), signature["size"], signature["mtime"])
+        with cls._hashes_lock:
+            if key in cls._hashes:
+                return cls._hashes[key]
+        digest = hash_file(file_path)
+        with cls._hashes_lock:
+            cls._hashes[key] = digest
+        return digest
+
+    @classmethod
+    def content_key(cls, inputs: dict) -> str:
+        """
+        Build a key from the content of a registration's inputs, regardless
+        of the files' paths.
+
+        Parameters
+        ----------
+        inputs : dict
+            Inputs of the registration (paths or plain values).
+
+        Returns
+        -------
+        str
+            The key of the inputs.
+        """
+
+        def describe(value):
+            if isinstance(value, dict):
+                return {key: describe(item) for key, item in sorted(value.items())}
+            if isinstance(value, Path):
+                return cls.content_hash(value) if value.is_file() else None
+            return value
+
+        description = json.dumps(describe(inputs), sort_keys=True, default=str)
+        return hashlib.sha256(description.encode()).hexdigest()
+
+    def path(self, key: str, name: str) -> Path:
+        """
+        Get the path of a cached file.
+
+        Parameters
+        ----------
+        key : str
+            Key of the registration's inputs (see :meth:`content_key`).
+        name : str
+            Name of the file.
+
+        Returns
+        -------
+        Path
+            Path to the cached file.
+        """
+        return self.directory / f"T1w-{key[:16]}" / name
+
+    def fetch(self, key: str, name: str, out_file: Union[str, Path]) -> bool:
+        """
+        Link a cached file to a session's output, if it is cached.
+
+        Parameters
+        ----------
+        key : str
+            Key of the registration's inputs (see :meth:`content_key`).
+        name : str
+            Name of the file.
+        out_file : Union[str, Path]
+            Path to the session's output.
+
+        Returns
+        -------
+        bool
+            Whether the file was cached.
+        """
+        cached = self.path(key, name)
+        if not cached.is_file():
+            return False
+        link_or_copy(cached, out_file)
+        return True
+
+    def store(self, key: str, name: str, out_file: Union[str, Path]):
+        """
+        Cache a session's output.
+
+        Parameters
+        ----------
+        key : str
+            Key of the registration's inputs (see :meth:`content_key`).
+        name : str
+            Name of the file.
+        out_file : Union[str, Path]
+            Path to the session's output.
+        """
+        link_or_copy(out_file, self.path(key, name))
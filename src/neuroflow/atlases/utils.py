@@ -1,21 +1,83 @@
-import os
 from pathlib import Path
 from typing import Union
 
+import nibabel as nib
+import numpy as np
 from nilearn import plotting
 
-GM_5TT_CMDS = [
-    "mrconvert {five_tissue_type} {out_file} -force",
-    "fslroi {out_file} {out_file} 0 2",
-    "fslmaths {out_file} -Tmax -thr 0.5 -bin {out_file} -odt float",
+from neuroflow.images import ImageLoader
+
+THREADS_ENVIRONMENT_VARIABLES = [
+    "OMP_NUM_THREADS",
+    "ITK_GLOBAL_DEFAULT_NUMBER_OF_THREADS",
+    "MRTRIX_NTHREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
 ]
 
+# cortical and sub-cortical grey matter volumes of a 5TT image
+GM_5TT_VOLUMES = [0, 1]
+GM_5TT_THRESHOLD = 0.5
+
+
+def optimal_threshold(data: np.ndarray) -> float:
+    """
+    Find the threshold whose binarization of an image correlates best with
+    the image itself (Ridgway et al., 2009), like MRtrix3's ``mrthreshold``
+    does by default.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Image data.
+
+    Returns
+    -------
+    float
+        The threshold (voxels above it are kept).
+    """
+    values = np.sort(data[np.isfinite(data)].astype(np.float64), axis=None)
+    n = len(values)
+    thresholds, first = np.unique(values, return_index=True)
+    # voxels above each candidate threshold
+    above = n - np.append(first[1:], n)
+    sums = np.cumsum(values[::-1])[::-1]
+    above_sums = np.where(above > 0, sums[np.minimum(n - above, n - 1)], 0)
+    proportion = above / n
+    covariance = above_sums / n - values.mean() * proportion
+    spread = np.sqrt(proportion * (1 - proportion))
+    with np.errstate(divide="ignore", invalid="ignore"):
+        correlation = np.where(spread > 0, covariance / spread, -np.inf)
+    return float(thresholds[np.argmax(correlation)])
+
+
+def save_mask(mask: np.ndarray, reference, out_file: Union[str, Path], dtype):
+    """
+    Write a binary mask on the grid of a reference image.
+
+    Parameters
+    ----------
+    mask : np.ndarray
+        Boolean mask.
+    reference : nib.spatialimages.SpatialImage
+        Image whose grid the mask is on.
+    out_file : Union[str, Path]
+        Path to the output mask.
+    dtype : np.dtype
+        Data type of the written mask.
+    """
+    image = nib.Nifti1Image(mask.astype(dtype), reference.affine)
+    image.header.set_zooms(reference.header.get_zooms()[:3])
+    image.header.set_xyzt_units(*reference.header.get_xyzt_units())
+    image.to_filename(out_file)
+
 
 def generate_gm_mask_from_smriprep(
     gm_probseg: Union[str, Path], out_file: Union[str, Path], force: bool = False
 ):
     """
-    Generate a grey matter mask from a probabilistic segmentation.
+    Generate a grey matter mask from a probabilistic segmentation,
+    thresholded at its optimal threshold (see :func:`optimal_threshold`).
 
     Parameters
     ----------
@@ -35,14 +97,19 @@ def generate_gm_mask_from_smriprep(
         raise FileNotFoundError(
             f"Gray matter probabilistic segmentation {gm_probseg} not found."
         )
-    os.system(f"mrthreshold {gm_probseg} {out_file}")  # noqa: S605
+    loader = ImageLoader()
+    probseg = loader.load(gm_probseg)
+    data = loader.load_metric(probseg)
+    save_mask(data > optimal_threshold(data), probseg, out_file, np.uint8)
 
 
 def generate_gm_mask_from_5tt(
     five_tissue_type: Union[str, Path], out_file: Union[str, Path], force: bool = False
 ):
     """
-    Generate a grey matter mask from a 5TT image.
+    Generate a grey matter mask from a 5TT image (MRtrix3 or NIfTI),
+    keeping the voxels whose cortical or sub-cortical grey matter fraction
+    is at least 0.5.
 
     Parameters
     ----------
@@ -60,9 +127,29 @@ def generate_gm_mask_from_5tt(
         return
     if not five_tissue_type.is_file():
         raise FileNotFoundError(f"5TT image {five_tissue_type} not found.")
-    for cmd in GM_5TT_CMDS:
-        cmd = cmd.format(five_tissue_type=five_tissue_type, out_file=out_file)
-        os.system(cmd)  # noqa: S605
+    loader = ImageLoader()
+    five_tissue_type = loader.load(five_tissue_type)
+    data = loader.load_metric(five_tissue_type)
+    grey_matter = np.max(data[..., GM_5TT_VOLUMES], axis=-1)
+    save_mask(grey_matter >= GM_5TT_THRESHOLD, five_tissue_type, out_file, np.float32)
+
+
+def qc_image_file(atlas: Union[str, Path]) -> Path:
+    """
+    Build the path to the QC image of a registered atlas.
+
+    Parameters
+    ----------
+    atlas : Union[str, Path]
+        Path to the registered atlas.
+
+    Returns
+    -------
+    Path
+        Path to the atlas' QC image.
+    """
+    atlas = Path(atlas)
+    return atlas.parent / atlas.name.replace("dseg.nii.gz", "QC.png")
 
 
 def qc_atlas_registration(
@@ -90,7 +177,7 @@ def qc_atlas_registration(
     """
     atlas = Path(atlas)
     reference = Path(reference)
-    out_file = atlas.parent / atlas.name.replace("dseg.nii.gz", "QC.png")
+    out_file = qc_image_file(atlas)
     if out_file.exists() and not force:
         print(f"QC image {out_file} already exists.")
         return
@@ -109,3 +196,21 @@ def qc_atlas_registration(
         alpha=0.5,
         output_file=out_file,
     )
+
+
+def thread_environment(nthreads: int) -> dict:
+    """
+    Build the environment variables that limit the number of threads used by
+    the registration tools (FSL, ANTs, MRtrix3 and their numerical libraries).
+
+    Parameters
+    ----------
+    nthreads : int
+        Number of threads each tool may use.
+
+    Returns
+    -------
+    dict
+        Environment variables to pass to the tools.
+    """
+    return {variable: str(nthreads) for variable in THREADS_ENVIRONMENT_VARIABLES}
@@ -0,0 +1,390 @@
+"""
+Flat voxel indices of each label of an atlas image,
+cached next to the atlas so that consumers can skip decoding its labels.
+
+The indices are relative to the atlas' non-zero bounding box, so consumers
+only touch (and keep in cache) the part of the grid the atlas covers.
+"""
+
+import os
+from pathlib import Path
+from typing import ClassVar, Optional, Tuple, Union
+
+import nibabel as nib
+import numpy as np
+
+from neuroflow.files_mapper.utils import file_signature
+from neuroflow.images import ImageLoader
+
+
+def bounding_box(data: np.ndarray) -> np.ndarray:
+    """
+    Compute the bounding box of the non-zero voxels of an image.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        Image data.
+
+    Returns
+    -------
+    np.ndarray
+        A (n_dims, 2) array with the start and (exclusive) stop of the
+        non-zero voxels along each axis. Empty images get an empty box.
+    """
+    data = np.asarray(data)
+    box = np.zeros((data.ndim, 2), dtype=np.int64)
+    for axis in range(data.ndim):
+        other_axes = tuple(i for i in range(data.ndim) if i != axis)
+        nonzero = np.flatnonzero(np.any(data, axis=other_axes))
+        if len(nonzero) == 0:
+            return np.zeros((data.ndim, 2), dtype=np.int64)
+        box[axis] = nonzero[0], nonzero[-1] + 1
+    return box
+
+
+def group_voxels(atlas_data: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Group the voxels of a labeled image by their label in a single pass.
+
+    Parameters
+    ----------
+    atlas_data : np.ndarray
+        Labeled image data. Voxels labeled 0 are considered background.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray, np.ndarray]
+        The sorted non-zero labels found in the image, the flat indices of the
+        labeled voxels sorted by label, and the offsets of each label within
+        the sorted indices (the voxels of ``labels[i]`` are
+        ``order[offsets[i]:offsets[i + 1]]``).
+    """
+    flat_labels = np.asarray(atlas_data).ravel()
+    if not np.issubdtype(flat_labels.dtype, np.integer):
+        flat_labels = np.rint(flat_labels).astype(np.int64)
+    voxels = np.flatnonzero(flat_labels)
+    voxel_labels = flat_labels[voxels]
+    # a stable sort keeps the voxels of each label in C order,
+    # matching the order of boolean-mask indexing
+    sort_index = np.argsort(voxel_labels, kind="stable")
+    order = voxels[sort_index]
+    labels, counts = np.unique(voxel_labels[sort_index], return_counts=True)
+    offsets = np.concatenate([[0], np.cumsum(counts)])
+    return labels, order, offsets
+
+
+class VoxelIndex:
+    """
+    Flat voxel indices of each label of an atlas image.
+    """
+
+    SUFFIX: ClassVar = "voxelindex.npz"
+    SIGNATURE_KEYS: ClassVar = ["size", "mtime", "sha256"]
+    INDEX_KEYS: ClassVar = [
+        "labels",
+        "order",
+        "offsets",
+        "shape",
+        "zooms",
+        "bbox",
+        "label_bboxes",
+    ]
+    VERSION: ClassVar = 2
+
+    def __init__(
+        self,
+        labels: np.ndarray,
+        order: np.ndarray,
+        offsets: np.ndarray,
+        shape: tuple,
+        zooms: tuple,
+        bbox: np.ndarray,
+        label_bboxes: np.ndarray,
+    ):
+        """
+        Initialize the VoxelIndex class.
+
+        Parameters
+        ----------
+        labels : np.ndarray
+            Sorted non-zero labels found in the atlas.
+        order : np.ndarray
+            Flat voxel indices (within *bbox*) sorted by label.
+        offsets : np.ndarray
+            Offsets of each label within *order*.
+        shape : tuple
+            Spatial shape of the atlas.
+        zooms : tuple
+            Voxel sizes of the atlas (in mm).
+        bbox : np.ndarray
+            A (3, 2) array with the bounding box of the labeled voxels.
+        label_bboxes : np.ndarray
+            A (n_labels, 3, 2) array with the bounding box of each label
+            (in the atlas' grid).
+        """
+        self.labels = labels
+        self.order = order
+        self.offsets = offsets
+        self.shape = tuple(int(dim) for dim in shape)
+        self.zooms = tuple(float(zoom) for zoom in zooms)
+        self.bbox = np.asarray(bbox, dtype=np.int64).reshape(3, 2)
+        self.label_bboxes = np.asarray(label_bboxes, dtype=np.int64).reshape(-1, 3, 2)
+
+    @classmethod
+    def from_image(cls, atlas: Union[str, Path, nib.Nifti1Image]) -> "VoxelIndex":
+        """
+        Build the voxel index of an atlas image.
+
+        Parameters
+        ----------
+        atlas : Union[str, Path, nib.Nifti1Image]
+            The atlas image (or a path to it).
+
+        Returns
+        -------
+        VoxelIndex
+            The voxel index of the atlas.
+        """
+        atlas = ImageLoader().load(atlas)
+        atlas_data = ImageLoader().load_labels(atlas)
+        bbox = bounding_box(atlas_data)
+        cropped = atlas_data[tuple(slice(start, stop) for start, stop in bbox)]
+        labels, order, offsets = group_voxels(cropped)
+        label_bboxes = np.zeros((len(labels), 3, 2), dtype=np.int64)
+        if len(labels):
+            coordinates = np.unravel_index(order, cropped.shape)
+            for axis, axis_coordinates in enumerate(coordinates):
+                label_bboxes[:, axis, 0] = (
+                    np.minimum.reduceat(axis_coordinates, offsets[:-1]) + bbox[axis, 0]
+                )
+                label_bboxes[:, axis, 1] = (
+                    np.maximum.reduceat(axis_coordinates, offsets[:-1])
+                    + bbox[axis, 0]
+                    + 1
+                )
+        n_voxels = int(np.prod(atlas.shape[:3]))
+        index_dtype = np.int32 if n_voxels < np.iinfo(np.int32).max else np.int64
+        return cls(
+            labels=labels.astype(np.min_scalar_type(labels.max(initial=0))),
+            order=order.astype(index_dtype),
+            offsets=offsets.astype(index_dtype),
+            shape=atlas.shape[:3],
+            zooms=atlas.header.get_zooms()[:3],
+            bbox=bbox,
+            label_bboxes=label_bboxes,
+        )
+
+    @classmethod
+    def from_file(cls, atlas: Union[str, Path], force: bool = False) -> "VoxelIndex":
+        """
+        Load the cached voxel index of an atlas, building it if the cache is
+        missing or was computed from a different atlas file.
+
+        Parameters
+        ----------
+        atlas : Union[str, Path]
+            Path to the atlas image.
+        force : bool, optional
+            Force the generation of the voxel index, by default False
+
+        Returns
+        -------
+        VoxelIndex
+            The voxel index of the atlas.
+        """
+        atlas = Path(atlas)
+        cache_file = cls.cache_path(atlas)
+        signature = file_signature(atlas, hash_content=False)
+        index, stored = cls._load_cache(cache_file) if not force else (None, None)
+        if index is not None:
+            if all([stored[key] == signature[key] for key in ["size", "mtime"]]):
+                return index
+            # the file was touched; its content may still be the same
+            signature = file_signature(atlas)
+            if stored["sha256"] == signature["sha256"]:
+                index.save(cache_file, signature)
+                return index
+        index = cls.from_image(atlas)
+        index.save(cache_file, file_signature(atlas))
+        return index
+
+    @classmethod
+    def _load_cache(cls, cache_file: Path) -> Tuple[Optional["VoxelIndex"], dict]:
+        """
+        Load a voxel index cache and the signature of the atlas it indexes.
+
+        Parameters
+        ----------
+        cache_file : Path
+            Path to the voxel index cache.
+
+        Returns
+        -------
+        Tuple[Optional[VoxelIndex], dict]
+            The cached voxel index and atlas signature, or (None, None) if the
+            cache is missing or was written by another version.
+        """
+        if not cache_file.exists():
+            return None, None
+        with np.load(cache_file) as cached:
+            version = cached["version"].item() if "version" in cached else 1
+            if version != cls.VERSION:
+                return None, None
+            stored = {key: cached[key].item() for key in cls.SIGNATURE_KEYS}
+            return cls(**{key: cached[key] for key in cls.INDEX_KEYS}), stored
+
+    @classmethod
+    def cache_path(cls, atlas: Union[str, Path]) -> Path:
+        """
+        Get the path of the voxel index cache of an atlas.
+
+        Parameters
+        ----------
+        atlas : Union[str, Path]
+            Path to the atlas image.
+
+        Returns
+        -------
+        Path
+            Path to the voxel index cache, next to the atlas.
+        """
+        atlas = Path(atlas)
+        base = atlas.name.removesuffix(".gz").removesuffix(".nii")
+        return atlas.parent / f"{base.removesuffix('_dseg')}_{cls.SUFFIX}"
+
+    def save(self, cache_file: Union[str, Path], signature: dict):
+        """
+        Save the voxel index alongside the signature of the atlas it indexes.
+
+        Parameters
+        ----------
+        cache_file : Union[str, Path]
+            Path to the voxel index cache.
+        signature : dict
+            Signature of the atlas file (see
+            :func:`neuroflow.files_mapper.utils.file_signature`).
+        """
+        cache_file = Path(cache_file)
+        tmp_file = cache_file.with_name(f".{cache_file.name}.{os.getpid()}.tmp")
+        try:
+            with Path.open(tmp_file, "wb") as f:
+                np.savez(
+                    f,
+                    labels=self.labels,
+                    order=self.order,
+                    offsets=self.offsets,
+                    shape=np.array(self.shape),
+                    zooms=np.array(self.zooms),
+                    bbox=self.bbox,
+                    label_bboxes=self.label_bboxes,
+                    version=np.array(self.VERSION),
+                    **{key: np.array(signature[key]) for key in self.SIGNATURE_KEYS},
+                )
+            tmp_file.replace(cache_file)
+        except OSError:
+            # read-only locations (e.g. packaged atlases) are simply not cached
+            tmp_file.unlink(missing_ok=True)
+
+    def region_bounds(self, regions: np.ndarray) -> np.ndarray:
+        """
+        Locate the voxels of each region within the label-sorted voxels.
+
+        Parameters
+        ----------
+        regions : np.ndarray
+            Region labels listed in the atlas description.
+
+        Returns
+        -------
+        np.ndarray
+            A (n_regions, 2) array with the start and stop of each region's
+            voxels. Regions missing from the atlas image get an empty range.
+        """
+        regions = np.asarray(regions, dtype=int)
+        bounds = np.zeros((len(regions), 2), dtype=np.int64)
+        if len(self.labels) == 0:
+            return bounds
+        positions = np.searchsorted(self.labels, regions)
+        clipped = np.minimum(positions, len(self.labels) - 1)
+        found = (positions < len(self.labels)) & (self.labels[clipped] == regions)
+        bounds[found, 0] = self.offsets[positions[found]]
+        bounds[found, 1] = self.offsets[positions[found] + 1]
+        return bounds
+
+    def crop(self, data: np.ndarray) -> np.ndarray:
+        """
+        Crop an image on the atlas' grid to the atlas' bounding box.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            Image data, on the atlas' grid.
+            May have trailing (non-spatial) dimensions.
+
+        Returns
+        -------
+        np.ndarray
+            A view of the data within the bounding box.
+        """
+        return data[self.slices]
+
+    def gather(self, metric_data: np.ndarray) -> np.ndarray:
+        """
+        Gather the values of a metric image in label-sorted order.
+        Only the atlas' bounding box of the metric is read.
+
+        Parameters
+        ----------
+        metric_data : np.ndarray
+            Metric image data, on the atlas' grid.
+            May have trailing (non-spatial) dimensions.
+
+        Returns
+        -------
+        np.ndarray
+            Metric values of the labeled voxels, one row per voxel.
+
+        Raises
+        ------
+        ValueError
+            If the metric image is not on the atlas' grid.
+        """
+        if tuple(metric_data.shape[:3]) != self.shape:
+            raise ValueError(
+                f"Metric image of shape {tuple(metric_data.shape[:3])} is not on "
+                f"the atlas' grid of shape {self.shape}."
+            )
+        cropped = np.asarray(self.crop(metric_data))
+        n_voxels = int(np.prod(self.bbox[:, 1] - self.bbox[:, 0]))
+        if cropped.size == n_voxels:
+            return cropped.reshape(-1)[self.order]
+        return cropped.reshape(n_voxels, -1)[self.order]
+
+    @property
+    def slices(self) -> tuple:
+        """
+        Slices of the atlas' bounding box.
+        """
+        return tuple(slice(start, stop) for start, stop in self.bbox)
+
+    @property
+    def n_voxels(self) -> int:
+        """
+        Number of voxels in the atlas' grid.
+        """
+        return int(np.prod(self.shape))
+
+    @property
+    def counts(self) -> np.ndarray:
+        """
+        Number of voxels of each label.
+        """
+        return np.diff(self.offsets)
+
+    @property
+    def voxel_volume(self) -> float:
+        """
+        Volume of a single voxel (in mm^3).
+        """
+        return float(np.prod(self.zooms))
@@ -7,12 +7,14 @@ from pathlib import Path
 import click
 
 from neuroflow.atlases.atlases import Atlases
+from neuroflow.atlases.qc import QC_MODES, render_cohort
 from neuroflow.connectome.connectome_reconstructor import ConnectomeReconstructor
 from neuroflow.covariates.covariates_collector import CovariatesCollector
 from neuroflow.files_mapper.files_mapper import FilesMapper
 from neuroflow.parcellation.parcellation import Parcellation
 from neuroflow.recon_tensors.dipy.dipy_tensors import DipyTensors
 from neuroflow.recon_tensors.mrtrix3.mrtrix3_tensors import MRTrix3Tensors
+from neuroflow.recon_tensors.native.native_tensors import NativeTensors
 from neuroflow.structural.smriprep_runner import SMRIPrepRunner
 
 AVAILABLE_STEPS = [
@@ -89,7 +91,7 @@ def cli():
 @click.option(
     "--steps",
     type=str,
-    help="Run specific steps",
+    help="Run specific steps (native_tensors only runs when requested)",
 )
 @click.option(
     "--nthreads",
@@ -97,6 +99,36 @@ def cli():
     default=1,
     help="Number of threads to use",
 )
+@click.option(
+    "--stack_metrics",
+    is_flag=True,
+    default=False,
+    help="Parcellate all tensor metrics at once into a single table per atlas",
+)
+@click.option(
+    "--t1w_atlases",
+    is_flag=True,
+    default=False,
+    help="Also write the atlases in the T1w space",
+)
+@click.option(
+    "--resampling",
+    type=click.Choice(["native", "fsl"]),
+    default="native",
+    help="Resample atlases in-process (native) or with FSL's tools (fsl)",
+)
+@click.option(
+    "--qc",
+    type=click.Choice(QC_MODES),
+    default="background",
+    help="Render the atlas registrations' QC images in the background, synchronously, later (deferred, see the qc command) or not at all",  # noqa: E501
+)
+@click.option(
+    "--output_format",
+    type=click.Choice(["pickle", "parquet", "feather"]),
+    default="pickle",
+    help="Format of the parcellation outputs (parquet/feather write a single table per session)",  # noqa: E501
+)
 @click.option(
     "--force",
     is_flag=True,
@@ -116,6 +148,11 @@ def process(
     ignore_steps: str,
     steps: str,
     nthreads: int,
+    stack_metrics: bool,
+    t1w_atlases: bool,
+    resampling: str,
+    qc: str,
+    output_format: str,
     force: bool,
 ):
     """
@@ -135,6 +172,16 @@ def process(
         The atlases to use for the analysis
     max_bval : int
         The maximum b-value for diffusion data
+    stack_metrics : bool
+        Parcellate all tensor metrics at once into a single table per atlas
+    t1w_atlases : bool
+        Also write the atlases in the T1w space
+    resampling : str
+        Method used to resample the atlases
+    qc : str
+        How the atlas registrations' QC images are rendered
+    output_format : str
+        Format of the parcellation outputs
     force : bool
         Force the processing of the data
     """
@@ -178,9 +225,13 @@ def process(
             crop_to_gm=crop_to_gm,
             use_smriprep=use_smriprep,
             smriprep_runner=smriprep_runner,
+            nthreads=nthreads,
+            resampling=resampling,
+            qc=qc,
         )
         print("Running atlas registrations...")
-        _ = atlases.register_atlas_to_t1w(force=force)
+        if t1w_atlases:
+            _ = atlases.register_atlas_to_t1w(force=force)
         _ = atlases.register_atlas_to_dwi(force=force)
     if "dipy_tensors" in steps:
         dipy_tensors = DipyTensors(
@@ -190,6 +241,9 @@ def process(
             tensors_manager=dipy_tensors,
             atlases_manager=atlases,
             output_directory=output_directory,
+            stack_metrics=stack_metrics,
+            nthreads=nthreads,
+            output_format=output_format,
         )
         print("Reconstructing tensors using Dipy...")
         _ = parcellation_dipy.run(force=force)
@@ -204,11 +258,31 @@ def process(
             tensors_manager=mrtrix3_tensors,
             atlases_manager=atlases,
             output_directory=output_directory,
+            stack_metrics=stack_metrics,
+            nthreads=nthreads,
+            output_format=output_format,
         )
         print(
             "Running atlas registrations and parcellations of MRtrix3-derived metrics..."  # noqa: E501
         )
         _ = parcellation_mrtrix3.run(force=force)
+    if "native_tensors" in steps:
+        native_tensors = NativeTensors(
+            mapper=mapper,
+            output_directory=output_directory,
+            max_bvalue=max_bval,
+            nthreads=nthreads,
+        )
+        parcellation_native = Parcellation(
+            tensors_manager=native_tensors,
+            atlases_manager=atlases,
+            output_directory=output_directory,
+            stack_metrics=stack_metrics,
+            nthreads=nthreads,
+            output_format=output_format,
+        )
+        print("Reconstructing tensors in-process...")
+        _ = parcellation_native.run(force=force)
     if "covariates" in steps:
         covariates = CovariatesCollector(
             mapper=mapper,
@@ -227,6 +301,94 @@ def process(
         )
         print("Reconstructing the connectome...")
         _ = connectome_recon.run(force=force)
+    if isinstance(atlases, Atlases):
+        atlases.qc_renderer.wait()
+
+
+@cli.command()
+@click.argument("root", type=click.Path(exists=True))
+@click.option(
+    "--patterns_file",
+    type=click.Path(exists=True),
+    help="Path to the patterns file",
+)
+@click.option(
+    "--nthreads",
+    type=int,
+    default=8,
+    help="Number of concurrent directory scans",
+)
+@click.option(
+    "--output",
+    type=click.Path(),
+    help="Path to a CSV file listing every session's files",
+)
+@click.option(
+    "--index",
+    type=click.Path(),
+    help="Path to a persistent index of the dataset, refreshed incrementally",
+)
+def discover(root: str, patterns_file: str, nthreads: int, output: str, index: str):
+    """
+    List the sessions of a dataset (<root>/<subject>/<session>) and their files.
+
+    Parameters
+    ----------
+    root : str
+        The path to the dataset's root directory
+    patterns_file : str
+        The path to the patterns file
+    nthreads : int
+        Number of concurrent directory scans
+    output : str
+        Path to a CSV file listing every session's files
+    index : str
+        Path to a persistent index of the dataset
+    """
+    kwargs = {"patterns": Path(patterns_file)} if patterns_file else {}
+    if index:
+        kwargs["index"] = Path(index)
+    discovered = FilesMapper.discover(Path(root), nthreads=nthreads, **kwargs)
+    complete = FilesMapper.complete_sessions(discovered)
+    n_sessions = discovered.groupby(["subject", "session"]).ngroups
+    print(f"Found {n_sessions} sessions, {len(complete)} of them complete.")
+    missing = discovered.loc[~discovered["exists"]]
+    for key, count in missing["key"].value_counts().items():
+        print(f"{key} missing in {count} sessions.")
+    if output:
+        discovered.to_csv(output, index=False)
+
+
+@cli.command()
+@click.argument("output_dir", type=click.Path(exists=True))
+@click.option(
+    "--nthreads",
+    type=int,
+    default=1,
+    help="Number of processes rendering the QC images",
+)
+@click.option(
+    "--force",
+    is_flag=True,
+    default=False,
+    help="Render the QC images that already exist too",
+)
+def qc(output_dir: str, nthreads: int, force: bool):
+    """
+    Render the pending atlas registration QC images of a cohort.
+
+    Parameters
+    ----------
+    output_dir : str
+        NeuroFlow's output directory
+    nthreads : int
+        Number of processes rendering the QC images
+    force : bool
+        Render the QC images that already exist too
+    """
+    print("Rendering the atlas registration QC images...")
+    n_images = render_cohort(Path(output_dir), nprocs=nthreads, force=force)
+    print(f"Rendered {n_images} QC images.")
 
 
 if __name__ == "__main__":
@@ -8,6 +8,7 @@ from typing import ClassVar, Optional
 import pandas as pd
 
 from neuroflow.atlases.atlases import Atlases
+from neuroflow.atlases.voxel_index import VoxelIndex
 from neuroflow.connectome.utils import COMBINATIONS
 from neuroflow.files_mapper import FilesMapper
 from neuroflow.interfaces.mrtrix3.mrtrix3 import BuildConnectome
@@ -42,13 +43,13 @@ class ConnectomeReconstructor:
         mapper : FilesMapper
             An instance of FilesMapper class.
         atlases_manager : Atlases
-            An instance of Atlases class.
+            An instance of Atlases class. Its whole-brain variant is used
+            (see :meth:`Atlases.variant`).
         output_directory : str
             Path to the output directory.
         """
         self.mapper = mapper
-        self.atlases_manager = atlases_manager
-        self.atlases_manager.crop_to_gm = False
+        self.atlases_manager = atlases_manager.variant(crop_to_gm=False)
         self.output_directory = self._gen_output_directory(output_directory)
         self.nthreads = nthreads
 
@@ -254,6 +255,31 @@ class ConnectomeReconstructor:
             return pd.read_csv(connectome["connectome"].values[0], header=None)
         return Path(connectome["connectome"].values[0])
 
+    def get_node_volumes(self, atlas: str) -> pd.DataFrame:
+        """
+        Get the volume of each node of a specific atlas, from the atlas'
+        cached voxel index (see :class:`VoxelIndex`) rather than its labels.
+
+        Parameters
+        ----------
+        atlas : str
+            Name of the atlas.
+
+        Returns
+        -------
+        pd.DataFrame
+            Number of voxels and volume (in mm^3) of each node.
+        """
+        nodes = self.atlases_manager.dwi_atlases[atlas].get("nifti")
+        voxel_index = VoxelIndex.from_file(nodes)
+        return pd.DataFrame(
+            {
+                "label": voxel_index.labels,
+                "n_voxels": voxel_index.counts,
+                "volume": voxel_index.counts * voxel_index.voxel_volume,
+            }
+        )
+
     @property
     def base_inputs(self) -> dict:
         """
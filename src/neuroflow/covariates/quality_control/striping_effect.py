@@ -6,9 +6,11 @@ import nibabel as nib
 import numpy as np
 from scipy.fft import fft, fftfreq
 
+from neuroflow.images import ImageLoader
+
 
 def calculate_strip_score(
-    input_file: Union[str, Path],
+    input_file: Union[str, Path, nib.Nifti1Image],
     axis=2,
     target_freq=0.25,
     freq_tolerance=0.05,
@@ -19,8 +21,8 @@ def calculate_strip_score(
 
     Parameters
     ----------
-    input_file : Union[str, Path]
-        The input NIfTI file
+    input_file : Union[str, Path, nib.Nifti1Image]
+        The input NIfTI file (or the loaded image)
     axis : int, optional
         The axis along which to calculate the striping score, by default 2
     target_freq : float, optional
@@ -33,9 +35,7 @@ def calculate_strip_score(
     float
         The striping score
     """
-    if isinstance(input_file, str) or isinstance(input_file, Path):
-        input_file = nib.load(input_file)
-    data = input_file.get_fdata()
+    data = ImageLoader().load_metric(input_file)
 
     # Load the NIfTI file
     # Compute the mean signal profile along the given axis
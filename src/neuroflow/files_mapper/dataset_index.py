@@ -0,0 +1,374 @@
+"""
+Persistent (SQLite) index of a dataset's files, refreshed incrementally.
+
+The index records the path, size and modification time of every pattern's
+file in every session of a dataset (``<root>/<subject>/<session>``), along
+with the modification times of the directories they were found in. Adding,
+removing or renaming an entry changes its directory's modification time, so
+a refresh only re-scans the sessions whose directories changed, and answers
+"which sessions have which files" without touching the others.
+
+Example:
+    >>> from neuroflow.files_mapper.dataset_index import DatasetIndex
+    >>> index = DatasetIndex("dataset.sqlite", "data")
+    >>> _ = index.refresh()
+    >>> sessions = index.sessions_with(["dwi_file", "t1w"])
+"""
+
+import json
+import os
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from pathlib import Path
+from typing import ClassVar, List, Optional, Union
+
+import pandas as pd
+
+from neuroflow.files_mapper.utils import (
+    list_subdirectories,
+    load_json_file,
+    resolve_patterns,
+    session_entities,
+)
+
+PARENT = Path(__file__).resolve().parent
+
+
+def directory_mtime(directory: Union[str, Path]) -> Optional[int]:
+    """
+    Get a directory's modification time.
+
+    Parameters
+    ----------
+    directory : Union[str, Path]
+        Path to the directory.
+
+    Returns
+    -------
+    Optional[int]
+        The modification time (in ns), or None if the directory is missing.
+    """
+    try:
+        return os.stat(directory).st_mtime_ns
+    except (FileNotFoundError, NotADirectoryError):
+        return None
+
+
+def stat_files(resolved: dict) -> List[tuple]:
+    """
+    Describe the resolved files of a session (see :func:`resolve_patterns`).
+
+    Parameters
+    ----------
+    resolved : dict
+        The path of each file type and whether it exists.
+
+    Returns
+    -------
+    List[tuple]
+        The key, path, existence, size and modification time of each file
+        (sizes and modification times are None for missing files).
+    """
+    rows = []
+    for key, (file, exists) in resolved.items():
+        size = mtime = None
+        if exists:
+            try:
+                stat = file.stat()
+                size, mtime = stat.st_size, stat.st_mtime_ns
+            except FileNotFoundError:
+                exists = False
+        rows.append((key, str(file), exists, size, mtime))
+    return rows
+
+
+class DatasetIndex:
+    """
+    A persistent index of the files of a dataset's sessions.
+    """
+
+    VERSION: ClassVar = 1
+    SCHEMA: ClassVar = [
+        "CREATE TABLE IF NOT EXISTS metadata (name TEXT PRIMARY KEY, value TEXT)",
+        "CREATE TABLE IF NOT EXISTS directories ("
+        "path TEXT PRIMARY KEY, parent TEXT, level INTEGER, mtime INTEGER)",
+        "CREATE TABLE IF NOT EXISTS files ("
+        "directory TEXT, subject TEXT, session TEXT, key TEXT, path TEXT, "
+        "exists_ INTEGER, size INTEGER, mtime INTEGER, "
+        "PRIMARY KEY (directory, key))",
+        "CREATE INDEX IF NOT EXISTS files_key ON files (key, exists_)",
+    ]
+    # levels of the indexed directories
+    ROOT, SUBJECT, SESSION, CONTENT = range(4)
+    COLUMNS: ClassVar = [
+        "subject",
+        "session",
+        "key",
+        "path",
+        "exists",
+        "directory",
+        "size",
+        "mtime",
+    ]
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        root: Union[str, Path],
+        patterns: Union[str, Path] = PARENT / "patterns.json",
+    ):
+        """
+        Initialize the DatasetIndex class.
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            Path to the index file.
+        root : Union[str, Path]
+            Path to the dataset's root directory.
+        patterns : Union[str, Path], optional
+            Path to json file containing the patterns to be used for mapping.
+        """
+        self.path = Path(path)
+        self.root = Path(root).resolve()
+        self.patterns = load_json_file(patterns)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with closing(self._connect()) as connection, connection:
+            for statement in self.SCHEMA:
+                connection.execute(statement)
+            self._check_metadata(connection)
+
+    def _connect(self) -> sqlite3.Connection:
+        """
+        Open the index.
+        """
+        return sqlite3.connect(self.path)
+
+    def _check_metadata(self, connection: sqlite3.Connection):
+        """
+        Clear the index if it was built for another dataset, other patterns
+        or by another version.
+        """
+        metadata = {
+            "version": str(self.VERSION),
+            "root": str(self.root),
+            "patterns": json.dumps(self.patterns, sort_keys=True),
+        }
+        stored = dict(connection.execute("SELECT name, value FROM metadata"))
+        if stored == metadata:
+            return
+        for table in ["metadata", "directories", "files"]:
+            connection.execute(f"DELETE FROM {table}")
+        connection.executemany(
+            "INSERT INTO metadata VALUES (?, ?)", list(metadata.items())
+        )
+
+    def _content_directories(self, session_directory: Path) -> List[Path]:
+        """
+        The directories a session's patterns point to (without scanning them).
+        """
+        subject, session = session_entities(session_directory)
+        return sorted(
+            {
+                (
+                    session_directory / pattern.format(subject=subject, session=session)
+                ).parent
+                for pattern in self.patterns.values()
+            }
+        )
+
+    def refresh(self, nthreads: int = 8) -> int:
+        """
+        Update the index, re-scanning only the directories whose modification
+        time changed since the last refresh.
+
+        Parameters
+        ----------
+        nthreads : int, optional
+            Number of concurrent directory scans, by default 8.
+
+        Returns
+        -------
+        int
+            The number of re-scanned sessions.
+        """
+        with closing(self._connect()) as connection:
+            stored = {
+                path: (parent, level, mtime)
+                for path, parent, level, mtime in connection.execute(
+                    "SELECT path, parent, level, mtime FROM directories"
+                )
+            }
+        children = {}
+        for path, (parent, _, _) in stored.items():
+            children.setdefault(parent, []).append(Path(path))
+        directories = {}
+
+        def list_children(directory: Path):
+            """
+            List a directory's sub-directories, from the index if unchanged.
+            """
+            mtime = directory_mtime(directory)
+            directories[directory] = mtime
+            cached = stored.get(str(directory))
+            if cached is not None and cached[2] == mtime:
+                return sorted(children.get(str(directory), []))
+            return list_subdirectories(directory)
+
+        def session_changed(directory: Path) -> bool:
+            """
+            Check (and record) the modification times of a session's
+            directories.
+            """
+            changed = False
+            for content_directory in [directory] + self._content_directories(directory):
+                mtime = directory_mtime(content_directory)
+                cached = stored.get(str(content_directory))
+                changed |= cached is None or cached[2] != mtime
+                directories[content_directory] = mtime
+            return changed
+
+        with ThreadPoolExecutor(max_workers=max(1, nthreads)) as executor:
+            subject_directories = list_children(self.root)
+            sessions = [
+                session_directory
+                for session_directories in executor.map(
+                    list_children, subject_directories
+                )
+                for session_directory in session_directories
+            ]
+            changed = [
+                session_directory
+                for session_directory, is_changed in zip(
+                    sessions, executor.map(session_changed, sessions)
+                )
+                if is_changed
+            ]
+            rescanned = list(executor.map(self._scan_session, changed))
+        self._write(subject_directories, sessions, directories, changed, rescanned)
+        return len(changed)
+
+    def _scan_session(self, session_directory: Path) -> List[tuple]:
+        """
+        Describe the files of a session (see :func:`stat_files`).
+        """
+        subject, session = session_entities(session_directory)
+        resolved = resolve_patterns(
+            session_directory, self.patterns, subject=subject, session=session
+        )
+        return [
+            (str(session_directory), subject, session, *row)
+            for row in stat_files(resolved)
+        ]
+
+    def _write(
+        self,
+        subject_directories: List[Path],
+        sessions: List[Path],
+        directories: dict,
+        changed: List[Path],
+        rescanned: List[List[tuple]],
+    ):
+        """
+        Replace the index's directories, and the files of re-scanned sessions.
+        """
+        subject_set = set(subject_directories)
+        session_set = set(sessions)
+
+        def describe(directory: Path) -> tuple:
+            if directory == self.root:
+                return None, self.ROOT
+            if directory in subject_set:
+                return str(self.root), self.SUBJECT
+            if directory in session_set:
+                return str(directory.parent), self.SESSION
+            return None, self.CONTENT
+
+        rows = [
+            (str(directory), *describe(directory), mtime)
+            for directory, mtime in directories.items()
+        ]
+        with closing(self._connect()) as connection, connection:
+            connection.execute("DELETE FROM directories")
+            connection.executemany(
+                "INSERT INTO directories VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            connection.execute("CREATE TEMP TABLE sessions (directory TEXT)")
+            connection.executemany(
+                "INSERT INTO sessions VALUES (?)",
+                [(str(directory),) for directory in sessions],
+            )
+            connection.execute(
+                "DELETE FROM files WHERE directory NOT IN "
+                "(SELECT directory FROM sessions)"
+            )
+            connection.executemany(
+                "DELETE FROM files WHERE directory = ?",
+                [(str(directory),) for directory in changed],
+            )
+            connection.executemany(
+                "INSERT INTO files VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [row for session_rows in rescanned for row in session_rows],
+            )
+
+    def files(self, keys: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Read the indexed files.
+
+        Parameters
+        ----------
+        keys : Optional[List[str]], optional
+            File types to read, by default all of them.
+
+        Returns
+        -------
+        pd.DataFrame
+            A row for each file type of each session (see
+            :meth:`FilesMapper.discover`), with the files' sizes and
+            modification times.
+        """
+        query = (
+            "SELECT subject, session, key, path, exists_, directory, size, mtime "
+            "FROM files"
+        )
+        parameters = []
+        if keys is not None:
+            query += f" WHERE key IN ({', '.join('?' * len(keys))})"
+            parameters = list(keys)
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                query + " ORDER BY directory, rowid", parameters
+            ).fetchall()
+        data = pd.DataFrame(rows, columns=self.COLUMNS)
+        data["exists"] = data["exists"].astype(bool)
+        data["path"] = data["path"].map(Path)
+        data["directory"] = data["directory"].map(Path)
+        return data
+
+    def sessions_with(self, keys: List[str]) -> pd.DataFrame:
+        """
+        List the sessions in which every file of the given types exists.
+
+        Parameters
+        ----------
+        keys : List[str]
+            File types the sessions must have.
+
+        Returns
+        -------
+        pd.DataFrame
+            The "subject", "session" and "directory" of each session.
+        """
+        placeholders = ", ".join("?" * len(keys))
+        with closing(self._connect()) as connection:
+            rows = connection.execute(
+                "SELECT subject, session, directory FROM files "
+                f"WHERE key IN ({placeholders}) AND exists_ = 1 "
+                "GROUP BY directory HAVING COUNT(*) = ? ORDER BY directory",
+                [*keys, len(set(keys))],
+            ).fetchall()
+        data = pd.DataFrame(rows, columns=["subject", "session", "directory"])
+        data["directory"] = data["directory"].map(Path)
+        return data
@@ -9,10 +9,19 @@ Example:
     0001
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Tuple, Union
+from typing import ClassVar, Optional, Tuple, Union
 
-from neuroflow.files_mapper.utils import load_json_file
+import pandas as pd
+
+from neuroflow.files_mapper.dataset_index import DatasetIndex
+from neuroflow.files_mapper.utils import (
+    list_subdirectories,
+    load_json_file,
+    resolve_patterns,
+    session_entities,
+)
 
 PARENT = Path(__file__).resolve().parent
 
@@ -22,6 +31,15 @@ class FilesMapper:
     A class used to map files to their respective patterns.
     """
 
+    DISCOVERY_COLUMNS: ClassVar = [
+        "subject",
+        "session",
+        "key",
+        "path",
+        "exists",
+        "directory",
+    ]
+
     def __init__(
         self,
         path: str,
@@ -42,6 +60,7 @@ class FilesMapper:
         self.path = Path(path)
         self.patterns = load_json_file(patterns)
         self._subject, self._session = self._identify_entities()
+        self._files = None
 
     def _identify_entities(self) -> Tuple[str, str]:
         """
@@ -52,13 +71,30 @@ class FilesMapper:
         Tuple[str,str]
             A tuple containing the subject's and session's ID.
         """
-        subject = self.path.parent.name.zfill(4)
-        session = self.path.name
-        return subject, session
+        return self.entities_of(self.path)
+
+    @staticmethod
+    def entities_of(path: Union[str, Path]) -> Tuple[str, str]:
+        """
+        Identify the subject's and session's ID of a session directory
+        (``<subject>/<session>``).
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            Path to the session directory.
+
+        Returns
+        -------
+        Tuple[str,str]
+            A tuple containing the subject's and session's ID.
+        """
+        return session_entities(path)
 
     def _map_files(self) -> dict:
         """
         Maps the files in the directory to their respective patterns.
+        Each sub-directory the patterns point to is scanned once.
 
         Returns
         -------
@@ -66,20 +102,35 @@ class FilesMapper:
             A dictionary containing the files as keys
             and their corresponding patterns as values.
         """
+        resolved = resolve_patterns(
+            self.path, self.patterns, subject=self.subject, session=self.session
+        )
         result = {}
-        for key, pattern in self.patterns.items():
-            file = self.path / pattern.format(
-                subject=self.subject, session=self.session
-            )
-            if not file.exists():
+        for key, (file, exists) in resolved.items():
+            if not exists:
                 raise FileNotFoundError(f"File {file} not found. ({key} missing.)")
             result[key] = file
         return result
 
+    def refresh(self) -> dict:
+        """
+        Resolve the files again, e.g. after they were (re)generated.
+
+        Returns
+        -------
+        dict
+            A dictionary containing the files as keys
+            and their corresponding patterns as values.
+        """
+        self._files = None
+        return self.files
+
     @property
     def files(self) -> dict:
         """
         Returns the files mapped to their respective patterns.
+        The files are resolved once, on first access (see :meth:`refresh`),
+        and each access gets its own copy of the mapping.
 
         Returns
         -------
@@ -87,7 +138,90 @@ class FilesMapper:
             A dictionary containing the files as keys
             and their corresponding patterns as values.
         """
-        return self._map_files()
+        if self._files is None:
+            self._files = self._map_files()
+        return dict(self._files)
+
+    @classmethod
+    def discover(
+        cls,
+        root: Union[str, Path],
+        patterns: Union[str, Path] = PARENT / "patterns.json",
+        nthreads: int = 8,
+        index: Optional[Union[str, Path]] = None,
+    ) -> pd.DataFrame:
+        """
+        Walk a dataset (``<root>/<subject>/<session>``) once, and check which
+        files of every session are present. Directories are scanned in a
+        thread pool, since each scan may wait on a network file system.
+        With an index file, only the sessions whose directories changed since
+        the previous discovery are re-scanned (see :class:`DatasetIndex`).
+
+        Parameters
+        ----------
+        root : Union[str, Path]
+            Path to the dataset's root directory.
+        patterns : Union[str, Path], optional
+            Path to json file containing the patterns to be used for mapping.
+        nthreads : int, optional
+            Number of concurrent directory scans, by default 8.
+        index : Optional[Union[str, Path]], optional
+            Path to a persistent index of the dataset, by default None
+
+        Returns
+        -------
+        pd.DataFrame
+            A row for each file type of each session, with the session's
+            "subject" and "session" IDs, the file type ("key"), its "path",
+            whether it "exists" and the session's "directory".
+        """
+        if index is not None:
+            dataset_index = DatasetIndex(index, root, patterns)
+            dataset_index.refresh(nthreads=nthreads)
+            return dataset_index.files()[cls.DISCOVERY_COLUMNS]
+        patterns = load_json_file(patterns)
+
+        def resolve(directory: Path) -> dict:
+            subject, session = cls.entities_of(directory)
+            return resolve_patterns(
+                directory, patterns, subject=subject, session=session
+            )
+
+        with ThreadPoolExecutor(max_workers=max(1, nthreads)) as executor:
+            subject_directories = list_subdirectories(root)
+            session_directories = [
+                directory
+                for directories in executor.map(
+                    list_subdirectories, subject_directories
+                )
+                for directory in directories
+            ]
+            resolved = executor.map(resolve, session_directories)
+            rows = [
+                (*cls.entities_of(directory), key, file, exists, directory)
+                for directory, files in zip(session_directories, resolved)
+                for key, (file, exists) in files.items()
+            ]
+        return pd.DataFrame(rows, columns=cls.DISCOVERY_COLUMNS)
+
+    @staticmethod
+    def complete_sessions(discovered: pd.DataFrame) -> pd.DataFrame:
+        """
+        Keep the sessions whose files are all present.
+
+        Parameters
+        ----------
+        discovered : pd.DataFrame
+            Discovered files (see :meth:`discover`).
+
+        Returns
+        -------
+        pd.DataFrame
+            The "subject", "session" and "directory" of each complete session.
+        """
+        columns = ["subject", "session", "directory"]
+        complete = discovered.groupby(columns, sort=False)["exists"].all()
+        return complete[complete].reset_index()[columns]
 
     @property
     def subject(self) -> str:
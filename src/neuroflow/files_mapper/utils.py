@@ -2,9 +2,11 @@
 This module contains utility functions for working with files.
 """
 
+import hashlib
 import json
+import os
 from pathlib import Path
-from typing import Union
+from typing import Tuple, Union
 
 
 def load_json_file(file_path: Union[str, Path]):
@@ -23,3 +25,119 @@ def load_json_file(file_path: Union[str, Path]):
         print(f"The file {file_path} was not found.")
     except json.JSONDecodeError:
         print(f"The file {file_path} could not be decoded as JSON.")
+
+
+def hash_file(file_path: Union[str, Path], chunk_size: int = 1 << 20) -> str:
+    """
+    Compute the SHA-256 digest of a file's content.
+
+    :param file_path: The path to the file to hash.
+    :param chunk_size: The number of bytes read at a time.
+    :return: The hexadecimal digest of the file's content.
+    """
+    digest = hashlib.sha256()
+    with Path.open(Path(file_path), "rb") as file:
+        for chunk in iter(lambda: file.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_signature(file_path: Union[str, Path], hash_content: bool = True) -> dict:
+    """
+    Describe a file by its size, modification time and (optionally) content hash.
+
+    :param file_path: The path to the file to describe.
+    :param hash_content: Whether to include the SHA-256 digest of the file.
+    :return: A dictionary with the "size", "mtime" and "sha256" of the file.
+    """
+    stat = Path(file_path).stat()
+    signature = {"size": stat.st_size, "mtime": stat.st_mtime_ns}
+    if hash_content:
+        signature["sha256"] = hash_file(file_path)
+    return signature
+
+
+def inputs_signature(inputs: dict) -> dict:
+    """
+    Describe the inputs of a processing step. Files are described by their size
+    and modification time, so that replacing any of them changes the signature.
+
+    :param inputs: The inputs of the step (paths, plain values or nested dicts).
+    :return: The signature of the inputs.
+    """
+    signature = {}
+    for key, value in inputs.items():
+        if isinstance(value, dict):
+            signature[key] = inputs_signature(value)
+        elif isinstance(value, Path) and value.exists():
+            signature[key] = (str(value), file_signature(value, hash_content=False))
+        else:
+            signature[key] = str(value) if isinstance(value, Path) else value
+    return signature
+
+
+def scan_directory(directory: Union[str, Path]) -> set:
+    """
+    List the names of a directory's entries with a single ``os.scandir`` call.
+
+    :param directory: The path to the directory to scan.
+    :return: The names of the directory's entries (empty if it does not exist).
+    """
+    try:
+        with os.scandir(directory) as entries:
+            return {entry.name for entry in entries}
+    except (FileNotFoundError, NotADirectoryError):
+        return set()
+
+
+def list_subdirectories(directory: Union[str, Path]) -> list:
+    """
+    List the (non-hidden) sub-directories of a directory, sorted by name.
+
+    :param directory: The path to the directory to scan.
+    :return: The paths of the sub-directories.
+    """
+    try:
+        with os.scandir(directory) as entries:
+            return sorted(
+                Path(entry.path)
+                for entry in entries
+                if entry.is_dir() and not entry.name.startswith(".")
+            )
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+
+
+def resolve_patterns(directory: Union[str, Path], patterns: dict, **entities) -> dict:
+    """
+    Resolve file patterns within a directory, scanning each of the
+    sub-directories they point to once.
+
+    :param directory: The path to the directory the patterns are relative to.
+    :param patterns: The patterns, keyed by file type.
+    :param entities: The values of the patterns' placeholders (e.g. subject).
+    :return: A dictionary with the path of each file type and whether it exists.
+    """
+    directory = Path(directory)
+    files = {
+        key: directory / pattern.format(**entities) for key, pattern in patterns.items()
+    }
+    listings = {}
+    result = {}
+    for key, file in files.items():
+        if file.parent not in listings:
+            listings[file.parent] = scan_directory(file.parent)
+        result[key] = (file, file.name in listings[file.parent])
+    return result
+
+
+def session_entities(directory: Union[str, Path]) -> Tuple[str, str]:
+    """
+    Identify the subject's and session's ID of a session directory
+    (``<subject>/<session>``).
+
+    :param directory: The path to the session directory.
+    :return: A tuple containing the subject's and session's ID.
+    """
+    directory = Path(directory)
+    return directory.parent.name.zfill(4), directory.name
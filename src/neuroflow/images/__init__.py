@@ -0,0 +1,6 @@
+"""
+This module contains the image access layer of NeuroFlow.
+"""
+
+from neuroflow.images.images import ImageLoader  # noqa: F401
+from neuroflow.images.mif import load_mif  # noqa: F401
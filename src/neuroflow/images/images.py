@@ -0,0 +1,125 @@
+"""
+Image access layer for NeuroFlow.
+
+Unlike ``get_fdata()``, which upcasts every image to float64 and materializes
+it in memory, the loader keeps label images as integers, reads metric images
+in a (configurable) floating point precision and memory-maps uncompressed
+images whenever their on-disk data can be used as-is.
+
+Example:
+    >>> from neuroflow.images import ImageLoader
+    >>> loader = ImageLoader(metric_dtype="float32")
+    >>> fa = loader.load_metric("sub-0001_ses-1_desc-fa_dwiref.nii")
+"""
+
+from pathlib import Path
+from typing import ClassVar, Union
+
+import nibabel as nib
+import numpy as np
+
+from neuroflow.images.mif import is_mif, load_mif
+
+Image = Union[str, Path, nib.spatialimages.SpatialImage]
+
+
+class ImageLoader:
+    """
+    Load label and metric images without unnecessary copies or upcasts.
+    """
+
+    LABEL_DTYPE: ClassVar = np.int32
+    METRIC_DTYPE: ClassVar = np.float32
+
+    def __init__(
+        self,
+        metric_dtype: Union[str, np.dtype] = METRIC_DTYPE,
+        mmap: bool = True,
+    ):
+        """
+        Initialize the ImageLoader class.
+
+        Parameters
+        ----------
+        metric_dtype : Union[str, np.dtype], optional
+            Floating point precision of metric data, by default float32.
+        mmap : bool, optional
+            Whether to memory-map uncompressed images, by default True.
+        """
+        self.metric_dtype = np.dtype(metric_dtype)
+        self.mmap = mmap
+
+    def load(self, image: Image) -> nib.spatialimages.SpatialImage:
+        """
+        Load an image (memory-mapping it if possible).
+        MRtrix3 images (``.mif``/``.mif.gz``) are read into memory.
+
+        Parameters
+        ----------
+        image : Image
+            Path to the image, or an already loaded image.
+
+        Returns
+        -------
+        nib.spatialimages.SpatialImage
+            The loaded image.
+        """
+        if isinstance(image, (str, Path)):
+            if is_mif(image):
+                return load_mif(image)
+            return nib.load(str(image), mmap=self.mmap)
+        return image
+
+    @staticmethod
+    def _is_unscaled(image: nib.spatialimages.SpatialImage) -> bool:
+        """
+        Check whether the on-disk data of an image is used without scaling.
+        """
+        dataobj = image.dataobj
+        if not nib.is_proxy(dataobj):
+            return True
+        slope = getattr(dataobj, "slope", 1.0)
+        inter = getattr(dataobj, "inter", 0.0)
+        return (np.isnan(slope) or slope == 1) and (np.isnan(inter) or inter == 0)
+
+    def load_labels(self, image: Image) -> np.ndarray:
+        """
+        Load the data of a label image as integers.
+
+        Parameters
+        ----------
+        image : Image
+            Path to the label image, or an already loaded image.
+
+        Returns
+        -------
+        np.ndarray
+            Integer label data (memory-mapped when stored as unscaled
+            integers in an uncompressed file).
+        """
+        image = self.load(image)
+        if np.issubdtype(image.get_data_dtype(), np.integer) and self._is_unscaled(
+            image
+        ):
+            return np.asanyarray(image.dataobj)
+        return np.rint(np.asanyarray(image.dataobj)).astype(self.LABEL_DTYPE)
+
+    def load_metric(self, image: Image) -> np.ndarray:
+        """
+        Load the data of a metric image as floating point values.
+
+        Parameters
+        ----------
+        image : Image
+            Path to the metric image, or an already loaded image.
+
+        Returns
+        -------
+        np.ndarray
+            Metric data in the loader's precision (memory-mapped when stored
+            unscaled, in that precision, in an uncompressed file).
+        """
+        image = self.load(image)
+        if image.get_data_dtype() == self.metric_dtype and self._is_unscaled(image):
+            return np.asanyarray(image.dataobj)
+        return image.get_fdata(dtype=self.metric_dtype)
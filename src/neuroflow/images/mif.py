@@ -0,0 +1,152 @@
+"""
+Reader of MRtrix3's image format (``.mif`` and ``.mif.gz``).
+
+Example:
+    >>> from neuroflow.images.mif import load_mif
+    >>> five_tissue_type = load_mif("segmentation_t1.mif")
+    >>> five_tissue_type.shape
+    (256, 256, 256, 5)
+"""
+
+import gzip
+import re
+from pathlib import Path
+from typing import Union
+
+import nibabel as nib
+import numpy as np
+
+MIF_MAGIC = "mrtrix image"
+MIF_DATATYPES = {
+    "int8": "i1",
+    "uint8": "u1",
+    "int16": "i2",
+    "uint16": "u2",
+    "int32": "i4",
+    "uint32": "u4",
+    "int64": "i8",
+    "uint64": "u8",
+    "float32": "f4",
+    "float64": "f8",
+    "cfloat32": "c8",
+    "cfloat64": "c16",
+}
+
+
+def is_mif(file_path: Union[str, Path]) -> bool:
+    """
+    Check whether a file is in MRtrix3's image format.
+
+    Parameters
+    ----------
+    file_path : Union[str, Path]
+        Path to the image.
+
+    Returns
+    -------
+    bool
+        True for ``.mif`` and ``.mif.gz`` files.
+    """
+    return Path(file_path).name.endswith((".mif", ".mif.gz"))
+
+
+def parse_mif_datatype(datatype: str) -> np.dtype:
+    """
+    Convert an MRtrix3 datatype (e.g. "Float32LE") to a numpy dtype.
+
+    Parameters
+    ----------
+    datatype : str
+        MRtrix3 datatype.
+
+    Returns
+    -------
+    np.dtype
+        The corresponding numpy dtype.
+    """
+    match = re.fullmatch(r"(c?[a-z]+\d+)(le|be)?", datatype.strip().lower())
+    if match is None or match.group(1) not in MIF_DATATYPES:
+        raise ValueError(f"Unsupported MRtrix3 datatype: {datatype}.")
+    byte_order = {"le": "<", "be": ">", None: "="}[match.group(2)]
+    return np.dtype(byte_order + MIF_DATATYPES[match.group(1)])
+
+
+def parse_mif_header(content: bytes) -> dict:
+    """
+    Parse the header of an MRtrix3 image.
+
+    Parameters
+    ----------
+    content : bytes
+        The content of the image file (at least its header).
+
+    Returns
+    -------
+    dict
+        The header's keys, with the values of repeated keys (such as
+        "transform") gathered into lists.
+    """
+    end = content.find(b"\nEND\n")
+    if not content.startswith(MIF_MAGIC.encode()) or end < 0:
+        raise ValueError("Not an MRtrix3 image.")
+    start = len(MIF_MAGIC)
+    header = {}
+    for line in content[start:end].decode("latin-1").splitlines():
+        if ":" not in line:
+            continue
+        key, value = (part.strip() for part in line.split(":", 1))
+        header.setdefault(key, []).append(value)
+    return header
+
+
+def load_mif(file_path: Union[str, Path]) -> nib.Nifti1Image:
+    """
+    Load an MRtrix3 image as a NIfTI image.
+
+    Parameters
+    ----------
+    file_path : Union[str, Path]
+        Path to the ``.mif`` or ``.mif.gz`` image.
+
+    Returns
+    -------
+    nib.Nifti1Image
+        The image, with its data in the order of the image's axes.
+    """
+    file_path = Path(file_path)
+    opener = gzip.open if file_path.name.endswith(".gz") else Path.open
+    with opener(file_path, "rb") as f:
+        content = f.read()
+    header = parse_mif_header(content)
+    shape = tuple(int(dim) for dim in header["dim"][0].split(","))
+    zooms = [float(zoom) for zoom in header["vox"][0].split(",")]
+    layout = [axis.strip() for axis in header["layout"][0].split(",")]
+    dtype = parse_mif_datatype(header["datatype"][0])
+    data_file, offset = header["file"][0].split()
+    if data_file != ".":
+        with opener(file_path.parent / data_file, "rb") as f:
+            content = f.read()
+    data = np.frombuffer(
+        content, dtype=dtype, count=int(np.prod(shape)), offset=int(offset)
+    )
+    # axes are stored from the fastest ("+0") to the slowest varying one
+    ranks = [int(axis[1:]) for axis in layout]
+    storage_axes = np.argsort(ranks)
+    data = data.reshape([shape[axis] for axis in storage_axes[::-1]])
+    data = data.transpose(np.argsort(storage_axes[::-1]))
+    for axis, spec in enumerate(layout):
+        if spec.startswith("-"):
+            data = np.flip(data, axis=axis)
+    if "scaling" in header:
+        offset, scale = (float(value) for value in header["scaling"][0].split(","))
+        if offset != 0 or scale != 1:
+            data = offset + scale * data.astype(np.float64)
+    affine = np.eye(4)
+    rotation = np.array(
+        [[float(value) for value in row.split(",")] for row in header["transform"]]
+    )
+    affine[:3, :3] = rotation[:, :3] * np.asarray(zooms[:3])
+    affine[:3, 3] = rotation[:, 3]
+    image = nib.Nifti1Image(np.ascontiguousarray(data), affine)
+    image.header.set_zooms([*zooms[:3], *[1.0] * (data.ndim - 3)][: data.ndim])
+    return image
@@ -20,6 +20,8 @@ from nipype.interfaces import fsl
 from surfplot import Plot
 from tqdm import tqdm
 
+from neuroflow.images import ImageLoader
+
 
 def map_groups_to_colors(group_labels):
     """
@@ -94,14 +96,17 @@ class Visualizations:
                 Matching column: {match_by}.
                 Value column: {value_column}."""
             )
-        labeled_img = nib.load(str(labeled_img_path))
-        labeled_img_data = labeled_img.get_fdata()
-        template_data = np.zeros_like(labeled_img_data)
+        image_loader = ImageLoader()
+        labeled_img = image_loader.load(labeled_img_path)
+        labeled_img_data = image_loader.load_labels(labeled_img)
+        template_data = np.zeros(labeled_img_data.shape, dtype=np.float32)
         for _, row in tqdm(df.iterrows()):
             label = row[match_by]
             value = row[value_column]
             template_data[labeled_img_data == label] = value
-        return nib.Nifti1Image(template_data, labeled_img.affine, labeled_img.header)
+        result = nib.Nifti1Image(template_data, labeled_img.affine, labeled_img.header)
+        result.set_data_dtype(template_data.dtype)
+        return result
 
     @staticmethod
     def nifti_to_surface_matlab(
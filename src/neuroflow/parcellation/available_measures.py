@@ -3,7 +3,7 @@ from scipy.stats import median_abs_deviation
 
 
 # Custom measures
-def zfmean(data: np.ndarray, threshold=3) -> float:
+def zfmean(data: np.ndarray, threshold=3, axis=None) -> float:
     """
     Z Filtered Mean
 
@@ -13,19 +13,21 @@ def zfmean(data: np.ndarray, threshold=3) -> float:
         Input data.
     threshold : float, optional
         Z-score threshold, by default 3.
+    axis : int, optional
+        Axis along which the measure is computed, by default None (all data).
 
     Returns
     -------
     float
         Z Filtered Mean
     """
-    m = np.nanmean(data)
-    s = np.nanstd(data)
+    m = np.nanmean(data, axis=axis, keepdims=True)
+    s = np.nanstd(data, axis=axis, keepdims=True)
     z_scores = np.abs((data - m) / s)
-    return np.nanmean(data[z_scores < threshold])
+    return np.nanmean(np.where(z_scores < threshold, data, np.nan), axis=axis)
 
 
-def madmedian(data: np.ndarray, threshold=3) -> float:
+def madmedian(data: np.ndarray, threshold=3, axis=None) -> float:
     """
     Median of MAD-filtered data
 
@@ -35,20 +37,25 @@ def madmedian(data: np.ndarray, threshold=3) -> float:
         Input data.
     threshold : float, optional
         Z-score threshold, by default 3.
+    axis : int, optional
+        Axis along which the measure is computed, by default None (all data).
 
     Returns
     -------
     float
         Median of MAD-filtered data
     """
-    m = np.nanmedian(data)
+    m = np.nanmedian(data, axis=axis, keepdims=True)
     # calculate the median absolute deviation where data is not NaN
-    mad = median_abs_deviation(data, nan_policy="omit")
-    filtered_data = data[np.abs(data - m) < threshold * mad]
-    return np.nanmedian(filtered_data)
+    mad = median_abs_deviation(
+        data, axis=0 if axis is None else axis, nan_policy="omit"
+    )
+    mad = np.expand_dims(mad, axis) if axis is not None else mad
+    filtered_data = np.where(np.abs(data - m) < threshold * mad, data, np.nan)
+    return np.nanmedian(filtered_data, axis=axis)
 
 
-def qfmean(data: np.ndarray, lower_quantile=10, upper_quantile=90) -> float:
+def qfmean(data: np.ndarray, lower_quantile=10, upper_quantile=90, axis=None) -> float:
     """
     Quantile Filtered Mean
 
@@ -60,18 +67,22 @@ def qfmean(data: np.ndarray, lower_quantile=10, upper_quantile=90) -> float:
         Lower quantile, by default 10.
     upper_quantile : int, optional
         Upper quantile, by default 90.
+    axis : int, optional
+        Axis along which the measure is computed, by default None (all data).
 
     Returns
     -------
     float
         Quantile Filtered Mean
     """
-    lower = np.nanpercentile(data, lower_quantile)
-    upper = np.nanpercentile(data, upper_quantile)
-    return np.nanmean(data[(data > lower) & (data < upper)])
+    lower = np.nanpercentile(data, lower_quantile, axis=axis, keepdims=True)
+    upper = np.nanpercentile(data, upper_quantile, axis=axis, keepdims=True)
+    return np.nanmean(
+        np.where((data > lower) & (data < upper), data, np.nan), axis=axis
+    )
 
 
-def iqrmean(data: np.ndarray) -> float:
+def iqrmean(data: np.ndarray, axis=None) -> float:
     """
     IQR Filtered Mean
 
@@ -79,17 +90,17 @@ def iqrmean(data: np.ndarray) -> float:
     ----------
     data : np.ndarray
         Input data.
-    threshold : float, optional
-        IQR threshold, by default 1.5.
+    axis : int, optional
+        Axis along which the measure is computed, by default None (all data).
 
     Returns
     -------
     float
         IQR Filtered Mean
     """
-    q75 = np.nanpercentile(data, 75)
-    q25 = np.nanpercentile(data, 25)
-    return np.nanmean(data[(data >= q25) & (data <= q75)])
+    q75 = np.nanpercentile(data, 75, axis=axis, keepdims=True)
+    q25 = np.nanpercentile(data, 25, axis=axis, keepdims=True)
+    return np.nanmean(np.where((data >= q25) & (data <= q75), data, np.nan), axis=axis)
 
 
 AVAILABLE_MEASURES = {
@@ -0,0 +1,325 @@
+"""
+Measure kernels for NeuroFlow's parcellation.
+
+The quantile-based measures (see :mod:`available_measures`) all need order
+statistics of the same region's voxels. A :class:`RegionKernel` partially
+sorts a region once, on every rank the requested measures need, and the
+kernel implementations of the measures derive their values from it.
+"""
+
+from typing import ClassVar, Iterable, Optional
+
+import numpy as np
+
+from neuroflow.parcellation.available_measures import iqrmean, madmedian, qfmean, zfmean
+
+
+def _lerp(a, b, t):
+    """
+    Linear interpolation between two order statistics, computed exactly like
+    numpy's own percentile interpolation (so results match bit for bit).
+    """
+    diff_b_a = np.subtract(b, a)
+    lerp = np.asanyarray(np.add(a, diff_b_a * t))
+    np.subtract(
+        b,
+        diff_b_a * (1 - t),
+        out=lerp,
+        where=t >= 0.5,
+        casting="unsafe",
+        dtype=type(lerp.dtype),
+    )
+    if lerp.ndim == 0:
+        lerp = lerp[()]
+    return lerp
+
+
+def _masked_mean(data: np.ndarray, mask: np.ndarray):
+    """
+    Mean of the masked values of each column of the data.
+    """
+    return np.nanmean(np.where(mask, data, np.nan), axis=0)
+
+
+def _masked_median(data: np.ndarray, mask: np.ndarray):
+    """
+    Median of the masked values of each column of the data.
+    """
+    if data.ndim == 1:
+        return np.median(data[mask]) if mask.any() else np.nan
+    return np.nanmedian(np.where(mask, data, np.nan), axis=0)
+
+
+class RegionKernel:
+    """
+    The voxel values of a single region, partially sorted once on the ranks
+    required by the quantile-based measures.
+    """
+
+    def __init__(
+        self,
+        data: np.ndarray,
+        percentiles: Iterable[float] = (),
+        median: bool = False,
+        nan_free: bool = False,
+    ):
+        """
+        Initialize the RegionKernel class.
+
+        Parameters
+        ----------
+        data : np.ndarray
+            Values of the region's voxels, either a vector or a
+            (n_voxels, n_columns) matrix whose columns are reduced separately.
+        percentiles : Iterable[float], optional
+            Percentiles (0-100) that will be queried, by default none.
+        median : bool, optional
+            Whether the median will be queried, by default False.
+        nan_free : bool, optional
+            Whether the data is known to be NaN-free, by default False.
+            Matrices must be NaN-free.
+        """
+        self.values = np.asarray(data)
+        self.nan_free = nan_free
+        if not nan_free:
+            if self.values.ndim != 1:
+                raise ValueError("Only NaN-free matrices can be partitioned.")
+            data = self.values[~np.isnan(self.values)]
+        else:
+            data = self.values
+        self.data = data
+        self.size = data.shape[0]
+        self._ranks = {}
+        kth = set()
+        for percentile in percentiles:
+            self._ranks[percentile] = self._percentile_ranks(percentile)
+            kth.update(self._ranks[percentile][:2])
+        if median:
+            kth.update(self._median_ranks())
+        self.partitioned = (
+            np.partition(data, sorted(kth), axis=0) if kth and self.size else data
+        )
+
+    def _percentile_ranks(self, percentile: float) -> tuple:
+        """
+        Ranks surrounding a percentile's (linear) virtual index, and the
+        interpolation weight between them.
+        """
+        virtual_index = (self.size - 1) * np.true_divide(percentile, 100)
+        previous = min(max(int(np.floor(virtual_index)), 0), max(self.size - 1, 0))
+        following = min(previous + 1, max(self.size - 1, 0))
+        gamma = np.asanyarray(virtual_index - np.floor(virtual_index))
+        return previous, following, gamma.reshape((1,) * (self.data.ndim - 1))
+
+    def _median_ranks(self) -> list:
+        """
+        The middle rank(s) of the data.
+        """
+        half = self.size // 2
+        return [half] if self.size % 2 else [half - 1, half]
+
+    def _empty(self):
+        """
+        The result of reducing an empty region.
+        """
+        if self.data.ndim == 1:
+            return np.nan
+        return np.full(self.data.shape[1:], np.nan)
+
+    def percentile(self, percentile: float):
+        """
+        Compute a percentile of the data (like ``np.nanpercentile``).
+
+        Parameters
+        ----------
+        percentile : float
+            Percentile to compute (0-100), one of those the kernel was
+            partitioned for.
+
+        Returns
+        -------
+        Union[float, np.ndarray]
+            The percentile of the data (of each column).
+        """
+        if not self.size:
+            return self._empty()
+        previous, following, gamma = self._ranks[percentile]
+        return _lerp(self.partitioned[previous], self.partitioned[following], gamma)
+
+    def median(self):
+        """
+        Compute the median of the data (like ``np.nanmedian``).
+
+        Returns
+        -------
+        Union[float, np.ndarray]
+            The median of the data (of each column).
+        """
+        if not self.size:
+            return self._empty()
+        ranks = self._median_ranks()
+        start, stop = ranks[0], ranks[-1] + 1
+        return np.mean(self.partitioned[start:stop], axis=0)
+
+    def mean(self):
+        """
+        Compute the mean of the data (like ``np.nanmean``).
+
+        Returns
+        -------
+        Union[float, np.ndarray]
+            The mean of the data (of each column).
+        """
+        if not self.size:
+            return self._empty()
+        if self.nan_free:
+            return np.mean(self.values, axis=0)
+        return np.nanmean(self.values, axis=0)
+
+    def std(self):
+        """
+        Compute the standard deviation of the data (like ``np.nanstd``).
+
+        Returns
+        -------
+        Union[float, np.ndarray]
+            The standard deviation of the data (of each column).
+        """
+        if not self.size:
+            return self._empty()
+        if self.nan_free:
+            return np.std(self.values, axis=0)
+        return np.nanstd(self.values, axis=0)
+
+
+def kernel_zfmean(kernel: RegionKernel, threshold=3):
+    """
+    Kernel implementation of :func:`available_measures.zfmean`.
+    """
+    if not kernel.size:
+        return kernel._empty()
+    z_scores = np.abs((kernel.values - kernel.mean()) / kernel.std())
+    return _masked_mean(kernel.values, z_scores < threshold)
+
+
+def kernel_madmedian(kernel: RegionKernel, threshold=3):
+    """
+    Kernel implementation of :func:`available_measures.madmedian`.
+    """
+    if not kernel.size:
+        return kernel._empty()
+    median = kernel.median()
+    mad = np.median(np.abs(kernel.data - median), axis=0)
+    deviations = np.abs(kernel.values - median)
+    return _masked_median(kernel.values, deviations < threshold * mad)
+
+
+def kernel_qfmean(kernel: RegionKernel, lower_quantile=10, upper_quantile=90):
+    """
+    Kernel implementation of :func:`available_measures.qfmean`.
+    """
+    if not kernel.size:
+        return kernel._empty()
+    lower = kernel.percentile(lower_quantile)
+    upper = kernel.percentile(upper_quantile)
+    values = kernel.values
+    return _masked_mean(values, (values > lower) & (values < upper))
+
+
+def kernel_iqrmean(kernel: RegionKernel):
+    """
+    Kernel implementation of :func:`available_measures.iqrmean`.
+    """
+    if not kernel.size:
+        return kernel._empty()
+    q75 = kernel.percentile(75)
+    q25 = kernel.percentile(25)
+    values = kernel.values
+    return _masked_mean(values, (values >= q25) & (values <= q75))
+
+
+class MeasureKernels:
+    """
+    Computes several measures of a region from a single :class:`RegionKernel`.
+    Measures without a kernel implementation are applied to the raw values.
+    """
+
+    KERNELS: ClassVar = {
+        zfmean: {"function": kernel_zfmean, "percentiles": [], "median": False},
+        madmedian: {"function": kernel_madmedian, "percentiles": [], "median": True},
+        qfmean: {"function": kernel_qfmean, "percentiles": [10, 90], "median": False},
+        iqrmean: {"function": kernel_iqrmean, "percentiles": [25, 75], "median": False},
+        np.nanmean: {"function": RegionKernel.mean, "percentiles": [], "median": False},
+        np.nanmedian: {
+            "function": RegionKernel.median,
+            "percentiles": [],
+            "median": True,
+        },
+    }
+
+    def __init__(self, measures: dict):
+        """
+        Initialize the MeasureKernels class.
+
+        Parameters
+        ----------
+        measures : dict
+            Measure functions, keyed by the name of their output column.
+        """
+        self.measures = measures
+        kernels = [self.KERNELS.get(measure) for measure in measures.values()]
+        self.functions = [kernel["function"] if kernel else None for kernel in kernels]
+        self.percentiles = sorted(
+            {q for kernel in kernels if kernel for q in kernel["percentiles"]}
+        )
+        self.median = any(kernel["median"] for kernel in kernels if kernel)
+        self.has_kernels = any(kernels)
+
+    def reduce(
+        self, region_values: np.ndarray, nan_free: bool = False, axis=None
+    ) -> list:
+        """
+        Apply every measure to the values of a region.
+
+        Parameters
+        ----------
+        region_values : np.ndarray
+            Values of the region's voxels.
+        nan_free : bool, optional
+            Whether the values are known to be NaN-free, by default False.
+        axis : int, optional
+            Axis passed to the measures, by default None (reduce all values).
+            Use 0 to reduce each column of stacked values separately.
+
+        Returns
+        -------
+        list
+            The result of each measure.
+        """
+        kwargs = {} if axis is None else {"axis": axis}
+        kernel = self._build_kernel(region_values, nan_free, axis)
+        return [
+            (
+                function(kernel)
+                if kernel is not None and function is not None
+                else measure(region_values, **kwargs)
+            )
+            for function, measure in zip(self.functions, self.measures.values())
+        ]
+
+    def _build_kernel(
+        self, region_values: np.ndarray, nan_free: bool, axis=None
+    ) -> Optional[RegionKernel]:
+        """
+        Partition the region's values, if the kernels can reduce them.
+        """
+        vector = axis is None and region_values.ndim == 1
+        columns = axis == 0 and region_values.ndim == 2 and nan_free
+        if not self.has_kernels or not (vector or columns):
+            return None
+        return RegionKernel(
+            region_values,
+            percentiles=self.percentiles,
+            median=self.median,
+            nan_free=nan_free,
+        )
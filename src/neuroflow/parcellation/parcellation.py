@@ -2,14 +2,25 @@
 Parcellation module for NeuroFlow.
 """
 
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
 from typing import Callable, ClassVar, Optional, Union
 
+import numpy as np
 import pandas as pd
 
 from neuroflow.atlases.atlases import Atlases
+from neuroflow.images import ImageLoader
 from neuroflow.parcellation.available_measures import AVAILABLE_MEASURES
-from neuroflow.parcellation.utils import parcellate
+from neuroflow.parcellation.store import ParcellationStore
+from neuroflow.parcellation.utils import (
+    is_complete,
+    load_metric_data,
+    parcellate_atlas,
+    parcellate_atlas_long,
+)
 from neuroflow.recon_tensors.recon_tensors import ReconTensors
 
 
@@ -21,6 +32,11 @@ class Parcellation:
     OUTPUT_TEMPLATE: ClassVar = (
         "{atlas}/sub-{subject}_ses-{session}_space-dwi_label-{label}_acq-shell{acq}_rec-{software}_atlas-{atlas}_desc-{metric}_parc.pkl"  # noqa: E501
     )
+    STACKED_OUTPUT_TEMPLATE: ClassVar = (
+        "{atlas}/sub-{subject}_ses-{session}_space-dwi_label-{label}_acq-shell{acq}_rec-{software}_atlas-{atlas}_parc.pkl"  # noqa: E501
+    )
+    STORE_TEMPLATE: ClassVar = "sub-{subject}_ses-{session}_space-dwi_parc.{extension}"
+    OUTPUT_FORMATS: ClassVar = ["pickle", "parquet", "feather"]
     MEASURES: ClassVar = AVAILABLE_MEASURES
 
     DIRECTORY_NAME: ClassVar = "parcellations"
@@ -31,6 +47,10 @@ class Parcellation:
         atlases_manager: Atlases,
         output_directory: Union[str, Path],
         measures: Optional[Union[str, list]] = None,
+        stack_metrics: bool = False,
+        nthreads: int = 1,
+        image_loader: Optional[ImageLoader] = None,
+        output_format: str = "pickle",
     ):
         """
         Initialize the Parcellation class.
@@ -43,12 +63,33 @@ class Parcellation:
             An instance of Atlases class.
         out_dir : Union[str, Path]
             Path to the output directory.
+        measures : Optional[Union[str, list]]
+            Measures to collect, by default all available measures.
+        stack_metrics : bool
+            Whether to parcellate all metrics at once and write a single
+            (long-format) table per atlas, by default False.
+        nthreads : int
+            Number of worker processes used to parcellate atlases
+            in parallel, by default 1 (serial).
+        image_loader : Optional[ImageLoader]
+            Loader used to read the metric images, by default one that reads
+            them as (memory-mapped when possible) float32 arrays.
+        output_format : str
+            Either "pickle" (a table per atlas and metric), or "parquet" or
+            "feather" (a single long-format table per session, see
+            :class:`ParcellationStore`), by default "pickle".
         """
+        if output_format not in self.OUTPUT_FORMATS:
+            raise ValueError(f"Invalid output format: {output_format}.")
         self.tensors_manager = tensors_manager
         self.atlases_manager = atlases_manager
         self.mapper = self.tensors_manager.mapper
         self.output_directory = self._gen_output_directory(output_directory)
         self.measures = self._validate_measures(measures)
+        self.stack_metrics = stack_metrics
+        self.nthreads = nthreads
+        self.image_loader = image_loader if image_loader is not None else ImageLoader()
+        self.output_format = output_format
 
     def _gen_output_directory(self, output_directory: Optional[str] = None) -> Path:
         """
@@ -106,56 +147,306 @@ class Parcellation:
                 raise ValueError(f"Invalid measure: {measure}.")
         return {measure: self.MEASURES[measure] for measure in measures}
 
+    def _build_output_path(self, atlas_name: str, metric: str) -> Path:
+        """
+        Build the path of the output table of an atlas and metric.
+
+        Parameters
+        ----------
+        atlas_name : str
+            Name of the atlas.
+        metric : str
+            Name of the metric.
+
+        Returns
+        -------
+        Path
+            Path to the output table.
+        """
+        template = (
+            self.STACKED_OUTPUT_TEMPLATE if self.stack_metrics else self.OUTPUT_TEMPLATE
+        )
+        return self.output_directory / template.format(
+            atlas=atlas_name,
+            subject=self.mapper.subject,
+            session=self.mapper.session,
+            metric=metric,
+            label=self.atlases_manager.label,
+            acq=self.tensors_manager.max_bvalue,
+            software=self.tensors_manager.software,
+        )
+
+    def _build_store_path(self) -> Path:
+        """
+        Build the path of the session's columnar table.
+
+        Returns
+        -------
+        Path
+            Path to the session's table.
+        """
+        return self.output_directory / self.STORE_TEMPLATE.format(
+            subject=self.mapper.subject,
+            session=self.mapper.session,
+            extension=ParcellationStore.FORMATS[self.output_format],
+        )
+
+    @contextmanager
+    def _shared_metric_images(self, metric_images: dict):
+        """
+        Decompress each metric image once into a memory-mapped array that
+        the workers of the process pool share.
+
+        Parameters
+        ----------
+        metric_images : dict
+            Paths to the metric images, keyed by the metric's name.
+
+        Yields
+        ------
+        dict
+            Paths to the memory-mapped arrays, keyed by the metric's name.
+        """
+        with tempfile.TemporaryDirectory(prefix="neuroflow-") as shared_directory:
+            shared_images = {}
+            for metric, metric_image in metric_images.items():
+                shared_images[metric] = Path(shared_directory) / f"{metric}.npy"
+                np.save(
+                    shared_images[metric],
+                    load_metric_data(metric_image, self.image_loader),
+                )
+            yield shared_images
+
     def run(self, force: bool = False) -> dict:
         """
         Run the parcellation workflow.
+        Only the atlases and metrics whose tables are missing or incomplete
+        are parcellated (and their metric images decompressed).
 
         Parameters
         ----------
         force : bool
-            Force the generation of the parcellation, by default True
+            Force the generation of the parcellation, by default False
 
         Returns
         -------
         dict
-            Outputs for the parcellation workflow.
-        """
-        outputs = {}
-        for atlas_name, atlas_entities in self.atlases_manager.dwi_atlases.items():
-            outputs[atlas_name] = {}
-            for metric, metric_image in self.tensors_manager.outputs.items():
-                outputs[atlas_name][metric] = {}
-                out_file = self.output_directory / self.OUTPUT_TEMPLATE.format(
-                    atlas=atlas_name,
-                    subject=self.mapper.subject,
-                    session=self.mapper.session,
-                    metric=metric,
-                    label=self.atlases_manager.label,
-                    acq=self.tensors_manager.max_bvalue,
-                    software=self.tensors_manager.software,
+            Paths to the output tables, keyed by the atlas' and the metric's
+            names (for columnar formats, every entry is the session's table,
+            see :meth:`run_store`).
+        """
+        metric_images = self.tensors_manager.outputs
+        dwi_atlases = self.atlases_manager.dwi_atlases
+        if self.output_format != "pickle":
+            store_path = self.run_store(force=force)
+            return {
+                atlas_name: {metric: store_path for metric in metric_images}
+                for atlas_name in dwi_atlases
+            }
+        outputs = {
+            atlas_name: {
+                metric: self._build_output_path(atlas_name, metric)
+                for metric in metric_images
+            }
+            for atlas_name in dwi_atlases
+        }
+        if force:
+            for out_files in outputs.values():
+                for out_file in out_files.values():
+                    out_file.unlink(missing_ok=True)
+        pending = self._pending_parcellations(outputs, dwi_atlases)
+        if not pending:
+            return outputs
+        if self.nthreads <= 1 or len(pending) <= 1:
+            for atlas_name, metrics in pending.items():
+                parcellate_atlas(
+                    dwi_atlases[atlas_name],
+                    {metric: metric_images[metric] for metric in metrics},
+                    outputs[atlas_name],
+                    self.measures,
+                    stack_metrics=self.stack_metrics,
+                    image_loader=self.image_loader,
                 )
-                if out_file.exists():
-                    if force:
-                        out_file.unlink()
-                    else:
-                        # validate that all measures are present
-                        data = pd.read_pickle(out_file)  # noqa
-                        if all(
-                            [measure in data.columns for measure in self.measures]
-                        ):  # noqa
-                            outputs[atlas_name][metric] = out_file
-                            continue
-                out_file.parent.mkdir(parents=True, exist_ok=True)
-                df = pd.read_csv(
-                    atlas_entities["description_file"],
-                    index_col=atlas_entities["index_col"],
-                ).copy()
-                for measure_name, measure in self.measures.items():
-                    df[measure_name] = parcellate(
-                        atlas_entities,
-                        metric_image,
-                        measure,
-                    )["value"]
-                df.to_pickle(out_file)
-                outputs[atlas_name][metric] = out_file
+            return outputs
+        needed = {
+            metric: metric_images[metric]
+            for metric in metric_images
+            if any(metric in metrics for metrics in pending.values())
+        }
+        with self._shared_metric_images(needed) as shared_images:
+            with ProcessPoolExecutor(
+                max_workers=min(self.nthreads, len(pending))
+            ) as executor:
+                futures = [
+                    executor.submit(
+                        parcellate_atlas,
+                        dwi_atlases[atlas_name],
+                        {metric: shared_images[metric] for metric in metrics},
+                        outputs[atlas_name],
+                        self.measures,
+                        stack_metrics=self.stack_metrics,
+                    )
+                    for atlas_name, metrics in pending.items()
+                ]
+                for future in futures:
+                    future.result()
         return outputs
+
+    def _pending_parcellations(self, outputs: dict, dwi_atlases: dict) -> dict:
+        """
+        List the metrics of each atlas whose tables are missing, lack some of
+        the requested measures (or metrics, for stacked tables) or list other
+        regions than the atlas'.
+
+        Parameters
+        ----------
+        outputs : dict
+            Paths to the output tables, keyed by the atlas' and the metric's
+            names.
+        dwi_atlases : dict
+            Entities of the atlases, keyed by the atlas' name.
+
+        Returns
+        -------
+        dict
+            The metrics to parcellate, keyed by the atlas' name.
+        """
+        pending = {}
+        for atlas_name, out_files in outputs.items():
+            if self.stack_metrics:
+                out_file = next(iter(out_files.values()), None)
+                if out_file is not None and not is_complete(
+                    out_file,
+                    dwi_atlases[atlas_name],
+                    self.measures,
+                    list(out_files),
+                ):
+                    pending[atlas_name] = list(out_files)
+                continue
+            metrics = [
+                metric
+                for metric, out_file in out_files.items()
+                if not is_complete(
+                    out_file,
+                    dwi_atlases[atlas_name],
+                    self.measures,
+                )
+            ]
+            if metrics:
+                pending[atlas_name] = metrics
+        return pending
+
+    def _missing_parcellations(
+        self, atlas_names: list, metrics: list, contents: set, entities: dict
+    ) -> dict:
+        """
+        List the metrics and measures of each atlas that are missing from the
+        session's columnar table.
+
+        Parameters
+        ----------
+        atlas_names : list
+            Names of the atlases.
+        metrics : list
+            Names of the metrics.
+        contents : set
+            Keys of the stored combinations
+            (see :meth:`ParcellationStore.contents`).
+        entities : dict
+            Label, acquisition and software of the parcellations.
+
+        Returns
+        -------
+        dict
+            The metrics and the measures to compute for each atlas,
+            keyed by the atlas' name.
+        """
+        missing = {}
+        for atlas_name in atlas_names:
+            atlas_metrics, measures = [], {}
+            for metric in metrics:
+                for measure_name, measure in self.measures.items():
+                    key = ParcellationStore.content_key(
+                        atlas=atlas_name,
+                        metric=metric,
+                        measure=measure_name,
+                        **entities,
+                    )
+                    if key not in contents:
+                        measures[measure_name] = measure
+                        if metric not in atlas_metrics:
+                            atlas_metrics.append(metric)
+            if atlas_metrics:
+                missing[atlas_name] = (atlas_metrics, measures)
+        return missing
+
+    def run_store(self, force: bool = False) -> Path:
+        """
+        Run the parcellation workflow into the session's columnar table.
+        Only the atlases, metrics and measures missing from the table (as
+        listed in its metadata) are computed.
+
+        Parameters
+        ----------
+        force : bool
+            Force the generation of the parcellation, by default False
+
+        Returns
+        -------
+        Path
+            Path to the session's table.
+        """
+        store = ParcellationStore(self._build_store_path(), self.output_format)
+        entities = {
+            "label": self.atlases_manager.label,
+            "acq": self.tensors_manager.max_bvalue,
+            "software": self.tensors_manager.software,
+        }
+        metric_images = self.tensors_manager.outputs
+        dwi_atlases = self.atlases_manager.dwi_atlases
+        missing = self._missing_parcellations(
+            list(dwi_atlases),
+            list(metric_images),
+            set() if force else store.contents(),
+            entities,
+        )
+        if not missing:
+            return store.path
+        if self.nthreads <= 1 or len(missing) <= 1:
+            tables = [
+                parcellate_atlas_long(
+                    atlas_name,
+                    dwi_atlases[atlas_name],
+                    {metric: metric_images[metric] for metric in metrics},
+                    measures,
+                    self.image_loader,
+                )
+                for atlas_name, (metrics, measures) in missing.items()
+            ]
+        else:
+            needed = {
+                metric: metric_images[metric]
+                for metric in metric_images
+                if any(metric in metrics for metrics, _ in missing.values())
+            }
+            with self._shared_metric_images(needed) as shared_images:
+                with ProcessPoolExecutor(
+                    max_workers=min(self.nthreads, len(missing))
+                ) as executor:
+                    futures = [
+                        executor.submit(
+                            parcellate_atlas_long,
+                            atlas_name,
+                            dwi_atlases[atlas_name],
+                            {metric: shared_images[metric] for metric in metrics},
+                            measures,
+                        )
+                        for atlas_name, (metrics, measures) in missing.items()
+                    ]
+                    tables = [future.result() for future in futures]
+        data = pd.concat(tables)
+        data.insert(0, "subject", self.mapper.subject)
+        data.insert(1, "session", self.mapper.session)
+        for column, value in entities.items():
+            data[column] = value
+        return store.write(data)
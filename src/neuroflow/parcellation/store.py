@@ -0,0 +1,234 @@
+"""
+Columnar (Parquet/Feather) storage of a session's parcellations.
+
+A single long-format table holds every atlas, metric, software and measure
+of a session. An index of the (atlas, metric, measure) combinations it holds
+is kept in the file's schema metadata, so checking what is already computed
+does not read the table itself. All sessions share the same schema, so a
+cohort's tables can be opened as a single dataset (see
+:meth:`ParcellationStore.dataset`).
+"""
+
+import json
+import os
+from pathlib import Path
+from typing import ClassVar, List, Optional, Union
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.feather as feather
+    import pyarrow.parquet as pq
+except ImportError:  # pragma: no cover
+    pa = None
+
+
+class ParcellationStore:
+    """
+    A session's parcellations, stored as a single long-format table.
+    """
+
+    FORMATS: ClassVar = {"parquet": "parquet", "feather": "arrow"}
+    STRING_COLUMNS: ClassVar = [
+        "subject",
+        "session",
+        "label",
+        "software",
+        "atlas",
+        "metric",
+        "measure",
+    ]
+    KEY_COLUMNS: ClassVar = ["label", "acq", "software", "atlas", "metric", "measure"]
+    METADATA_KEY: ClassVar = b"neuroflow"
+
+    def __init__(self, path: Union[str, Path], file_format: str = "parquet"):
+        """
+        Initialize the ParcellationStore class.
+
+        Parameters
+        ----------
+        path : Union[str, Path]
+            Path to the session's table.
+        file_format : str, optional
+            Either "parquet" or "feather", by default "parquet".
+        """
+        self._check_dependencies()
+        if file_format not in self.FORMATS:
+            raise ValueError(f"Invalid file format: {file_format}.")
+        self.path = Path(path)
+        self.file_format = file_format
+
+    @staticmethod
+    def _check_dependencies():
+        """
+        Make sure the optional pyarrow dependency is installed.
+        """
+        if pa is None:
+            raise ImportError(
+                "Columnar parcellation outputs require pyarrow "
+                "(pip install neuroflow-yalab[parquet])."
+            )
+
+    @classmethod
+    def schema(cls) -> "pa.Schema":
+        """
+        The schema shared by all sessions' tables.
+
+        Returns
+        -------
+        pa.Schema
+            Schema of the long-format table.
+        """
+        cls._check_dependencies()
+        return pa.schema(
+            [
+                ("subject", pa.string()),
+                ("session", pa.string()),
+                ("label", pa.string()),
+                ("acq", pa.int32()),
+                ("software", pa.string()),
+                ("atlas", pa.string()),
+                ("region", pa.int64()),
+                ("metric", pa.string()),
+                ("measure", pa.string()),
+                ("value", pa.float64()),
+            ]
+        )
+
+    @classmethod
+    def content_key(cls, **entities) -> str:
+        """
+        Build the key of an (atlas, metric, measure) combination in the index
+        of the table's contents.
+
+        Parameters
+        ----------
+        **entities
+            Values of the :attr:`KEY_COLUMNS`.
+
+        Returns
+        -------
+        str
+            The key of the combination.
+        """
+        return "/".join(str(entities[column]) for column in cls.KEY_COLUMNS)
+
+    @classmethod
+    def _row_keys(cls, data: pd.DataFrame) -> pd.Series:
+        """
+        Build the content key (see :meth:`content_key`) of each row of a table.
+        """
+        keys = data[cls.KEY_COLUMNS[0]].astype(str)
+        for column in cls.KEY_COLUMNS[1:]:
+            keys = keys + "/" + data[column].astype(str)
+        return keys
+
+    def contents(self) -> set:
+        """
+        Read the index of the combinations stored in the table, from its
+        metadata only.
+
+        Returns
+        -------
+        set
+            Keys of the stored combinations (see :meth:`content_key`).
+        """
+        if not self.path.exists():
+            return set()
+        if self.file_format == "parquet":
+            schema = pq.read_schema(self.path)
+        else:
+            with pa.memory_map(str(self.path)) as source:
+                schema = pa.ipc.open_file(source).schema
+        metadata = schema.metadata or {}
+        return set(json.loads(metadata.get(self.METADATA_KEY, b"[]")))
+
+    def read(self, columns: Optional[List[str]] = None) -> pd.DataFrame:
+        """
+        Read the session's table.
+
+        Parameters
+        ----------
+        columns : Optional[List[str]], optional
+            Columns to read, by default all of them.
+
+        Returns
+        -------
+        pd.DataFrame
+            The long-format table, with categorical string columns.
+        """
+        if not self.path.exists():
+            return self.schema().empty_table().to_pandas()
+        if self.file_format == "parquet":
+            table = pq.read_table(self.path, columns=columns)
+        else:
+            table = feather.read_table(self.path, columns=columns)
+        data = table.to_pandas()
+        for column in self.STRING_COLUMNS:
+            if column in data:
+                data[column] = data[column].astype("category")
+        return data
+
+    def write(self, data: pd.DataFrame) -> Path:
+        """
+        Add rows to the session's table, replacing the stored rows of the same
+        (atlas, metric, measure) combinations.
+
+        Parameters
+        ----------
+        data : pd.DataFrame
+            Long-format rows (see :meth:`schema`).
+
+        Returns
+        -------
+        Path
+            Path to the session's table.
+        """
+        data = data[self.schema().names]
+        if self.path.exists():
+            existing = self.read()
+            replaced = self._row_keys(existing).isin(set(self._row_keys(data)))
+            data = pd.concat([existing.loc[~replaced], data])
+        contents = sorted(set(self._row_keys(data)))
+        table = pa.Table.from_pandas(
+            data, schema=self.schema(), preserve_index=False
+        ).replace_schema_metadata({self.METADATA_KEY: json.dumps(contents)})
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = self.path.with_name(f".{self.path.name}.{os.getpid()}.tmp")
+        if self.file_format == "parquet":
+            pq.write_table(table, tmp_file)
+        else:
+            feather.write_feather(table, tmp_file)
+        tmp_file.replace(self.path)
+        return self.path
+
+    @classmethod
+    def dataset(
+        cls, root: Union[str, Path], file_format: str = "parquet"
+    ) -> "ds.Dataset":
+        """
+        Open the tables of every session under a directory as a single
+        dataset, e.g. to load a cohort's parcellations with filters.
+
+        Parameters
+        ----------
+        root : Union[str, Path]
+            NeuroFlow's output directory.
+        file_format : str, optional
+            Either "parquet" or "feather", by default "parquet".
+
+        Returns
+        -------
+        ds.Dataset
+            A dataset of all sessions' tables.
+        """
+        cls._check_dependencies()
+        extension = cls.FORMATS[file_format]
+        files = sorted(str(path) for path in Path(root).rglob(f"*_parc.{extension}"))
+        return ds.dataset(
+            files,
+            schema=cls.schema(),
+            format="parquet" if file_format == "parquet" else "ipc",
+        )
@@ -1,10 +1,207 @@
 from pathlib import Path
-from typing import Callable, Union
+from typing import Callable, Optional, Union
 
-import nibabel as nib
 import numpy as np
 import pandas as pd
 
+from neuroflow.atlases.atlas_package import AtlasPackage
+from neuroflow.atlases.voxel_index import VoxelIndex
+from neuroflow.images import ImageLoader
+from neuroflow.parcellation.measure_kernels import MeasureKernels
+
+
+def load_atlas_description(atlas_entities: dict) -> pd.DataFrame:
+    """
+    Load the description of an atlas' regions, from the atlas' package
+    (see :class:`AtlasPackage`) if it was built from the atlas' current files.
+
+    Parameters
+    ----------
+    atlas_entities : dict
+        Dictionary with the entities of the atlas.
+
+    Returns
+    -------
+    pd.DataFrame
+        Description of the atlas' regions.
+    """
+    if atlas_entities.get("package") is not None:
+        # registered atlases keep the MNI152 atlas the package was built from
+        package = AtlasPackage.find(
+            {
+                **atlas_entities,
+                "nifti": atlas_entities.get("mni_nifti", atlas_entities["nifti"]),
+            }
+        )
+        if package is not None:
+            return package.description.copy()
+    return pd.read_csv(
+        atlas_entities["description_file"], index_col=atlas_entities["index_col"]
+    ).copy()
+
+
+def load_metric_data(
+    metric_image: Union[str, Path, np.ndarray],
+    image_loader: Optional[ImageLoader] = None,
+) -> np.ndarray:
+    """
+    Load the data of a metric image.
+
+    Parameters
+    ----------
+    metric_image : Union[str, Path, np.ndarray]
+        Path to a NIfTI image or to a ``.npy`` array (which is memory-mapped),
+        or the metric data itself.
+    image_loader : Optional[ImageLoader], optional
+        Loader used for NIfTI images, by default a float32, memory-mapping
+        :class:`ImageLoader`.
+
+    Returns
+    -------
+    np.ndarray
+        The metric data.
+    """
+    if isinstance(metric_image, np.ndarray):
+        return metric_image
+    if Path(metric_image).suffix == ".npy":
+        return np.load(metric_image, mmap_mode="r")
+    image_loader = image_loader if image_loader is not None else ImageLoader()
+    return image_loader.load_metric(metric_image)
+
+
+def reduce_regions(
+    values: np.ndarray, bounds: np.ndarray, measures: dict, axis=None
+) -> np.ndarray:
+    """
+    Apply every measure to the values of each region.
+    Each region is partially sorted once and shared by the measures that have
+    a kernel implementation (see :class:`MeasureKernels`).
+
+    Parameters
+    ----------
+    values : np.ndarray
+        Label-sorted voxel values (see :meth:`VoxelIndex.gather`).
+    bounds : np.ndarray
+        Start and stop of each region's voxels
+        (see :meth:`VoxelIndex.region_bounds`).
+    measures : dict
+        Measure functions, keyed by the name of their output column.
+    axis : int, optional
+        Axis passed to the measures, by default None (reduce all values).
+        Use 0 to reduce each column of stacked values separately.
+
+    Returns
+    -------
+    np.ndarray
+        A (n_regions, n_measures) array, with an additional trailing dimension
+        for the columns of *values* when *axis* is 0.
+    """
+    shape = (len(bounds), len(measures))
+    if axis is not None:
+        shape += values.shape[1:]
+    result = np.full(shape, np.nan)
+    kernels = MeasureKernels(measures)
+    nan_free = not np.isnan(values).any()
+    for i, (start, stop) in enumerate(bounds):
+        result[i] = kernels.reduce(values[start:stop], nan_free=nan_free, axis=axis)
+    return result
+
+
+def parcellate_measures(
+    atlas_entities: dict,
+    metric_image: Union[str, Path, np.ndarray],
+    measures: dict,
+    image_loader: Optional[ImageLoader] = None,
+) -> pd.DataFrame:
+    """
+    Collects several measures for each region of an atlas.
+    The atlas' voxel index is loaded once (see :class:`VoxelIndex`), and every
+    measure is applied to each region's voxel values.
+
+    Parameters
+    ----------
+    atlas_entities : dict
+        Dictionary with the entities of the atlas.
+    metric_image : Union[str, Path, np.ndarray]
+        Path to the metric image (see :func:`load_metric_data`).
+    measures : dict
+        Measure functions, keyed by the name of their output column.
+    image_loader : Optional[ImageLoader], optional
+        Loader used for the metric images (see :func:`load_metric_data`).
+
+    Returns
+    -------
+    pd.DataFrame
+        Dataframe with a column for each measure and a row for each region.
+    """
+    atlas_description = load_atlas_description(atlas_entities)
+    voxel_index = VoxelIndex.from_file(atlas_entities["nifti"])
+    metric_data = load_metric_data(metric_image, image_loader)
+    values = voxel_index.gather(metric_data)
+    bounds = voxel_index.region_bounds(atlas_description[atlas_entities["region_col"]])
+    result = reduce_regions(values, bounds, measures)
+    for j, measure_name in enumerate(measures):
+        atlas_description[measure_name] = result[:, j]
+    return atlas_description
+
+
+def parcellate_metrics(
+    atlas_entities: dict,
+    metric_images: dict,
+    measures: dict,
+    image_loader: Optional[ImageLoader] = None,
+) -> pd.DataFrame:
+    """
+    Collects several measures of several metrics for each region of an atlas.
+    The scalar metric maps are stacked into a single
+    (n_labeled_voxels, n_metrics) matrix, so every region is reduced for all
+    of them at once. Multi-volume maps (e.g. tensors or eigenvectors) are
+    reduced separately, like in :func:`parcellate_measures`.
+
+    Parameters
+    ----------
+    atlas_entities : dict
+        Dictionary with the entities of the atlas.
+    metric_images : dict
+        Paths to the metric images (see :func:`load_metric_data`),
+        keyed by the metric's name.
+    measures : dict
+        Measure functions, keyed by the name of their output column.
+    image_loader : Optional[ImageLoader], optional
+        Loader used for the metric images (see :func:`load_metric_data`).
+
+    Returns
+    -------
+    pd.DataFrame
+        Long-format dataframe with a "metric" column, a column for each
+        measure and a row for each region of each metric.
+    """
+    atlas_description = load_atlas_description(atlas_entities)
+    voxel_index = VoxelIndex.from_file(atlas_entities["nifti"])
+    bounds = voxel_index.region_bounds(atlas_description[atlas_entities["region_col"]])
+    results, stacked = {}, {}
+    for metric, metric_image in metric_images.items():
+        metric_data = load_metric_data(metric_image, image_loader)
+        values = voxel_index.gather(metric_data)
+        if metric_data.shape == voxel_index.shape:
+            stacked[metric] = values
+        else:
+            results[metric] = reduce_regions(values, bounds, measures)
+    if stacked:
+        stacked_result = reduce_regions(
+            np.column_stack(list(stacked.values())), bounds, measures, axis=0
+        )
+        for k, metric in enumerate(stacked):
+            results[metric] = stacked_result[:, :, k]
+    tables = []
+    for metric in metric_images:
+        table = atlas_description.copy()
+        table["metric"] = metric
+        for j, measure_name in enumerate(measures):
+            table[measure_name] = results[metric][:, j]
+        tables.append(table)
+    return pd.concat(tables)
+
 
 def parcellate(
     atlas_entities: dict, metric_image: Union[str, Path], measure: Callable
@@ -26,15 +223,304 @@ def parcellate(
     pd.DataFrame
         Dataframe with the measure for each region of the atlas.
     """
-    atlas_description = pd.read_csv(
-        atlas_entities["description_file"], index_col=atlas_entities["index_col"]
-    ).copy()
-    atlas_description["value"] = np.nan
-    atlas_data = nib.load(atlas_entities["nifti"]).get_fdata()
-    metric_data = nib.load(metric_image).get_fdata()
-    for i, row in atlas_description.iterrows():
-        region = int(row[atlas_entities["region_col"]])
-        roi_mask = atlas_data == region
-        measure_value = measure(metric_data[roi_mask])
-        atlas_description.loc[i, "value"] = measure_value
-    return atlas_description
+    return parcellate_measures(atlas_entities, metric_image, {"value": measure})
+
+
+def missing_measures(data: pd.DataFrame, measures: dict) -> dict:
+    """
+    Get the measures that are missing from an existing table.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Existing parcellation table.
+    measures : dict
+        Requested measure functions, keyed by the name of their output column.
+
+    Returns
+    -------
+    dict
+        Measure functions missing from *data*.
+    """
+    return {
+        measure_name: measure
+        for measure_name, measure in measures.items()
+        if measure_name not in data.columns
+    }
+
+
+def matches_regions(data: pd.DataFrame, atlas_entities: dict) -> bool:
+    """
+    Check whether a parcellation table lists the atlas' current regions.
+
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Parcellation table of a single metric.
+    atlas_entities : dict
+        Dictionary with the entities of the atlas.
+
+    Returns
+    -------
+    bool
+        Whether the table's region ids are the atlas description's.
+    """
+    region_col = atlas_entities["region_col"]
+    if region_col not in data.columns:
+        return False
+    regions = load_atlas_description(atlas_entities)[region_col].to_numpy()
+    return np.array_equal(data[region_col].to_numpy(), regions)
+
+
+def is_complete(
+    out_file: Union[str, Path],
+    atlas_entities: dict,
+    measures: dict,
+    metrics: Optional[list] = None,
+) -> bool:
+    """
+    Check whether a table file holds every requested measure (and metric) of
+    the atlas' current regions.
+
+    Parameters
+    ----------
+    out_file : Union[str, Path]
+        Path to the table.
+    atlas_entities : dict
+        Dictionary with the entities of the atlas.
+    measures : dict
+        Requested measure functions, keyed by the name of their output column.
+    metrics : Optional[list], optional
+        Requested metrics of a stacked table, by default None.
+
+    Returns
+    -------
+    bool
+        Whether nothing is left to compute for the table.
+    """
+    if not Path(out_file).exists():
+        return False
+    data = pd.read_pickle(out_file)  # noqa
+    if missing_measures(data, measures):
+        return False
+    if metrics is None:
+        return matches_regions(data, atlas_entities)
+    return all(
+        matches_regions(data.loc[data["metric"] == metric], atlas_entities)
+        for metric in metrics
+    )
+
+
+def parcellate_to_file(
+    atlas_entities: dict,
+    metric_image: Union[str, Path, np.ndarray],
+    out_file: Union[str, Path],
+    measures: dict,
+    image_loader: Optional[ImageLoader] = None,
+) -> Path:
+    """
+    Parcellate a metric image into a table file.
+    If the table already exists, only the measures it lacks are computed
+    and merged into it, unless it lists other regions than the atlas' (see
+    :func:`matches_regions`), in which case it is recomputed.
+
+    Parameters
+    ----------
+    atlas_entities : dict
+        Dictionary with the entities of the atlas.
+    metric_image : Union[str, Path, np.ndarray]
+        Path to the metric image (see :func:`load_metric_data`).
+    out_file : Union[str, Path]
+        Path to the output table.
+    measures : dict
+        Measure functions, keyed by the name of their output column.
+    image_loader : Optional[ImageLoader], optional
+        Loader used for the metric images (see :func:`load_metric_data`).
+
+    Returns
+    -------
+    Path
+        Path to the output table.
+    """
+    out_file = Path(out_file)
+    data = None
+    new_measures = measures
+    if out_file.exists():
+        data = pd.read_pickle(out_file)  # noqa
+        if matches_regions(data, atlas_entities):
+            new_measures = missing_measures(data, measures)
+            if not new_measures:
+                return out_file
+        else:
+            data = None
+    out_file.parent.mkdir(parents=True, exist_ok=True)
+    df = parcellate_measures(atlas_entities, metric_image, new_measures, image_loader)
+    if data is not None:
+        data = data.copy()
+        for measure_name in new_measures:
+            data[measure_name] = df[measure_name].to_numpy()
+        df = data
+    df.to_pickle(out_file)
+    return out_file
+
+
+def parcellate_metrics_to_file(
+    atlas_entities: dict,
+    metric_images: dict,
+    out_file: Union[str, Path],
+    measures: dict,
+    image_loader: Optional[ImageLoader] = None,
+) -> Path:
+    """
+    Parcellate several metric images into a single (stacked) table file.
+    If the table already exists, only the metrics and measures it lacks are
+    computed and merged into it; the metrics whose rows list other regions
+    than the atlas' (see :func:`matches_regions`) are recomputed.
+
+    Parameters
+    ----------
+    atlas_entities : dict
+        Dictionary with the entities of the atlas.
+    metric_images : dict
+        Paths to the metric images (see :func:`load_metric_data`),
+        keyed by the metric's name.
+    out_file : Union[str, Path]
+        Path to the output table.
+    measures : dict
+        Measure functions, keyed by the name of their output column.
+    image_loader : Optional[ImageLoader], optional
+        Loader used for the metric images (see :func:`load_metric_data`).
+
+    Returns
+    -------
+    Path
+        Path to the output table.
+    """
+    out_file = Path(out_file)
+    if not out_file.exists():
+        out_file.parent.mkdir(parents=True, exist_ok=True)
+        parcellate_metrics(
+            atlas_entities, metric_images, measures, image_loader
+        ).to_pickle(out_file)
+        return out_file
+    data = pd.read_pickle(out_file)  # noqa
+    present, missing = {}, {}
+    for metric, image in metric_images.items():
+        rows = (data["metric"] == metric).to_numpy()
+        if rows.any() and matches_regions(data.loc[rows], atlas_entities):
+            present[metric] = image
+        else:
+            # missing, or built from other regions: recompute every measure
+            data = data.loc[~rows]
+            missing[metric] = image
+    new_measures = missing_measures(data, measures)
+    if not new_measures and not missing:
+        return out_file
+    if new_measures and present:
+        new_data = parcellate_metrics(
+            atlas_entities, present, new_measures, image_loader
+        )
+        data = data.copy()
+        for metric in present:
+            rows = (data["metric"] == metric).to_numpy()
+            new_rows = (new_data["metric"] == metric).to_numpy()
+            for measure_name in new_measures:
+                data.loc[rows, measure_name] = new_data.loc[
+                    new_rows, measure_name
+                ].to_numpy()
+    if missing:
+        new_data = parcellate_metrics(atlas_entities, missing, measures, image_loader)
+        data = new_data if data.empty else pd.concat([data, new_data])
+    data.to_pickle(out_file)
+    return out_file
+
+
+def parcellate_atlas(
+    atlas_entities: dict,
+    metric_images: dict,
+    out_files: dict,
+    measures: dict,
+    stack_metrics: bool = False,
+    image_loader: Optional[ImageLoader] = None,
+) -> dict:
+    """
+    Parcellate every metric image of a subject with a single atlas.
+    This is the unit of work of :class:`Parcellation`, executed either
+    serially or by the workers of a process pool.
+
+    Parameters
+    ----------
+    atlas_entities : dict
+        Dictionary with the entities of the atlas.
+    metric_images : dict
+        Paths to the metric images (see :func:`load_metric_data`),
+        keyed by the metric's name.
+    out_files : dict
+        Paths to the output tables, keyed by the metric's name.
+    measures : dict
+        Measure functions, keyed by the name of their output column.
+    stack_metrics : bool, optional
+        Whether all metrics are written to a single table, by default False.
+    image_loader : Optional[ImageLoader], optional
+        Loader used for the metric images (see :func:`load_metric_data`).
+
+    Returns
+    -------
+    dict
+        Paths to the output tables, keyed by the metric's name.
+    """
+    if stack_metrics:
+        out_file = next(iter(out_files.values()))
+        parcellate_metrics_to_file(
+            atlas_entities, metric_images, out_file, measures, image_loader
+        )
+        return out_files
+    for metric, metric_image in metric_images.items():
+        parcellate_to_file(
+            atlas_entities, metric_image, out_files[metric], measures, image_loader
+        )
+    return out_files
+
+
+def parcellate_atlas_long(
+    atlas_name: str,
+    atlas_entities: dict,
+    metric_images: dict,
+    measures: dict,
+    image_loader: Optional[ImageLoader] = None,
+) -> pd.DataFrame:
+    """
+    Parcellate every metric image of a subject with a single atlas into
+    long-format rows (see :class:`ParcellationStore`).
+    This is the unit of work of :class:`Parcellation` for columnar outputs.
+
+    Parameters
+    ----------
+    atlas_name : str
+        Name of the atlas.
+    atlas_entities : dict
+        Dictionary with the entities of the atlas.
+    metric_images : dict
+        Paths to the metric images (see :func:`load_metric_data`),
+        keyed by the metric's name.
+    measures : dict
+        Measure functions, keyed by the name of their output column.
+    image_loader : Optional[ImageLoader], optional
+        Loader used for the metric images (see :func:`load_metric_data`).
+
+    Returns
+    -------
+    pd.DataFrame
+        A row for each region, metric and measure, with "atlas", "region",
+        "metric", "measure" and "value" columns.
+    """
+    data = parcellate_metrics(atlas_entities, metric_images, measures, image_loader)
+    data = data.rename(columns={atlas_entities["region_col"]: "region"})
+    data = data.melt(
+        id_vars=["region", "metric"],
+        value_vars=list(measures),
+        var_name="measure",
+        value_name="value",
+    )
+    data.insert(0, "atlas", atlas_name)
+    return data
@@ -70,24 +70,41 @@ class DipyTensors(ReconTensors):
         }
         return {key: str(value) for key, value in inputs.items()}
 
+    def fingerprint_inputs(self) -> dict:
+        """
+        Gather the inputs and parameters the tensors are reconstructed from.
+
+        Returns
+        -------
+        dict
+            The inputs of :meth:`ReconTensors.fingerprint_inputs`, along with
+            the fit method.
+        """
+        inputs = super().fingerprint_inputs()
+        inputs["fit_method"] = self.fit_method
+        return inputs
+
     def run(self, force: bool = False) -> dict:
         """
-        Run the DipyTensors workflow.
+        Run the DipyTensors workflow, unless its outputs were reconstructed
+        from the same inputs and parameters.
 
         Returns
         -------
         dict
             Outputs for the DipyTensors workflow.
         """
-        inputs = self.collect_inputs()
         outputs = self.collect_outputs()
+        if not force and self.is_current(outputs):
+            return outputs
+        # outdated outputs would be kept by the flow
+        self.clear_outputs(outputs)
+        inputs = self.collect_inputs()
         out_dir = Path(inputs["out_dir"])
         out_dir.mkdir(parents=True, exist_ok=True)
-        if force:
-            for file in outputs.values():
-                file.unlink(missing_ok=True)
         flow = ReconstDtiFlow()
         flow.run(
             **inputs, **{f"out_{key}": str(value) for key, value in outputs.items()}
         )
+        self.write_fingerprint()
         return outputs
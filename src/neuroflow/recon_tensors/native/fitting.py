@@ -0,0 +1,298 @@
+"""
+Batched, in-process fitting of diffusion tensors.
+
+The log-linear tensor model is fitted to the masked voxels in fixed-size
+chunks, each chunk being a handful of batched NumPy linear-algebra calls
+(ordinary or weighted least squares, optionally refined by non-linear least
+squares), so that whole-brain fits need neither a subprocess nor a per-voxel
+loop. Chunks are fitted in a thread pool, since NumPy's linear algebra
+releases the GIL.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional, Tuple
+
+import numpy as np
+from dipy.reconst import dti
+
+FIT_METHODS = ["OLS", "WLS", "NLLS"]
+# relative tolerance of the smallest diffusivity (as in dipy)
+MIN_DIFFUSIVITY_TOLERANCE = 1e-6
+
+
+def design_matrix(bvals: np.ndarray, bvecs: np.ndarray) -> np.ndarray:
+    """
+    Build the design matrix of the log-linear tensor model.
+
+    Parameters
+    ----------
+    bvals : np.ndarray
+        The (n_volumes,) b-values.
+    bvecs : np.ndarray
+        The (n_volumes, 3) gradient directions.
+
+    Returns
+    -------
+    np.ndarray
+        A (n_volumes, 7) matrix whose columns match the tensor's lower
+        triangular elements (Dxx, Dxy, Dyy, Dxz, Dyz, Dzz) and ln(S0).
+    """
+    bvals = np.asarray(bvals, dtype=np.float64)
+    x, y, z = np.asarray(bvecs, dtype=np.float64).T
+    return np.column_stack(
+        [
+            -bvals * x * x,
+            -2 * bvals * x * y,
+            -bvals * y * y,
+            -2 * bvals * x * z,
+            -2 * bvals * y * z,
+            -bvals * z * z,
+            np.ones_like(bvals),
+        ]
+    )
+
+
+def _weighted_least_squares(
+    design: np.ndarray, log_signal: np.ndarray, weights: np.ndarray
+) -> np.ndarray:
+    """
+    Solve the weighted least squares problem of each voxel at once.
+    """
+    weighted = weights[..., None] * design
+    lhs = weighted.transpose(0, 2, 1) @ design
+    rhs = weighted.transpose(0, 2, 1) @ log_signal[..., None]
+    return np.linalg.solve(lhs, rhs)[..., 0]
+
+
+def _nonlinear_least_squares(
+    design: np.ndarray,
+    signal: np.ndarray,
+    params: np.ndarray,
+    n_iterations: int = 10,
+) -> np.ndarray:
+    """
+    Refine the parameters of each voxel with Levenberg-Marquardt iterations
+    on the (non-log) signal, all voxels at once.
+    """
+
+    def cost(params):
+        return np.square(signal - np.exp(params @ design.T)).sum(axis=1)
+
+    current = cost(params)
+    damping = np.full(len(params), 1e-3)
+    for _ in range(n_iterations):
+        predicted = np.exp(params @ design.T)
+        jacobian = predicted[..., None] * design
+        transposed = jacobian.transpose(0, 2, 1)
+        hessian = transposed @ jacobian
+        gradient = transposed @ (signal - predicted)[..., None]
+        diagonal = np.einsum("nii->ni", hessian)
+        diagonal += damping[:, None] * diagonal + 1e-12
+        step = np.linalg.solve(hessian, gradient)[..., 0]
+        candidate = params + step
+        with np.errstate(over="ignore", invalid="ignore"):
+            candidate_cost = cost(candidate)
+        improved = np.isfinite(candidate_cost) & (candidate_cost < current)
+        params = np.where(improved[:, None], candidate, params)
+        current = np.where(improved, candidate_cost, current)
+        damping = np.where(improved, damping / 10, damping * 10)
+        if not improved.any():
+            break
+    return params
+
+
+def fit_signal(
+    design: np.ndarray,
+    signal: np.ndarray,
+    fit_method: str = "WLS",
+    min_signal: float = 1e-4,
+) -> np.ndarray:
+    """
+    Fit the tensor model to the signal of a batch of voxels.
+
+    Parameters
+    ----------
+    design : np.ndarray
+        The (n_volumes, 7) design matrix (see :func:`design_matrix`).
+    signal : np.ndarray
+        The (n_voxels, n_volumes) diffusion signal.
+    fit_method : str, optional
+        Either "OLS", "WLS" or "NLLS" (WLS refined by non-linear least
+        squares), by default "WLS".
+    min_signal : float, optional
+        Smallest signal value, by default 1e-4.
+
+    Returns
+    -------
+    np.ndarray
+        The (n_voxels, 7) parameters: the tensor's lower triangular elements
+        and ln(S0).
+    """
+    if fit_method not in FIT_METHODS:
+        raise ValueError(f"Invalid fit method: {fit_method}.")
+    signal = np.maximum(np.asarray(signal, dtype=np.float64), min_signal)
+    log_signal = np.log(signal)
+    params = log_signal @ np.linalg.pinv(design).T
+    if fit_method == "OLS":
+        return params
+    # dipy's weights: the squared signal predicted by the OLS fit
+    weights = np.exp(2 * (params @ design.T))
+    params = _weighted_least_squares(design, log_signal, weights)
+    if fit_method == "NLLS":
+        params = _nonlinear_least_squares(design, signal, params)
+    return params
+
+
+def decompose_tensors(
+    lower_triangular: np.ndarray, min_diffusivity: float = 0
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Decompose tensors into their eigenvalues and eigenvectors.
+
+    Parameters
+    ----------
+    lower_triangular : np.ndarray
+        The (n_voxels, 6) tensors' lower triangular elements.
+    min_diffusivity : float, optional
+        Smallest eigenvalue, by default 0.
+
+    Returns
+    -------
+    Tuple[np.ndarray, np.ndarray]
+        The (n_voxels, 3) eigenvalues, in decreasing order, and the
+        (n_voxels, 3, 3) eigenvectors (as columns).
+    """
+    dxx, dxy, dyy, dxz, dyz, dzz = np.moveaxis(lower_triangular, -1, 0)
+    tensors = np.stack(
+        [
+            np.stack([dxx, dxy, dxz], axis=-1),
+            np.stack([dxy, dyy, dyz], axis=-1),
+            np.stack([dxz, dyz, dzz], axis=-1),
+        ],
+        axis=-2,
+    )
+    evals, evecs = np.linalg.eigh(tensors)
+    evals = np.clip(evals[..., ::-1], min_diffusivity, None)
+    return evals, evecs[..., ::-1]
+
+
+def fit_tensors(
+    data: np.ndarray,
+    mask: np.ndarray,
+    bvals: np.ndarray,
+    bvecs: np.ndarray,
+    fit_method: str = "WLS",
+    chunk_size: int = 10000,
+    nthreads: int = 1,
+    min_signal: Optional[float] = None,
+) -> dict:
+    """
+    Fit diffusion tensors to the masked voxels of a DWI series, in chunks.
+
+    Parameters
+    ----------
+    data : np.ndarray
+        The (x, y, z, n_volumes) diffusion signal.
+    mask : np.ndarray
+        The (x, y, z) brain mask.
+    bvals : np.ndarray
+        The (n_volumes,) b-values.
+    bvecs : np.ndarray
+        The (n_volumes, 3) gradient directions.
+    fit_method : str, optional
+        Either "OLS", "WLS" or "NLLS", by default "WLS".
+    chunk_size : int, optional
+        Number of voxels fitted at once, by default 10000.
+    nthreads : int, optional
+        Number of chunks fitted concurrently, by default 1.
+    min_signal : Optional[float], optional
+        Smallest signal value, by default the smallest positive signal of the
+        masked voxels.
+
+    Returns
+    -------
+    dict
+        The "voxels" (indices of the masked voxels), and their tensors'
+        "lower_triangular" elements, "evals" and "evecs".
+    """
+    design = design_matrix(bvals, bvecs)
+    voxels = np.nonzero(np.asarray(mask) > 0)
+    n_voxels = len(voxels[0])
+    chunks = [
+        slice(start, start + chunk_size) for start in range(0, n_voxels, chunk_size)
+    ]
+
+    def chunk_signal(chunk: slice) -> np.ndarray:
+        return data[tuple(axis[chunk] for axis in voxels)]
+
+    min_diffusivity = MIN_DIFFUSIVITY_TOLERANCE / -design[:, :6].min(initial=-1)
+    lower_triangular = np.zeros((n_voxels, 6))
+    evals = np.zeros((n_voxels, 3))
+    evecs = np.zeros((n_voxels, 3, 3))
+    positive_minima = []
+
+    def fit_chunk(chunk: slice, chunk_min_signal: Optional[float]) -> bool:
+        """
+        Fit a chunk, unless its smallest signal must be clipped to the masked
+        voxels' (still unknown) smallest positive signal.
+        """
+        signal = chunk_signal(chunk)
+        if chunk_min_signal is None:
+            positive = signal > 0
+            positive_minima.append(signal[positive].min(initial=np.inf))
+            if not positive.all():
+                return False
+            # every value is positive: clipping is a no-op
+            chunk_min_signal = float(signal.min())
+        params = fit_signal(design, signal, fit_method, chunk_min_signal)
+        lower_triangular[chunk] = params[:, :6]
+        evals[chunk], evecs[chunk] = decompose_tensors(params[:, :6], min_diffusivity)
+        return True
+
+    with ThreadPoolExecutor(max_workers=max(1, nthreads)) as executor:
+        fitted = list(executor.map(fit_chunk, chunks, [min_signal] * len(chunks)))
+        deferred = [chunk for chunk, done in zip(chunks, fitted) if not done]
+        if deferred:
+            min_signal = min(positive_minima)
+            min_signal = float(min_signal) if np.isfinite(min_signal) else 1e-4
+            list(executor.map(fit_chunk, deferred, [min_signal] * len(deferred)))
+    return {
+        "voxels": voxels,
+        "lower_triangular": lower_triangular,
+        "evals": evals,
+        "evecs": evecs,
+    }
+
+
+def tensor_metrics(evals: np.ndarray, evecs: np.ndarray) -> dict:
+    """
+    Compute the metrics of fitted tensors, as dipy's ``ReconstDtiFlow`` does.
+
+    Parameters
+    ----------
+    evals : np.ndarray
+        The (..., 3) eigenvalues, in decreasing order.
+    evecs : np.ndarray
+        The (..., 3, 3) eigenvectors (as columns).
+
+    Returns
+    -------
+    dict
+        The "fa", "ga", "rgb", "md", "ad", "rd", "mode", "tensor" (lower
+        triangular elements), "evec" and "eval" of each tensor.
+    """
+    fa = dti.fractional_anisotropy(evals)
+    fa = np.clip(np.nan_to_num(fa, nan=0), 0, 1)
+    quadratic_form = dti.vec_val_vect(evecs, evals)
+    return {
+        "fa": fa,
+        "ga": dti.geodesic_anisotropy(evals),
+        "rgb": 255 * dti.color_fa(fa, evecs),
+        "md": dti.mean_diffusivity(evals),
+        "ad": dti.axial_diffusivity(evals),
+        "rd": dti.radial_diffusivity(evals),
+        "mode": dti.mode(quadratic_form),
+        "tensor": dti.lower_triangular(quadratic_form),
+        "evec": evecs,
+        "eval": evals,
+    }
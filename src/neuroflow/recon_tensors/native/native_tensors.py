@@ -0,0 +1,174 @@
+"""
+Reconstruction of diffusion tensors from the diffusion signal, in-process.
+"""
+
+from pathlib import Path
+from typing import Optional, Union
+
+import nibabel as nib
+import numpy as np
+from dipy.io import read_bvals_bvecs
+from dipy.io.utils import nifti1_symmat
+
+from neuroflow.files_mapper.files_mapper import FilesMapper
+from neuroflow.recon_tensors.native.fitting import (
+    FIT_METHODS,
+    fit_tensors,
+    tensor_metrics,
+)
+from neuroflow.recon_tensors.native.outputs import OUTPUTS
+from neuroflow.recon_tensors.recon_tensors import ReconTensors
+
+
+class NativeTensors(ReconTensors):
+    """
+    Reconstruction of diffusion tensors from the diffusion signal, with a
+    batched NumPy fitter instead of an external workflow.
+    """
+
+    OUTPUTS = OUTPUTS
+
+    def __init__(
+        self,
+        mapper: FilesMapper,
+        output_directory: Union[str, Path],
+        max_bvalue: Optional[int] = 1000,
+        bval_tol: Optional[int] = 50,
+        fit_method: Optional[str] = "WLS",
+        chunk_size: int = 10000,
+        nthreads: int = 1,
+    ):
+        """
+        Initialize the NativeTensors class.
+
+        Parameters
+        ----------
+        mapper : FilesMapper
+            An instance of FilesMapper class.
+        out_dir : Union[str, Path]
+            Path to the output directory.
+        max_bvalue : int
+            Maximum b-value to use for the reconstruction.
+        fit_method : str
+            Either "OLS", "WLS" or "NLLS" (WLS refined by non-linear least
+            squares).
+        chunk_size : int
+            Number of voxels fitted at once.
+        nthreads : int
+            Number of chunks fitted concurrently.
+        """
+        if fit_method not in FIT_METHODS:
+            raise ValueError(f"Invalid fit method: {fit_method}.")
+        super().__init__(
+            mapper=mapper,
+            output_directory=output_directory,
+            max_bvalue=max_bvalue,
+            bval_tol=bval_tol,
+        )
+        self.fit_method = fit_method
+        self.chunk_size = chunk_size
+        self.nthreads = nthreads
+        self.software = "native"
+
+    def collect_inputs(self) -> dict:
+        """
+        Gather inputs for the NativeTensors workflow.
+
+        Returns
+        -------
+        dict
+            Inputs for the NativeTensors workflow.
+        """
+        filtered_files = self.filtered_files
+        return {
+            "dwi_file": filtered_files.get("dwi_file"),
+            "bval_file": filtered_files.get("bval_file"),
+            "bvec_file": filtered_files.get("bvec_file"),
+            "mask_file": self.mapper.files.get("b0_brain_mask"),
+        }
+
+    def fingerprint_inputs(self) -> dict:
+        """
+        Gather the inputs and parameters the tensors are reconstructed from.
+
+        Returns
+        -------
+        dict
+            The inputs of :meth:`ReconTensors.fingerprint_inputs`, along with
+            the fit method.
+        """
+        inputs = super().fingerprint_inputs()
+        inputs["fit_method"] = self.fit_method
+        return inputs
+
+    def fit(self) -> dict:
+        """
+        Fit the tensors of the masked voxels and compute their metrics.
+
+        Returns
+        -------
+        dict
+            The volume of each metric (see :data:`OUTPUTS`), and the DWI's
+            "affine".
+        """
+        inputs = self.collect_inputs()
+        image = nib.load(inputs["dwi_file"])
+        bvals, bvecs = read_bvals_bvecs(
+            str(inputs["bval_file"]), str(inputs["bvec_file"])
+        )
+        mask = np.asanyarray(nib.load(inputs["mask_file"]).dataobj) > 0
+        fitted = fit_tensors(
+            np.asanyarray(image.dataobj),
+            mask,
+            bvals,
+            bvecs,
+            fit_method=self.fit_method,
+            chunk_size=self.chunk_size,
+            nthreads=self.nthreads,
+        )
+        volumes = {"affine": image.affine}
+        for key, values in tensor_metrics(fitted["evals"], fitted["evecs"]).items():
+            volume = np.zeros(mask.shape + values.shape[1:], dtype=np.float32)
+            volume[fitted["voxels"]] = values
+            volumes[key] = volume
+        return volumes
+
+    def save_outputs(self, volumes: dict, outputs: dict):
+        """
+        Save the metrics' volumes in the formats of dipy's ``ReconstDtiFlow``.
+
+        Parameters
+        ----------
+        volumes : dict
+            The volume of each metric (see :meth:`fit`).
+        outputs : dict
+            Outputs for the NativeTensors workflow.
+        """
+        affine = volumes["affine"]
+        for key, out_file in outputs.items():
+            if key == "tensor":
+                image = nifti1_symmat(volumes[key], affine)
+            elif key == "rgb":
+                image = nib.Nifti1Image(volumes[key].astype(np.uint8), affine)
+            else:
+                image = nib.Nifti1Image(volumes[key], affine)
+            nib.save(image, out_file)
+
+    def run(self, force: bool = False) -> dict:
+        """
+        Run the NativeTensors workflow, unless its outputs were reconstructed
+        from the same inputs and parameters.
+
+        Returns
+        -------
+        dict
+            Outputs for the NativeTensors workflow.
+        """
+        outputs = self.collect_outputs()
+        if not force and self.is_current(outputs):
+            return outputs
+        self.clear_outputs(outputs)
+        Path(self.output_directory / self.software).mkdir(parents=True, exist_ok=True)
+        self.save_outputs(self.fit(), outputs)
+        self.write_fingerprint()
+        return outputs
@@ -0,0 +1,5 @@
+"""
+Outputs for the native tensor reconstruction module.
+"""
+
+OUTPUTS = ["fa", "ga", "rgb", "md", "ad", "rd", "mode", "tensor", "evec", "eval"]
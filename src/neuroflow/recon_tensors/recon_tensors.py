@@ -2,12 +2,54 @@
 Reconstruction of diffusion tensors from the diffusion signal.
 """
 
+import json
+import os
 from pathlib import Path
 from typing import ClassVar, Optional, Union
 
 from nipype.interfaces.mrtrix3 import DWIExtract
 
 from neuroflow.files_mapper.files_mapper import FilesMapper
+from neuroflow.files_mapper.utils import inputs_signature
+
+
+def read_fingerprint(fingerprint_file: Path) -> Optional[dict]:
+    """
+    Read a recorded fingerprint.
+
+    Parameters
+    ----------
+    fingerprint_file : Path
+        Path to the fingerprint.
+
+    Returns
+    -------
+    Optional[dict]
+        The fingerprint, or None if it is missing or unreadable.
+    """
+    try:
+        with Path.open(fingerprint_file, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def write_fingerprint(fingerprint_file: Path, fingerprint: dict):
+    """
+    Record a fingerprint atomically, since several workflows may share it.
+
+    Parameters
+    ----------
+    fingerprint_file : Path
+        Path to the fingerprint.
+    fingerprint : dict
+        The fingerprint.
+    """
+    fingerprint_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = fingerprint_file.with_name(f".{fingerprint_file.name}.{os.getpid()}.tmp")
+    with Path.open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(fingerprint, f, indent=2)
+    tmp_file.replace(fingerprint_file)
 
 
 class ReconTensors:
@@ -19,6 +61,9 @@ class ReconTensors:
     OUTPUT_TEMPLATE: ClassVar = (
         "{software}/sub-{subject}_ses-{session}_space-dwi_acq-shell{max_bvalue}_rec-{software}_desc-{metric}_dwiref.nii.gz"  # noqa: E501
     )
+    FINGERPRINT_TEMPLATE: ClassVar = (
+        "{software}/sub-{subject}_ses-{session}_space-dwi_acq-shell{max_bvalue}_rec-{software}_fingerprint.json"  # noqa: E501
+    )
 
     DIRECTORY_NAME: ClassVar = "tensors"
 
@@ -101,21 +146,70 @@ class ReconTensors:
             bvals = [int(val) for val in f.readline().split()]
         return bvals
 
-    def crop_to_max_bvalue(self):
+    def cropped_files(self) -> dict:
         """
-        Crop the diffusion signal to the maximum b-value.
+        Get the paths of the diffusion signal cropped to the maximum b-value
+        (shared by every software).
         """
-        out_template = str(
-            self.output_directory
-            / f"sub-{self.mapper.subject}_ses-{self.mapper.session}_acq-shell{self.max_bvalue}_dwi"  # noqa: E501
-        )
+        out_template = str(self._cropped_base())
         out_files = {}
         for key, extension in zip(
             ["dwi_file", "bval_file", "bvec_file"], [".nii.gz", ".bval", ".bvec"]
         ):
             out_files[key] = Path(out_template + extension)
+        return out_files
+
+    def _cropped_base(self) -> Path:
+        """
+        Path of the cropped diffusion signal, without extension.
+        """
+        return (
+            self.output_directory
+            / f"sub-{self.mapper.subject}_ses-{self.mapper.session}_acq-shell{self.max_bvalue}_dwi"  # noqa: E501
+        )
+
+    @property
+    def crop_fingerprint_file(self) -> Path:
+        """
+        Path to the fingerprint of the cropped diffusion signal.
+        """
+        base = self._cropped_base()
+        return base.with_name(f"{base.name}_fingerprint.json")
+
+    def crop_fingerprint(self) -> dict:
+        """
+        Describe the inputs of the cropped diffusion signal (see
+        :func:`neuroflow.files_mapper.utils.inputs_signature`).
+
+        Returns
+        -------
+        dict
+            The fingerprint of the extraction, as stored on disk.
+        """
+        inputs = {
+            key: Path(self.mapper.files.get(key))
+            for key in ["dwi_file", "bval_file", "bvec_file"]
+        }
+        inputs["shells"] = sorted(self.filtered_bvalues)
+        return json.loads(json.dumps(inputs_signature(inputs)))
+
+    def crop_to_max_bvalue(self):
+        """
+        Crop the diffusion signal to the maximum b-value, unless it was
+        cropped from the same inputs. A cropped signal without a fingerprint
+        (from an earlier version) is kept, and its fingerprint recorded.
+        """
+        out_files = self.cropped_files()
+        fingerprint_file = self.crop_fingerprint_file
+        fingerprint = self.crop_fingerprint()
         if all([out_file.exists() for out_file in out_files.values()]):  # noqa
-            return out_files
+            stored = read_fingerprint(fingerprint_file)
+            if stored is None:
+                write_fingerprint(fingerprint_file, fingerprint)
+            if stored is None or stored == fingerprint:
+                return out_files
+        for out_file in out_files.values():
+            out_file.unlink(missing_ok=True)
         dwiextract = DWIExtract()
         dwiextract.inputs.in_file = self.mapper.files.get("dwi_file")
         dwiextract.inputs.grad_fsl = (
@@ -127,6 +221,7 @@ class ReconTensors:
         dwiextract.inputs.out_bval = out_files.get("bval_file")
         dwiextract.inputs.shell = self.filtered_bvalues
         dwiextract.run()
+        write_fingerprint(fingerprint_file, fingerprint)
         return out_files
 
     def collect_outputs(self) -> dict:
@@ -150,6 +245,91 @@ class ReconTensors:
             for key in self.OUTPUTS
         }
 
+    def fingerprint_inputs(self) -> dict:
+        """
+        Gather the inputs and parameters the tensors are reconstructed from.
+
+        Returns
+        -------
+        dict
+            The DWI, b-values, b-vectors and brain mask files, along with the
+            reconstructed shells.
+        """
+        inputs = {
+            key: Path(self.mapper.files.get(key))
+            for key in ["dwi_file", "bval_file", "bvec_file", "b0_brain_mask"]
+        }
+        inputs["shells"] = sorted(self.filtered_bvalues)
+        inputs["software"] = self.software
+        return inputs
+
+    def fingerprint(self) -> dict:
+        """
+        Describe the inputs and parameters of the reconstruction (see
+        :func:`neuroflow.files_mapper.utils.inputs_signature`).
+
+        Returns
+        -------
+        dict
+            The fingerprint of the reconstruction, as stored on disk.
+        """
+        return json.loads(json.dumps(inputs_signature(self.fingerprint_inputs())))
+
+    @property
+    def fingerprint_file(self) -> Path:
+        """
+        Path to the fingerprint of the last reconstruction.
+        """
+        return self.output_directory / self.FINGERPRINT_TEMPLATE.format(
+            subject=self.mapper.subject,
+            session=self.mapper.session,
+            max_bvalue=self.max_bvalue,
+            software=self.software,
+        )
+
+    def is_current(self, outputs: dict) -> bool:
+        """
+        Check whether the outputs exist and were reconstructed from the
+        current inputs and parameters. Outputs without a fingerprint (from an
+        earlier version) are kept, and their fingerprint recorded.
+
+        Parameters
+        ----------
+        outputs : dict
+            Outputs of the workflow.
+
+        Returns
+        -------
+        bool
+            Whether the reconstruction can be skipped.
+        """
+        if not all([output.exists() for output in outputs.values()]):  # noqa
+            return False
+        if not self.fingerprint_file.exists():
+            self.write_fingerprint()
+            return True
+        return read_fingerprint(self.fingerprint_file) == self.fingerprint()
+
+    def write_fingerprint(self):
+        """
+        Record the fingerprint of a finished reconstruction.
+        """
+        write_fingerprint(self.fingerprint_file, self.fingerprint())
+
+    def clear_outputs(self, outputs: dict):
+        """
+        Remove outdated outputs, along with their fingerprint. The cropped
+        diffusion signal is shared by every software, and re-extracted only
+        when its own inputs change (see :meth:`crop_to_max_bvalue`).
+
+        Parameters
+        ----------
+        outputs : dict
+            Outputs of the workflow.
+        """
+        for file in [*outputs.values(), self.fingerprint_file]:
+            file.unlink(missing_ok=True)
+
     def run(self, force: bool = False) -> dict:
         """
         Run the workflow.
@@ -178,6 +358,10 @@ class ReconTensors:
     @property
     def outputs(self) -> dict:
         """
-        Get the outputs.
+        Get the outputs, reconstructing them only if they are missing or
+        outdated.
         """
+        outputs = self.collect_outputs()
+        if self.is_current(outputs):
+            return outputs
         return self.run()
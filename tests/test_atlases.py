@@ -0,0 +1,561 @@
+"""
+This file contains the tests for the atlases module.
+"""
+
+import os
+from pathlib import Path
+from types import SimpleNamespace
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+import pytest
+
+from neuroflow.atlases import atlases as atlases_module
+from neuroflow.atlases import qc as qc_module
+from neuroflow.atlases.atlas_package import AtlasPackage
+from neuroflow.atlases.atlases import Atlases
+from neuroflow.atlases.qc_metrics import RegistrationMetrics, registration_metrics
+from neuroflow.atlases.sampling_map import SamplingMap, fsl_coordinates
+from neuroflow.atlases.utils import (
+    generate_gm_mask_from_5tt,
+    generate_gm_mask_from_smriprep,
+    optimal_threshold,
+)
+from neuroflow.parcellation.utils import load_atlas_description
+
+
+@pytest.fixture
+def mapper(tmp_path):
+    """
+    A minimal files mapper, with small placeholder inputs.
+    """
+    files = {}
+    for key in [
+        "t1w_brain",
+        "t1w_brain_mask",
+        "t1w_5tt",
+        "template_to_t1w_warp",
+        "b0_brain",
+        "b0_brain_mask",
+        "t1w_to_dwi_mat",
+    ]:
+        files[key] = tmp_path / "inputs" / f"{key}.nii.gz"
+        files[key].parent.mkdir(exist_ok=True)
+        shape = (4, 4, 4, 5) if key == "t1w_5tt" else (4, 4, 4)
+        nib.Nifti1Image(np.ones(shape, dtype=np.uint8), np.eye(4)).to_filename(
+            files[key]
+        )
+    return SimpleNamespace(subject="0001", session="1", files=files)
+
+
+@pytest.fixture
+def registrations(monkeypatch):
+    """
+    Replace the registration tools with stubs that record their calls.
+    """
+    calls = []
+    labels = np.arange(64, dtype=np.int16).reshape(4, 4, 4) % 5
+
+    def write_labels(out_file):
+        nib.Nifti1Image(labels, np.eye(4)).to_filename(out_file)
+
+    def apply_warp(self, in_file, out_file, environ=None):
+        calls.append(("T1w", Path(out_file).name, environ))
+        write_labels(out_file)
+
+    class ApplyXFM:
+        def __init__(self, out_file, **kwargs):
+            self.out_file = out_file
+            self.inputs = SimpleNamespace(environ={})
+
+        def run(self):
+            calls.append(("dwi", Path(self.out_file).name, self.inputs.environ))
+            write_labels(self.out_file)
+            matrix_file = Path(self.out_file).with_suffix(".mat")
+            matrix_file.touch()
+            return SimpleNamespace(outputs=SimpleNamespace(out_matrix_file=matrix_file))
+
+    monkeypatch.setattr(Atlases, "apply_warp", apply_warp)
+    monkeypatch.setattr(atlases_module.fsl, "ApplyXFM", ApplyXFM)
+    monkeypatch.setattr(
+        qc_module,
+        "render_entry",
+        lambda entry, force=False: calls.append(("QC", entry["atlas_name"])),
+    )
+    return calls
+
+
+def test_registrations_are_memoized(mapper, tmp_path, registrations):
+    """
+    Test that each atlas is registered once, until the inputs change.
+    """
+    atlases = Atlases(
+        mapper=mapper,
+        output_directory=tmp_path / "out",
+        atlases=["fan2016", "huang2022"],
+        crop_to_gm=False,
+        resampling="fsl",
+        qc="sync",
+    )
+    dwi_atlases = atlases.dwi_atlases
+    assert sorted(dwi_atlases) == ["fan2016", "huang2022"]
+    assert all(Path(entities["nifti"]).exists() for entities in dwi_atlases.values())
+    assert len(registrations) == 8
+    atlases.dwi_atlases["fan2016"]["nifti"] = "modified"
+    assert atlases.dwi_atlases == dwi_atlases
+    assert atlases.t1w_atlases["fan2016"]["nifti"].endswith(
+        "fan2016_res-1mm_dseg.nii.gz"
+    )
+    assert len(registrations) == 8
+    atlases.register_atlas_to_dwi(force=True)
+    assert [call[0] for call in registrations[8:]] == ["dwi", "dwi", "QC", "QC"]
+    Path(dwi_atlases["fan2016"]["nifti"]).unlink()
+    _ = atlases.dwi_atlases
+    assert [call[0] for call in registrations[12:]] == ["dwi", "QC"]
+    inputs = atlases._registration_inputs("dwi", atlases.t1w_atlases)
+    assert atlases.registrations.get("dwi", inputs, atlases.label) is not None
+    mapper.files["t1w_to_dwi_mat"].write_text("changed")
+    assert atlases.registrations.get("dwi", inputs, atlases.label) is None
+
+
+def test_parallel_registrations(mapper, tmp_path, registrations):
+    """
+    Test that atlases are registered concurrently within the thread budget,
+    and that their QC images are rendered in order.
+    """
+    atlases = Atlases(
+        mapper=mapper,
+        output_directory=tmp_path / "out",
+        atlases=["fan2016", "huang2022", "schaefer2018_100_7"],
+        crop_to_gm=False,
+        nthreads=6,
+        resampling="fsl",
+        qc="sync",
+    )
+    _ = atlases.dwi_atlases
+    for space in ["T1w", "dwi"]:
+        calls = [call for call in registrations if call[0] == space]
+        assert len(calls) == 3
+        assert all(call[2]["OMP_NUM_THREADS"] == "2" for call in calls)
+    qc_calls = [call[1] for call in registrations if call[0] == "QC"]
+    assert qc_calls == ["fan2016", "huang2022", "schaefer2018_100_7"] * 2
+
+
+def test_label_variants(mapper, tmp_path, registrations):
+    """
+    Test that GM-cropped and whole-brain atlases are registered once each,
+    without changing the label of the shared atlases manager.
+    """
+    atlases = Atlases(
+        mapper=mapper,
+        output_directory=tmp_path / "out",
+        atlases=["fan2016"],
+        crop_to_gm=True,
+        resampling="fsl",
+        qc="sync",
+    )
+    gm_atlases = atlases.dwi_atlases
+    whole_brain = atlases.variant(crop_to_gm=False)
+    whole_brain_atlases = whole_brain.dwi_atlases
+    assert atlases.label == "GM" and whole_brain.label == "WholeBrain"
+    assert "label-GM" in gm_atlases["fan2016"]["nifti"]
+    assert "label-WholeBrain" in whole_brain_atlases["fan2016"]["nifti"]
+    assert atlases.dwi_atlases == gm_atlases
+    assert atlases.variant(crop_to_gm=False) is whole_brain
+    assert whole_brain.variant(crop_to_gm=True) is atlases
+    assert [call[0] for call in registrations if call[0] != "QC"] == [
+        "T1w",
+        "dwi",
+    ] * 2
+    summary = atlases.qc_metrics.read()
+    assert sorted(summary["label"]) == ["GM", "GM", "WholeBrain", "WholeBrain"]
+
+
+def test_subject_atlases_are_reused(mapper, tmp_path, registrations):
+    """
+    Test that the T1w-space atlases of a subject's sessions with the same
+    inputs are registered once, and only the diffusion step is recomputed.
+    """
+    outputs = {}
+    for session in ["1", "2"]:
+        atlases = Atlases(
+            mapper=SimpleNamespace(
+                subject=mapper.subject, session=session, files=mapper.files
+            ),
+            output_directory=tmp_path / "out",
+            atlases=["fan2016", "huang2022"],
+            crop_to_gm=False,
+            resampling="fsl",
+            qc="skip",
+        )
+        outputs[session] = atlases.dwi_atlases
+    assert [call[0] for call in registrations] == ["T1w"] * 2 + ["dwi"] * 4
+    t1w_file = Path(atlases.t1w_atlases["fan2016"]["nifti"])
+    assert "ses-2" in t1w_file.name and t1w_file.exists()
+    assert Path(outputs["2"]["fan2016"]["nifti"]).exists()
+    # a different T1w image is registered again
+    nib.Nifti1Image(np.zeros((4, 4, 4), dtype=np.uint8), np.eye(4)).to_filename(
+        mapper.files["t1w_brain"]
+    )
+    atlases = Atlases(
+        mapper=SimpleNamespace(subject=mapper.subject, session="3", files=mapper.files),
+        output_directory=tmp_path / "out",
+        atlases=["fan2016"],
+        crop_to_gm=False,
+        resampling="fsl",
+        qc="skip",
+    )
+    _ = atlases.t1w_atlases
+    assert [call[0] for call in registrations[6:]] == ["T1w"]
+
+
+def test_deferred_qc(mapper, tmp_path, registrations):
+    """
+    Test that deferred QC images are only recorded in the session's manifest,
+    and rendered later for the whole cohort.
+    """
+    atlases = Atlases(
+        mapper=mapper,
+        output_directory=tmp_path / "out",
+        atlases=["fan2016", "huang2022"],
+        crop_to_gm=False,
+        resampling="fsl",
+        qc="deferred",
+    )
+    _ = atlases.dwi_atlases
+    assert not [call for call in registrations if call[0] == "QC"]
+    entries = atlases.qc_renderer.manifest.entries()
+    assert [entry["reference_name"] for entry in entries] == ["T1w"] * 2 + ["DWI"] * 2
+    summary = atlases.qc_metrics.read()
+    assert list(zip(summary["atlas"], summary["space"])) == [
+        ("fan2016", "T1w"),
+        ("huang2022", "T1w"),
+        ("fan2016", "dwi"),
+        ("huang2022", "dwi"),
+    ]
+    assert (summary["fraction_in_mask"] == 1).all()
+    qc_module.qc_image_file(entries[0]["atlas"]).touch()
+    assert qc_module.render_cohort(tmp_path / "out") == 3
+    assert [call[1] for call in registrations if call[0] == "QC"] == [
+        "huang2022",
+        "fan2016",
+        "huang2022",
+    ]
+
+
+def test_background_qc_errors(tmp_path):
+    """
+    Test that background renderings are waited for when leaving the
+    renderer's context, and that their errors are raised.
+    """
+    manifest = qc_module.QCManifest(tmp_path / "sub-01_ses-1_QC.json")
+    entry = {
+        "atlas": str(tmp_path / "missing_dseg.nii.gz"),
+        "reference": str(tmp_path / "missing_T1w.nii.gz"),
+        "atlas_name": "fan2016",
+        "reference_name": "T1w",
+    }
+    with pytest.raises(RuntimeError, match="1 QC image"):
+        with qc_module.QCRenderer(manifest, mode="background") as renderer:
+            renderer.submit([entry])
+    assert renderer._executor is None
+    assert manifest.entries() == [entry]
+
+
+def test_registration_metrics():
+    """
+    Test the numeric QC metrics of a registered atlas.
+    """
+    source_counts = np.array([0, 16, 16, 8, 0, 8])
+    labels = np.zeros((4, 4, 2), dtype=np.int32)
+    labels[:2] = 1
+    labels[2, :2] = 2
+    labels[3, 0] = 5
+    mask = np.ones(labels.shape, dtype=np.uint8)
+    mask[:, :, 1] = 0
+    summary, regions = registration_metrics(
+        labels, source_counts, voxel_volume=2.0, source_voxel_volume=1.0, mask=mask
+    )
+    assert summary["n_regions"] == 4
+    assert summary["n_lost_regions"] == 1
+    assert summary["lost_regions"] == "3"
+    assert summary["labelled_voxels"] == 22
+    assert summary["fraction_in_mask"] == 0.5
+    np.testing.assert_array_equal(regions["region"], [1, 2, 3, 5])
+    np.testing.assert_array_equal(regions["voxels"], [16, 4, 0, 2])
+    np.testing.assert_allclose(regions["volume_ratio"], [2, 0.5, 0, 0.5])
+
+
+@pytest.mark.parametrize("mask_grid", ["same", "shape", "affine"])
+def test_registration_metrics_mask_grid(tmp_path, mask_grid):
+    """
+    Test that a brain mask on another grid than the registered atlas' is
+    ignored, with a warning, rather than failing the registration's QC.
+    """
+    labels = np.zeros((4, 4, 2), dtype=np.int16)
+    labels[:2] = 1
+    nib.Nifti1Image(labels, np.eye(4)).to_filename(tmp_path / "source.nii.gz")
+    mask_shape = (5, 4, 2) if mask_grid == "shape" else labels.shape
+    mask_affine = np.diag([2.0, 2.0, 2.0, 1.0]) if mask_grid == "affine" else np.eye(4)
+    nib.Nifti1Image(np.ones(mask_shape, dtype=np.uint8), mask_affine).to_filename(
+        tmp_path / "mask.nii.gz"
+    )
+    metrics = RegistrationMetrics(tmp_path, "0001", "1")
+    mask = metrics.load_mask(tmp_path / "mask.nii.gz")
+    registered = nib.Nifti1Image(labels, np.eye(4))
+    if mask_grid == "same":
+        summary, _ = metrics.compute(
+            "atlas", "T1w", registered, tmp_path / "source.nii.gz", mask=mask
+        )
+        assert summary["fraction_in_mask"] == 1
+        return
+    with pytest.warns(UserWarning, match="not on the grid"):
+        summary, _ = metrics.compute(
+            "atlas", "T1w", registered, tmp_path / "source.nii.gz", mask=mask
+        )
+    assert np.isnan(summary["fraction_in_mask"])
+    assert summary["n_lost_regions"] == 0
+
+
+@pytest.mark.parametrize("x_zoom", [-2.0, 2.0])
+@pytest.mark.parametrize("field", ["relative", "fnirt", "absolute"])
+def test_sampling_map(tmp_path, x_zoom, field):
+    """
+    Test that the sampling map composes the warp and the affine, in FSL's
+    coordinates, with the T1w mask applied, for relative and absolute
+    displacement fields (including FNIRT's "fnirt disp field" intent).
+    """
+    shape, affine = (10, 12, 14), np.diag([x_zoom, 2.0, 2.0, 1.0])
+    rng = np.random.default_rng(0)
+    atlas = rng.integers(1, 50, size=shape).astype(np.float32)
+    mask = np.ones(shape, dtype=np.uint8)
+    mask[:, :, :3] = 0
+    warp = np.zeros((*shape, 3), dtype=np.float32)
+    warp[..., 0], warp[..., 1] = 2.0, 2.0  # one voxel along x and y
+    matrix = np.eye(4)
+    matrix[2, 3] = 2.0  # one voxel along z
+    files = {
+        "atlas": atlas,
+        "t1w_brain": np.ones(shape, dtype=np.float32),
+        "t1w_mask": mask,
+        "warp": warp,
+        "b0_brain": np.ones(shape, dtype=np.float32),
+    }
+    for name, data in files.items():
+        files[name] = tmp_path / f"{name}.nii.gz"
+        image = nib.Nifti1Image(data, affine)
+        if name == "warp" and field == "fnirt":
+            image.header.set_intent("fnirt disp field")
+        elif name == "warp" and field == "absolute":
+            image = nib.Nifti1Image(data + fsl_coordinates(image), affine)
+        image.to_filename(files[name])
+    np.savetxt(tmp_path / "t1w_to_dwi.mat", matrix)
+    assert SamplingMap.supports(files["warp"], files["t1w_brain"])
+    sampling_map = SamplingMap(
+        warp_file=files["warp"],
+        t1w_reference=files["t1w_brain"],
+        t1w_mask=files["t1w_mask"],
+        t1w_to_dwi_mat=tmp_path / "t1w_to_dwi.mat",
+        dwi_reference=files["b0_brain"],
+    )
+    out_file = sampling_map.apply(files["atlas"], tmp_path / "dwi.nii.gz", "dwi")
+    result = nib.load(out_file)
+    assert result.get_data_dtype() == np.uint8
+    np.testing.assert_array_equal(result.affine, affine)
+    # FSL's x axis runs against the voxels of images with a positive determinant
+    x_step = -1 if x_zoom > 0 else 1
+    expected = np.zeros(shape, dtype=np.uint8)
+    x_stop = shape[0] - 1
+    target_x = slice(1, None) if x_step < 0 else slice(0, x_stop)
+    source_x = slice(0, x_stop) if x_step < 0 else slice(1, None)
+    expected[target_x, :-1, 4:] = atlas[source_x, 1:, 3:-1]
+    np.testing.assert_array_equal(result.get_fdata(), expected)
+
+
+def test_sampling_map_coefficient_fields(tmp_path):
+    """
+    Test that FNIRT coefficient fields are left to FSL.
+    """
+    shape, affine = (4, 4, 4), np.diag([-2.0, 2.0, 2.0, 1.0])
+    reference = tmp_path / "t1w.nii.gz"
+    nib.Nifti1Image(np.ones(shape, dtype=np.float32), affine).to_filename(reference)
+    warp = nib.Nifti1Image(np.zeros((*shape, 3), dtype=np.float32), affine)
+    warp.header.set_intent("fnirt cubic spline coef")
+    warp.to_filename(tmp_path / "warp.nii.gz")
+    assert not SamplingMap.supports(tmp_path / "warp.nii.gz", reference)
+
+
+def test_direct_dwi_registration(tmp_path, monkeypatch):
+    """
+    Test that natively resampled atlases are sampled directly from the MNI
+    space, without writing T1w-space atlases.
+    """
+    shape, affine = (8, 9, 10), np.diag([-2.0, 2.0, 2.0, 1.0])
+    images = {
+        "atlas": np.random.default_rng(0).integers(0, 5, size=shape),
+        "t1w_brain": np.ones(shape),
+        "t1w_brain_mask": np.ones(shape),
+        "template_to_t1w_warp": np.zeros((*shape, 3)),
+        "b0_brain": np.ones(shape),
+    }
+    files = {}
+    for name, data in images.items():
+        files[name] = tmp_path / "inputs" / f"{name}.nii.gz"
+        files[name].parent.mkdir(exist_ok=True)
+        nib.Nifti1Image(data.astype(np.float32), affine).to_filename(files[name])
+    files["t1w_to_dwi_mat"] = tmp_path / "inputs" / "t1w_to_dwi.mat"
+    np.savetxt(files["t1w_to_dwi_mat"], np.eye(4))
+    atlas_file = files.pop("atlas")
+    monkeypatch.setattr(
+        Atlases, "ATLASES", {"synthetic": {"nifti": atlas_file}}, raising=True
+    )
+    checks = []
+    supports = SamplingMap.supports
+    monkeypatch.setattr(
+        SamplingMap,
+        "supports",
+        lambda *args: checks.append(args) or supports(*args),
+    )
+    atlases = Atlases(
+        mapper=SimpleNamespace(subject="0001", session="1", files=files),
+        output_directory=tmp_path / "out",
+        crop_to_gm=False,
+        qc="skip",
+    )
+    dwi_file = Path(atlases.dwi_atlases["synthetic"]["nifti"])
+    assert atlases.dwi_atlases["synthetic"]["nifti"] == str(dwi_file)
+    assert len(checks) == 1
+    np.testing.assert_array_equal(nib.load(dwi_file).get_fdata(), images["atlas"])
+    assert not list(dwi_file.parent.glob("*space-T1w*"))
+    t1w_file = Path(atlases.register_atlas_to_t1w()["synthetic"]["nifti"])
+    np.testing.assert_array_equal(nib.load(t1w_file).get_fdata(), images["atlas"])
+    # skipping the QC images still writes the numeric QC tables
+    assert not atlases.qc_renderer.manifest.path.exists()
+    summary = atlases.qc_metrics.read()
+    assert list(summary["space"]) == ["dwi", "T1w"]
+    assert (summary["n_lost_regions"] == 0).all()
+    assert not atlases._resampled
+
+
+def test_gm_masks(tmp_path):
+    """
+    Test the grey matter masks generated from a 5TT image and from a
+    probabilistic segmentation.
+    """
+    rng = np.random.default_rng(0)
+    affine = np.diag([2.0, 2.0, 2.0, 1.0])
+    five_tissue_type = rng.random((6, 7, 8, 5)).astype(np.float32)
+    nib.Nifti1Image(five_tissue_type, affine).to_filename(tmp_path / "5tt.nii.gz")
+    generate_gm_mask_from_5tt(tmp_path / "5tt.nii.gz", tmp_path / "5tt_mask.nii.gz")
+    mask = nib.load(tmp_path / "5tt_mask.nii.gz")
+    assert mask.get_data_dtype() == np.float32
+    np.testing.assert_array_equal(mask.affine, affine)
+    expected = five_tissue_type[..., :2].max(axis=-1) >= 0.5
+    np.testing.assert_array_equal(mask.get_fdata(), expected)
+
+    probseg = np.round(rng.beta(0.5, 0.5, size=(6, 7, 8)), 2).astype(np.float32)
+    nib.Nifti1Image(probseg, affine).to_filename(tmp_path / "probseg.nii.gz")
+    threshold = optimal_threshold(probseg)
+    # the threshold maximizes the image's correlation with its binarization
+    correlations = {
+        value: np.corrcoef(probseg.ravel(), (probseg > value).ravel())[0, 1]
+        for value in np.unique(probseg)[:-1]
+    }
+    assert threshold == max(correlations, key=correlations.get)
+    generate_gm_mask_from_smriprep(
+        tmp_path / "probseg.nii.gz", tmp_path / "probseg_mask.nii.gz"
+    )
+    mask = nib.load(tmp_path / "probseg_mask.nii.gz")
+    assert mask.get_data_dtype() == np.uint8
+    np.testing.assert_array_equal(mask.get_fdata(), probseg > threshold)
+
+
+def test_atlas_package(tmp_path):
+    """
+    Test that an atlas package holds the atlas' compact labels, lookup table
+    and description, and is rebuilt when the atlas changes.
+    """
+    labels = np.zeros((6, 7, 8), dtype=np.int32)
+    labels[1:3, 2:4, 3:6] = 300
+    labels[4, 5, 6] = 2
+    nib.Nifti1Image(labels.astype(np.float64), np.diag([2, 2, 2, 1])).to_filename(
+        tmp_path / "atlas_dseg.nii.gz"
+    )
+    description = pd.DataFrame(
+        {"label": [2, 300, 7], "name": ["a", "b", "c"], "lobe": ["x", None, "z"]}
+    )
+    description.to_csv(tmp_path / "atlas_dseg.csv")
+    entities = {
+        "nifti": tmp_path / "atlas_dseg.nii.gz",
+        "description_file": tmp_path / "atlas_dseg.csv",
+        "region_col": "label",
+        "index_col": 0,
+        "name_col": "name",
+        "package": tmp_path / "atlas_package.npz",
+    }
+    AtlasPackage.from_entities(entities)
+    package = AtlasPackage.load(entities["package"])
+    assert package.labels.dtype == np.uint16
+    np.testing.assert_array_equal(package.to_image().get_fdata(), labels)
+    np.testing.assert_array_equal(package.to_image().affine, np.diag([2, 2, 2, 1]))
+    np.testing.assert_array_equal(package.regions, [2, 300, 7])
+    np.testing.assert_array_equal(package.counts, [1, 12, 0])
+    np.testing.assert_array_equal(package.bboxes[1], [[1, 3], [2, 4], [3, 6]])
+    np.testing.assert_array_equal(package.names, ["a", "b", "c"])
+    registered = {
+        **entities,
+        "nifti": tmp_path / "registered_dseg.nii.gz",
+        "mni_nifti": entities["nifti"],
+    }
+    for atlas_entities in [entities, registered]:
+        pd.testing.assert_frame_equal(
+            load_atlas_description(atlas_entities),
+            pd.read_csv(entities["description_file"], index_col=0),
+        )
+    description.loc[0, "name"] = "d"
+    description.to_csv(entities["description_file"])
+    stat = entities["description_file"].stat()
+    os.utime(
+        entities["description_file"], ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9)
+    )
+    assert load_atlas_description(registered).loc[0, "name"] == "d"
+    labels[labels == 300] = 3
+    nib.Nifti1Image(labels, np.diag([2, 2, 2, 1])).to_filename(entities["nifti"])
+    assert AtlasPackage.from_entities(entities).labels.dtype == np.uint8
+
+
+def test_atlas_package_fallback(tmp_path, monkeypatch):
+    """
+    Test that packages that cannot be written next to their atlas are cached
+    in the user's cache directory, and that their labels are read lazily.
+    """
+    labels = np.zeros((4, 5, 6), dtype=np.int16)
+    labels[1:3, 2:4, 3] = 5
+    nib.Nifti1Image(labels, np.eye(4)).to_filename(tmp_path / "atlas_dseg.nii.gz")
+    pd.DataFrame({"label": [5], "name": ["a"]}).to_csv(tmp_path / "atlas_dseg.csv")
+    (tmp_path / "read-only").write_text("")
+    entities = {
+        "nifti": tmp_path / "atlas_dseg.nii.gz",
+        "description_file": tmp_path / "atlas_dseg.csv",
+        "region_col": "label",
+        "index_col": 0,
+        "name_col": "name",
+        # a file's "sub-directory" cannot be written, even by root
+        "package": tmp_path / "read-only" / "atlas_package.npz",
+    }
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    with pytest.warns(UserWarning, match="Cannot write the atlas package"):
+        AtlasPackage.from_entities(entities)
+    fallback = AtlasPackage.candidate_paths(entities["package"])[1]
+    assert fallback.is_relative_to(tmp_path / "cache")
+    assert fallback.exists()
+
+    def unexpected_build(*args):
+        raise AssertionError("The package was rebuilt.")
+
+    monkeypatch.setattr(AtlasPackage, "build", unexpected_build)
+    package = AtlasPackage.from_entities(entities)
+    assert callable(package._labels)
+    assert load_atlas_description(entities)["name"].tolist() == ["a"]
+    np.testing.assert_array_equal(package.labels, labels)
@@ -0,0 +1,34 @@
+"""
+This file contains the tests for the connectome module.
+"""
+
+from types import SimpleNamespace
+
+import nibabel as nib
+import numpy as np
+
+from neuroflow.atlases.voxel_index import VoxelIndex
+from neuroflow.connectome.connectome_reconstructor import ConnectomeReconstructor
+
+
+def test_node_volumes(tmp_path):
+    """
+    Test that the node volumes are read from the atlas' cached voxel index.
+    """
+    nodes = np.zeros((5, 6, 7), dtype=np.int16)
+    nodes[1:3, 2:5, 3] = 4
+    nodes[4, 0, 1:6] = 9
+    nib.Nifti1Image(nodes, np.diag([2, 2, 3, 1])).to_filename(tmp_path / "nodes.nii")
+    atlases_manager = SimpleNamespace(
+        dwi_atlases={"atlas": {"nifti": tmp_path / "nodes.nii"}}
+    )
+    atlases_manager.variant = lambda crop_to_gm: atlases_manager
+    reconstructor = ConnectomeReconstructor(
+        SimpleNamespace(subject="0001", session="1"), atlases_manager
+    )
+    volumes = reconstructor.get_node_volumes("atlas")
+    assert VoxelIndex.cache_path(tmp_path / "nodes.nii").exists()
+    assert volumes["label"].tolist() == [4, 9]
+    assert volumes["n_voxels"].tolist() == [6, 5]
+    np.testing.assert_allclose(volumes["volume"], [72, 60])
+    assert reconstructor.get_node_volumes("atlas").equals(volumes)
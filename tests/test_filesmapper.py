@@ -2,7 +2,14 @@
 This file contains the tests for the filesmapper module.
 """
 
+import json
+
+import pytest
+
+from neuroflow.files_mapper import utils
+from neuroflow.files_mapper.dataset_index import DatasetIndex
 from neuroflow.files_mapper.files_mapper import FilesMapper
+from neuroflow.files_mapper.utils import scan_directory as scan
 
 
 def test_files_mapper_subject_session():
@@ -13,3 +20,103 @@ def test_files_mapper_subject_session():
     mapper = FilesMapper(path)
     assert mapper.subject == "0001"
     assert mapper.session == "1"
+
+
+def test_files_mapper_resolves_once(tmp_path, monkeypatch):
+    """
+    Test that the files are resolved with one scan per directory, cached
+    until refreshed.
+    """
+    patterns = {
+        "dwi_file": "data/{subject}_{session}.nii.gz",
+        "bval_file": "raw_data/bvals",
+        "t1w": "raw_data/mprage.nii.gz",
+    }
+    (tmp_path / "patterns.json").write_text(json.dumps(patterns))
+    session_dir = tmp_path / "1" / "2"
+    for pattern in patterns.values():
+        file = session_dir / pattern.format(subject="0001", session="2")
+        file.parent.mkdir(parents=True, exist_ok=True)
+        file.touch()
+    scans = []
+
+    def scan_directory(directory):
+        scans.append(directory)
+        return scan(directory)
+
+    monkeypatch.setattr(utils, "scan_directory", scan_directory)
+    mapper = FilesMapper(session_dir, patterns=tmp_path / "patterns.json")
+    files = mapper.files
+    assert files["t1w"] == session_dir / "raw_data" / "mprage.nii.gz"
+    files["t1w"] = None
+    assert mapper.files["t1w"] is not None
+    assert len(scans) == 2
+    (session_dir / "raw_data" / "bvals").unlink()
+    assert mapper.files["bval_file"].name == "bvals"
+    with pytest.raises(FileNotFoundError, match="bval_file missing"):
+        mapper.refresh()
+    assert len(scans) == 4
+
+
+def test_files_mapper_discover(tmp_path):
+    """
+    Test that a dataset's sessions and their files are discovered at once.
+    """
+    patterns = {"dwi_file": "data/{subject}_{session}.nii.gz", "bval_file": "bvals"}
+    (tmp_path / "patterns.json").write_text(json.dumps(patterns))
+    root = tmp_path / "dataset"
+    for subject, session in [("1", "1"), ("1", "2"), ("23", "1")]:
+        session_dir = root / subject / session
+        (session_dir / "data").mkdir(parents=True)
+        (session_dir / "data" / f"{subject.zfill(4)}_{session}.nii.gz").touch()
+        if session == "1":
+            (session_dir / "bvals").touch()
+    discovered = FilesMapper.discover(
+        root, patterns=tmp_path / "patterns.json", nthreads=2
+    )
+    assert len(discovered) == 6
+    assert discovered["exists"].sum() == 5
+    missing = discovered.loc[~discovered["exists"]].iloc[0]
+    assert (missing["subject"], missing["session"], missing["key"]) == (
+        "0001",
+        "2",
+        "bval_file",
+    )
+    complete = FilesMapper.complete_sessions(discovered)
+    assert list(zip(complete["subject"], complete["session"])) == [
+        ("0001", "1"),
+        ("0023", "1"),
+    ]
+    mapper = FilesMapper(complete["directory"][1], patterns=tmp_path / "patterns.json")
+    assert mapper.files["bval_file"] == root / "23" / "1" / "bvals"
+
+
+def test_dataset_index_refresh(tmp_path):
+    """
+    Test that the dataset index only re-scans the sessions that changed.
+    """
+    patterns = {"dwi_file": "data/{subject}_{session}.nii.gz", "bval_file": "bvals"}
+    (tmp_path / "patterns.json").write_text(json.dumps(patterns))
+    root = tmp_path / "dataset"
+    for subject, session in [("1", "1"), ("1", "2")]:
+        (root / subject / session / "data").mkdir(parents=True)
+        (root / subject / session / "bvals").write_text("0 1000")
+    index_file = tmp_path / "index.sqlite"
+    index = DatasetIndex(index_file, root, tmp_path / "patterns.json")
+    assert index.refresh() == 2
+    assert index.refresh() == 0
+    assert index.sessions_with(["dwi_file"]).empty
+    (root / "1" / "2" / "data" / "0001_2.nii.gz").write_bytes(b"dwi")
+    (root / "2" / "1").mkdir(parents=True)
+    index = DatasetIndex(index_file, root, tmp_path / "patterns.json")
+    assert index.refresh() == 2
+    files = index.files(["dwi_file"]).set_index(["subject", "session"])
+    assert files.loc[("0001", "2"), "size"] == 3
+    assert not files.loc[("0002", "1"), "exists"]
+    complete = index.sessions_with(["dwi_file", "bval_file"])
+    assert list(zip(complete["subject"], complete["session"])) == [("0001", "2")]
+    discovered = FilesMapper.discover(
+        root, patterns=tmp_path / "patterns.json", index=index_file
+    )
+    assert list(discovered.columns) == FilesMapper.DISCOVERY_COLUMNS
+    assert len(discovered) == 6
@@ -0,0 +1,66 @@
+"""
+This file contains the tests for the images module.
+"""
+
+import nibabel as nib
+import numpy as np
+
+from neuroflow.images import ImageLoader
+
+
+def test_image_loader_dtypes(tmp_path):
+    """
+    Test that labels stay integers, metrics are float32 and uncompressed
+    images are memory-mapped.
+    """
+    labels = np.arange(24, dtype=np.int16).reshape(2, 3, 4)
+    nib.Nifti1Image(labels, np.eye(4)).to_filename(tmp_path / "labels.nii")
+    nib.Nifti1Image(labels.astype(np.float64), np.eye(4)).to_filename(
+        tmp_path / "float_labels.nii.gz"
+    )
+    metric = np.linspace(0, 1, 24, dtype=np.float32).reshape(2, 3, 4)
+    nib.Nifti1Image(metric, np.eye(4)).to_filename(tmp_path / "metric.nii")
+
+    loader = ImageLoader()
+    label_data = loader.load_labels(tmp_path / "labels.nii")
+    assert isinstance(label_data, np.memmap)
+    assert label_data.dtype == np.int16
+    float_label_data = loader.load_labels(tmp_path / "float_labels.nii.gz")
+    assert np.issubdtype(float_label_data.dtype, np.integer)
+    np.testing.assert_array_equal(float_label_data, labels)
+    metric_data = loader.load_metric(tmp_path / "metric.nii")
+    assert isinstance(metric_data, np.memmap)
+    assert metric_data.dtype == np.float32
+    float64_loader = ImageLoader(metric_dtype="float64")
+    assert float64_loader.load_metric(tmp_path / "metric.nii").dtype == np.float64
+
+
+def test_load_mif(tmp_path):
+    """
+    Test that MRtrix3 images are read in the order of their axes, whatever
+    their storage layout.
+    """
+    expected = np.arange(2 * 3 * 4 * 2, dtype=np.float32).reshape(2, 3, 4, 2)
+    # axis 0 stored fastest and reversed, then axis 3, axis 2 and axis 1
+    stored = np.flip(expected, axis=0).transpose(1, 2, 3, 0)
+    header = (
+        "mrtrix image\n"
+        "dim: 2,3,4,2\n"
+        "vox: 2,2.5,3,1\n"
+        "layout: -0,+3,+2,+1\n"
+        "datatype: Float32LE\n"
+        "transform: 1,0,0,-10\n"
+        "transform: 0,1,0,-20\n"
+        "transform: 0,0,1,-30\n"
+        "file: . 256\n"
+        "END\n"
+    ).encode()
+    content = header.ljust(256, b"\0") + stored.astype("<f4").tobytes()
+    (tmp_path / "image.mif").write_bytes(content)
+
+    image = ImageLoader().load(tmp_path / "image.mif")
+    np.testing.assert_array_equal(image.get_fdata(), expected)
+    np.testing.assert_array_equal(
+        image.affine[:3], [[2, 0, 0, -10], [0, 2.5, 0, -20], [0, 0, 3, -30]]
+    )
+    assert image.header.get_zooms()[:3] == (2.0, 2.5, 3.0)
@@ -0,0 +1,351 @@
+"""
+This file contains the tests for the parcellation module.
+"""
+
+from types import SimpleNamespace
+
+import nibabel as nib
+import numpy as np
+import pandas as pd
+import pytest
+
+from neuroflow.atlases.voxel_index import VoxelIndex, group_voxels
+from neuroflow.parcellation.available_measures import AVAILABLE_MEASURES
+from neuroflow.parcellation.measure_kernels import MeasureKernels
+from neuroflow.parcellation.parcellation import Parcellation
+from neuroflow.parcellation.utils import (
+    parcellate,
+    parcellate_measures,
+    parcellate_metrics,
+    parcellate_metrics_to_file,
+    parcellate_to_file,
+)
+
+
+@pytest.fixture
+def atlas_entities(tmp_path):
+    """
+    A small synthetic atlas with a region that is missing from the image.
+    """
+    rng = np.random.default_rng(42)
+    atlas_data = rng.integers(0, 5, size=(6, 7, 8)).astype(np.float32)
+    nib.Nifti1Image(atlas_data, np.eye(4)).to_filename(tmp_path / "atlas.nii.gz")
+    pd.DataFrame({"index": [1, 2, 3, 4, 7]}).to_csv(tmp_path / "atlas.csv")
+    return {
+        "nifti": tmp_path / "atlas.nii.gz",
+        "description_file": tmp_path / "atlas.csv",
+        "region_col": "index",
+        "index_col": 0,
+    }
+
+
+@pytest.fixture
+def metric_image(tmp_path):
+    """
+    A synthetic metric image with a few NaN voxels.
+    """
+    rng = np.random.default_rng(0)
+    metric_data = rng.normal(size=(6, 7, 8))
+    metric_data[0, 0, :3] = np.nan
+    out_file = tmp_path / "metric.nii.gz"
+    nib.Nifti1Image(metric_data, np.eye(4)).to_filename(out_file)
+    return out_file
+
+
+def test_group_voxels():
+    """
+    Test that voxels are grouped by label in C order.
+    """
+    atlas_data = np.array([[0, 2, 1], [2, 0, 1]])
+    labels, order, offsets = group_voxels(atlas_data)
+    assert labels.tolist() == [1, 2]
+    assert order.tolist() == [2, 5, 1, 3]
+    assert offsets.tolist() == [0, 2, 4]
+
+
+def test_voxel_index_cache(atlas_entities):
+    """
+    Test that the voxel index is cached next to the atlas and invalidated
+    when the atlas changes.
+    """
+    voxel_index = VoxelIndex.from_file(atlas_entities["nifti"])
+    cache_file = VoxelIndex.cache_path(atlas_entities["nifti"])
+    assert cache_file == atlas_entities["nifti"].parent / "atlas_voxelindex.npz"
+    assert cache_file.exists()
+    cached = VoxelIndex.from_file(atlas_entities["nifti"])
+    np.testing.assert_array_equal(cached.order, voxel_index.order)
+    assert cached.shape == (6, 7, 8)
+    nib.Nifti1Image(np.ones((6, 7, 8)), np.eye(4)).to_filename(atlas_entities["nifti"])
+    updated = VoxelIndex.from_file(atlas_entities["nifti"])
+    assert updated.labels.tolist() == [1]
+    assert updated.counts.tolist() == [6 * 7 * 8]
+
+
+def test_voxel_index_bounding_boxes(tmp_path):
+    """
+    Test that the voxel index is restricted to the atlas' bounding box.
+    """
+    atlas_data = np.zeros((10, 10, 10), dtype=np.int16)
+    atlas_data[2:4, 3:7, 5] = 1
+    atlas_data[5, 6, 4:9] = 2
+    nib.Nifti1Image(atlas_data, np.eye(4)).to_filename(tmp_path / "atlas.nii")
+    voxel_index = VoxelIndex.from_file(tmp_path / "atlas.nii")
+    assert voxel_index.bbox.tolist() == [[2, 6], [3, 7], [4, 9]]
+    assert voxel_index.label_bboxes.tolist() == [
+        [[2, 4], [3, 7], [5, 6]],
+        [[5, 6], [6, 7], [4, 9]],
+    ]
+    metric_data = np.arange(1000, dtype=np.float32).reshape(10, 10, 10)
+    values = voxel_index.gather(metric_data)
+    for label, (start, stop) in zip([1, 2], voxel_index.region_bounds([1, 2])):
+        np.testing.assert_array_equal(
+            values[start:stop], metric_data[atlas_data == label]
+        )
+    with pytest.raises(ValueError):
+        voxel_index.gather(metric_data[:, :, :8])
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+@pytest.mark.parametrize("measure_name", list(AVAILABLE_MEASURES))
+def test_parcellate_matches_masking(atlas_entities, metric_image, measure_name):
+    """
+    Test that the grouped parcellation matches a per-region masking.
+    """
+    measure = AVAILABLE_MEASURES[measure_name]
+    atlas_data = nib.load(atlas_entities["nifti"]).get_fdata()
+    metric_data = nib.load(metric_image).get_fdata(dtype=np.float32)
+    expected = [
+        measure(metric_data[atlas_data == region]) for region in [1, 2, 3, 4, 7]
+    ]
+    result = parcellate(atlas_entities, metric_image, measure)
+    assert list(result.columns) == ["index", "value"]
+    np.testing.assert_allclose(result["value"], expected)
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_parcellate_measures(atlas_entities, metric_image):
+    """
+    Test that all measures are collected in a single table.
+    """
+    result = parcellate_measures(atlas_entities, metric_image, AVAILABLE_MEASURES)
+    assert list(result.columns) == ["index", *AVAILABLE_MEASURES]
+    for measure_name, measure in AVAILABLE_MEASURES.items():
+        expected = parcellate(atlas_entities, metric_image, measure)["value"]
+        np.testing.assert_allclose(result[measure_name], expected)
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_parcellate_metrics(atlas_entities, metric_image, tmp_path):
+    """
+    Test that stacked metrics match the per-metric parcellation.
+    """
+    rng = np.random.default_rng(1)
+    scalar, multi_volume = tmp_path / "scalar.nii.gz", tmp_path / "multi.nii.gz"
+    nib.Nifti1Image(rng.gamma(2, size=(6, 7, 8)), np.eye(4)).to_filename(scalar)
+    nib.Nifti1Image(rng.normal(size=(6, 7, 8, 3)), np.eye(4)).to_filename(multi_volume)
+    metric_images = {"a": metric_image, "b": multi_volume, "c": scalar}
+    result = parcellate_metrics(atlas_entities, metric_images, AVAILABLE_MEASURES)
+    assert result["metric"].tolist() == ["a"] * 5 + ["b"] * 5 + ["c"] * 5
+    for metric, image in metric_images.items():
+        expected = parcellate_measures(atlas_entities, image, AVAILABLE_MEASURES)
+        for measure_name in AVAILABLE_MEASURES:
+            np.testing.assert_allclose(
+                result.loc[result["metric"] == metric, measure_name],
+                expected[measure_name],
+                rtol=1e-6,
+            )
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+@pytest.mark.parametrize("regions", [[1, 2], [1, 2, 3, 4, 8]])
+def test_parcellate_to_file_recomputes_stale_tables(
+    atlas_entities, metric_image, tmp_path, monkeypatch, regions
+):
+    """
+    Test that a table built from other regions (even as many) is recomputed
+    in full, once, rather than completed with the missing measures alone.
+    """
+    computed = []
+
+    def recording_parcellate_measures(atlas_entities, metric_image, measures, *args):
+        computed.append(list(measures))
+        return parcellate_measures(atlas_entities, metric_image, measures, *args)
+
+    monkeypatch.setattr(
+        "neuroflow.parcellation.utils.parcellate_measures",
+        recording_parcellate_measures,
+    )
+    out_file = tmp_path / "parc.pkl"
+    stale = pd.DataFrame({"index": regions, "nanmean": 0.0})
+    stale.to_pickle(out_file)
+    measures = {key: AVAILABLE_MEASURES[key] for key in ["nanmean", "nanmedian"]}
+    parcellate_to_file(atlas_entities, metric_image, out_file, measures)
+    assert computed == [["nanmean", "nanmedian"]]
+    result = pd.read_pickle(out_file)
+    expected = parcellate_measures(atlas_entities, metric_image, measures)
+    pd.testing.assert_frame_equal(result, expected)
+    stale.assign(metric="fa").to_pickle(out_file)
+    parcellate_metrics_to_file(atlas_entities, {"fa": metric_image}, out_file, measures)
+    pd.testing.assert_frame_equal(
+        pd.read_pickle(out_file),
+        parcellate_metrics(atlas_entities, {"fa": metric_image}, measures),
+    )
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+@pytest.mark.parametrize("dtype", [np.float32, np.float64])
+def test_measure_kernels_match_measures(dtype):
+    """
+    Test that the shared-partition kernels match the measures exactly.
+    """
+    rng = np.random.default_rng(7)
+    kernels = MeasureKernels(AVAILABLE_MEASURES)
+    for size in [0, 1, 2, 5, 10, 11, 41]:
+        data = rng.normal(size=(size, 3)).astype(dtype)
+        expected = [measure(data, axis=0) for measure in AVAILABLE_MEASURES.values()]
+        for result, value in zip(kernels.reduce(data, nan_free=True, axis=0), expected):
+            np.testing.assert_array_equal(result, value)
+        vector = data[:, 0].copy()
+        vector[: size // 3] = np.nan
+        expected = [measure(vector) for measure in AVAILABLE_MEASURES.values()]
+        for result, value in zip(kernels.reduce(vector), expected):
+            np.testing.assert_array_equal(result, value)
+
+
+def build_managers(dwi_atlases: dict, metric_images: dict):
+    """
+    Build minimal tensors and atlases managers for the Parcellation class.
+    """
+    tensors_manager = SimpleNamespace(
+        mapper=SimpleNamespace(subject="0001", session="1"),
+        outputs=metric_images,
+        max_bvalue=1000,
+        software="dipy",
+    )
+    atlases_manager = SimpleNamespace(dwi_atlases=dwi_atlases, label="GM")
+    return tensors_manager, atlases_manager
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+def test_parcellation_computes_missing_measures(
+    atlas_entities, metric_image, tmp_path, monkeypatch
+):
+    """
+    Test that only missing measures are computed for existing outputs.
+    """
+    mapper = SimpleNamespace(subject="0001", session="1")
+    tensors_manager = SimpleNamespace(
+        mapper=mapper,
+        outputs={"fa": metric_image},
+        max_bvalue=1000,
+        software="dipy",
+    )
+    atlases_manager = SimpleNamespace(dwi_atlases={"atlas": atlas_entities}, label="GM")
+    computed = []
+
+    def recording_parcellate_measures(atlas_entities, metric_image, measures, *args):
+        computed.append(list(measures))
+        return parcellate_measures(atlas_entities, metric_image, measures, *args)
+
+    monkeypatch.setattr(
+        "neuroflow.parcellation.utils.parcellate_measures",
+        recording_parcellate_measures,
+    )
+    kwargs = {
+        "tensors_manager": tensors_manager,
+        "atlases_manager": atlases_manager,
+        "output_directory": tmp_path / "out",
+    }
+    outputs = Parcellation(measures="nanmean", **kwargs).run()
+    outputs = Parcellation(measures=["nanmean", "nanmedian"], **kwargs).run()
+    assert computed == [["nanmean"], ["nanmedian"]]
+    result = pd.read_pickle(outputs["atlas"]["fa"])
+    expected = parcellate_measures(atlas_entities, metric_image, AVAILABLE_MEASURES)
+    for measure_name in ["nanmean", "nanmedian"]:
+        np.testing.assert_allclose(result[measure_name], expected[measure_name])
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+@pytest.mark.parametrize("stack_metrics", [False, True])
+def test_parcellation_parallel_matches_serial(
+    atlas_entities, metric_image, tmp_path, stack_metrics, monkeypatch
+):
+    """
+    Test that the process-pool execution matches the serial one.
+    """
+    tensors_manager, atlases_manager = build_managers(
+        {"first": atlas_entities, "second": atlas_entities},
+        {"fa": metric_image, "md": metric_image},
+    )
+    outputs = {}
+    for nthreads in [1, 2]:
+        outputs[nthreads] = Parcellation(
+            tensors_manager=tensors_manager,
+            atlases_manager=atlases_manager,
+            output_directory=tmp_path / f"out-{nthreads}",
+            stack_metrics=stack_metrics,
+            nthreads=nthreads,
+        ).run()
+    for atlas_name, out_files in outputs[1].items():
+        for metric, out_file in out_files.items():
+            parallel_file = outputs[2][atlas_name][metric]
+            assert parallel_file.name == out_file.name
+            pd.testing.assert_frame_equal(
+                pd.read_pickle(parallel_file), pd.read_pickle(out_file)
+            )
+
+    def unexpected_decompression(*args):
+        raise AssertionError("The metric images were decompressed.")
+
+    monkeypatch.setattr(Parcellation, "_shared_metric_images", unexpected_decompression)
+    assert (
+        Parcellation(
+            tensors_manager=tensors_manager,
+            atlases_manager=atlases_manager,
+            output_directory=tmp_path / "out-2",
+            stack_metrics=stack_metrics,
+            nthreads=2,
+        ).run()
+        == outputs[2]
+    )
+
+
+@pytest.mark.filterwarnings("ignore::RuntimeWarning")
+@pytest.mark.parametrize("output_format", ["parquet", "feather"])
+def test_parcellation_store(atlas_entities, metric_image, tmp_path, output_format):
+    """
+    Test that the columnar store holds every parcellation of a session and
+    that only missing measures are computed.
+    """
+    pytest.importorskip("pyarrow")
+    from neuroflow.parcellation.store import ParcellationStore
+
+    tensors_manager, atlases_manager = build_managers(
+        {"first": atlas_entities, "second": atlas_entities},
+        {"fa": metric_image, "md": metric_image},
+    )
+    kwargs = {
+        "tensors_manager": tensors_manager,
+        "atlases_manager": atlases_manager,
+        "output_directory": tmp_path / "out",
+        "output_format": output_format,
+    }
+    outputs = Parcellation(measures="nanmean", **kwargs).run()
+    out_file = outputs["first"]["fa"]
+    assert {path for paths in outputs.values() for path in paths.values()} == {out_file}
+    store = ParcellationStore(out_file, output_format)
+    assert len(store.contents()) == 2 * 2
+    out_file = Parcellation(
+        measures=["nanmean", "nanmedian"], nthreads=2, **kwargs
+    ).run_store()
+    assert len(store.contents()) == 2 * 2 * 2
+    data = store.read()
+    assert len(data) == 2 * 2 * 2 * 5
+    assert set(data["software"]) == {"dipy"}
+    expected = parcellate_measures(atlas_entities, metric_image, AVAILABLE_MEASURES)
+    for measure_name in ["nanmean", "nanmedian"]:
+        rows = data[(data["atlas"] == "second") & (data["metric"] == "md")]
+        rows = rows[rows["measure"] == measure_name]
+        np.testing.assert_allclose(rows["value"], expected[measure_name], rtol=1e-6)
+    dataset = ParcellationStore.dataset(tmp_path / "out", output_format)
+    assert dataset.count_rows() == len(data)
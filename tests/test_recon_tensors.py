@@ -0,0 +1,187 @@
+"""
+This file contains the tests for the recon_tensors module.
+"""
+
+import json
+import os
+import shutil
+from types import SimpleNamespace
+
+import nibabel as nib
+import numpy as np
+import pytest
+from dipy.core.gradients import gradient_table
+from dipy.reconst.dti import TensorModel
+from dipy.sims.voxel import multi_tensor
+
+from neuroflow.files_mapper.files_mapper import FilesMapper
+from neuroflow.recon_tensors import recon_tensors as recon_tensors_module
+from neuroflow.recon_tensors.dipy import dipy_tensors as dipy_module
+from neuroflow.recon_tensors.dipy.dipy_tensors import DipyTensors
+from neuroflow.recon_tensors.native.fitting import FIT_METHODS, fit_tensors
+from neuroflow.recon_tensors.native.native_tensors import NativeTensors
+
+
+@pytest.fixture
+def mapper(tmp_path):
+    """
+    Build a session with the inputs of the tensor reconstruction.
+    """
+    patterns = {
+        "dwi_file": "dwi.nii.gz",
+        "bval_file": "bvals",
+        "bvec_file": "bvecs",
+        "b0_brain_mask": "mask.nii.gz",
+    }
+    (tmp_path / "patterns.json").write_text(json.dumps(patterns))
+    session_dir = tmp_path / "data" / "0001" / "1"
+    session_dir.mkdir(parents=True)
+    for name in patterns.values():
+        (session_dir / name).write_text("0 1000 1000")
+    return FilesMapper(session_dir, patterns=tmp_path / "patterns.json")
+
+
+@pytest.fixture
+def extractions(monkeypatch):
+    """
+    Replace MRtrix3's dwiextract with a copy of the DWI and gradients.
+    """
+    extracted = []
+
+    class StubExtract:
+        def __init__(self):
+            self.inputs = SimpleNamespace()
+
+        def run(self):
+            inputs = self.inputs
+            extracted.append(inputs.in_file)
+            shutil.copy(inputs.in_file, inputs.out_file)
+            shutil.copy(inputs.grad_fsl[0], inputs.out_bvec)
+            shutil.copy(inputs.grad_fsl[1], inputs.out_bval)
+
+    monkeypatch.setattr(recon_tensors_module, "DWIExtract", StubExtract)
+    return extracted
+
+
+def test_dipy_tensors_fingerprint(mapper, extractions, tmp_path, monkeypatch):
+    """
+    Test that the tensors are only fitted when their inputs change, from a
+    fresh extraction of the changed inputs.
+    """
+    fits = []
+
+    class StubFlow:
+        def run(self, **kwargs):
+            fits.append(kwargs["fit_method"])
+            with open(kwargs["input_files"]) as f:
+                fitted_dwis.append(f.read())
+            for key, value in kwargs.items():
+                if key.startswith("out_") and key != "out_dir":
+                    with open(value, "w") as f:
+                        f.write(key)
+
+    fitted_dwis = []
+    monkeypatch.setattr(dipy_module, "ReconstDtiFlow", StubFlow)
+    tensors = DipyTensors(mapper, tmp_path / "output")
+    outputs = tensors.run()
+    assert all(output.exists() for output in outputs.values())
+    assert tensors.outputs == outputs
+    assert tensors.run() == outputs
+    assert len(fits) == 1
+    bvals = mapper.files["bval_file"]
+    stat = bvals.stat()
+    os.utime(bvals, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    _ = tensors.outputs
+    assert len(fits) == 2
+    assert len(extractions) == 2
+    tensors.fit_method = "WLS"
+    _ = tensors.outputs
+    assert fits == ["NLLS", "NLLS", "WLS"]
+    # refitting keeps the cropped signal the other software share
+    assert len(extractions) == 2
+    assert all(path.exists() for path in tensors.cropped_files().values())
+    dwi = mapper.files["dwi_file"]
+    dwi.write_text("changed")
+    stat = dwi.stat()
+    os.utime(dwi, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    _ = tensors.outputs
+    assert len(extractions) == 3
+    assert fitted_dwis[-1] == "changed"
+    # outputs of earlier versions, without fingerprints, are kept
+    tensors.fingerprint_file.unlink()
+    tensors.crop_fingerprint_file.unlink()
+    assert tensors.run() == outputs
+    assert len(fits) == 4
+    assert tensors.fingerprint_file.exists()
+    assert tensors.filtered_files == tensors.cropped_files()
+    assert len(extractions) == 3
+    assert tensors.crop_fingerprint_file.exists()
+
+
+@pytest.mark.parametrize("fit_method", FIT_METHODS)
+def test_native_tensors(mapper, extractions, tmp_path, fit_method):
+    """
+    Test that the native fitter matches dipy's tensor model.
+    """
+    rng = np.random.default_rng(0)
+    bvecs = rng.normal(size=(20, 3))
+    bvecs = np.vstack(
+        [np.zeros((2, 3)), bvecs / np.linalg.norm(bvecs, axis=1)[:, None]]
+    )
+    bvals = np.r_[0, 0, np.full(20, 1000)]
+    gtab = gradient_table(bvals, bvecs=bvecs)
+    evals = np.array([[1.7e-3, 3e-4, 3e-4], [1e-3, 8e-4, 6e-4]])
+    data = np.zeros((3, 3, 2, len(bvals)))
+    for index in np.ndindex(data.shape[:3]):
+        data[index], _ = multi_tensor(
+            gtab,
+            evals[[index[2]]],
+            S0=1000,
+            angles=[(rng.uniform(0, 180), rng.uniform(0, 360))],
+            fractions=[100],
+            snr=50,
+        )
+    mask = np.ones(data.shape[:3], dtype=np.uint8)
+    mask[0, 0, 0] = 0
+    nib.save(nib.Nifti1Image(mask, np.eye(4)), mapper.files["b0_brain_mask"])
+    nib.save(nib.Nifti1Image(data, np.eye(4)), mapper.files["dwi_file"])
+    np.savetxt(mapper.files["bval_file"], bvals[None], fmt="%d")
+    np.savetxt(mapper.files["bvec_file"], bvecs.T)
+    tensors = NativeTensors(
+        mapper, tmp_path / "output", fit_method=fit_method, chunk_size=4, nthreads=2
+    )
+    outputs = tensors.run()
+    assert list(outputs) == DipyTensors.OUTPUTS
+    loaded = {key: nib.load(path).get_fdata() for key, path in outputs.items()}
+    assert loaded["evec"].shape == data.shape[:3] + (3, 3)
+    assert loaded["tensor"].shape == data.shape[:3] + (1, 6)
+    assert loaded["fa"][0, 0, 0] == 0
+    reference = TensorModel(gtab, fit_method=fit_method).fit(data, mask=mask > 0)
+    for key in ["fa", "md", "ad", "rd"]:
+        np.testing.assert_allclose(
+            loaded[key], getattr(reference, key), rtol=1e-4, atol=1e-7
+        )
+    mtime = outputs["fa"].stat().st_mtime_ns
+    assert tensors.run() == outputs
+    assert outputs["fa"].stat().st_mtime_ns == mtime
+
+
+def test_fit_tensors_min_signal():
+    """
+    Test that non-positive signals are clipped to the smallest positive signal
+    of every masked voxel, whichever chunk it is in.
+    """
+    rng = np.random.default_rng(0)
+    bvecs = rng.normal(size=(8, 3))
+    bvecs /= np.linalg.norm(bvecs, axis=1)[:, None]
+    bvals = np.r_[0, np.full(7, 1000)]
+    data = rng.uniform(100, 1000, size=(4, 3, 2, 8))
+    data[0, 0, 0, 3] = 0
+    data[3, 2, 1, 5] = 7
+    mask = np.ones(data.shape[:3], dtype=bool)
+    expected = fit_tensors(data, mask, bvals, bvecs, min_signal=7.0)
+    for chunk_size in [5, 24]:
+        fitted = fit_tensors(data, mask, bvals, bvecs, chunk_size=chunk_size)
+        np.testing.assert_allclose(
+            fitted["lower_triangular"], expected["lower_triangular"]
+        )